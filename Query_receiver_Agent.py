@@ -5,6 +5,10 @@ from openai import AzureOpenAI
 from dotenv import load_dotenv
 from typing import List, Dict
 
+import async_clients
+from telemetry import record_usage
+from deadlines import timeout_kwargs
+
 load_dotenv()
 
 logger = logging.getLogger("query_generator")
@@ -33,18 +37,8 @@ RESPONSE_FORMAT_EXAMPLE = json.dumps({
     "queries": ["sub query 1", "sub query 2", "sub query 3"]
 }, indent=2)
 
-def query_generator(user_query: str) -> str:
-    """
-    Generates structured sub-queries from a complex user query using Azure OpenAI.
-
-    Args:
-        user_query: A string containing the user's question.
-
-    Returns:
-        A stringified JSON containing the list of sub-queries.
-    """
-    try:
-        prompt = f"""
+def build_prompt(user_query: str) -> str:
+    return f"""
         System Prompt:
                 - If the user query is related to attendance and it cannot be broken down into smaller meaningful parts, return the original question as a single-item list.
                 - If the user query is related to attendance and it can be decomposed, break it into distinct, concise sub-queries. Each sub-query must focus on a single topic or request.
@@ -62,16 +56,58 @@ def query_generator(user_query: str) -> str:
         Question:
         {user_query}"""
 
+COMPLETION_PARAMS = dict(
+    model=DEPLOYMENT,
+    max_tokens=800,
+    temperature=0.3,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+)
+
+def query_generator(user_query: str) -> str:
+    """
+    Generates structured sub-queries from a complex user query using Azure OpenAI.
+
+    Args:
+        user_query: A string containing the user's question.
+
+    Returns:
+        A stringified JSON containing the list of sub-queries.
+    """
+    try:
         response = azure_client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}],
-            model=DEPLOYMENT,
-            max_tokens=800,
-            temperature=0.3,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
+            messages=[{"role": "system", "content": build_prompt(user_query)}],
+            **COMPLETION_PARAMS
+        )
+
+        record_usage(response.usage)
+        result = response.choices[0].message.content.strip()
+        logger.info("Query decomposition succeeded for user input: %s", user_query)
+        return result
+
+    except Exception as e:
+        logger.exception("Error during query generation for user input '%s': %s", user_query, str(e))
+        return json.dumps({"queries": []})
+
+async def query_generator_async(user_query: str) -> str:
+    """
+    Async variant of ``query_generator`` on the shared async client.
+
+    Args:
+        user_query: A string containing the user's question.
+
+    Returns:
+        A stringified JSON containing the list of sub-queries.
+    """
+    try:
+        response = await async_clients.get_chat_client().chat.completions.create(
+            messages=[{"role": "system", "content": build_prompt(user_query)}],
+            **COMPLETION_PARAMS,
+            **timeout_kwargs()
         )
 
+        record_usage(response.usage)
         result = response.choices[0].message.content.strip()
         logger.info("Query decomposition succeeded for user input: %s", user_query)
         return result
@@ -80,7 +116,7 @@ def query_generator(user_query: str) -> str:
         logger.exception("Error during query generation for user input '%s': %s", user_query, str(e))
         return json.dumps({"queries": []})
 
-print(query_generator("list all cases"))
+# print(query_generator("list all cases"))
 
 """You are a query decomposition tool.
             Instructions:
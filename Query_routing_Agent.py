@@ -4,6 +4,10 @@ import logging
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 
+import async_clients
+from telemetry import record_usage
+from deadlines import timeout_kwargs
+
 load_dotenv()
 
 logging.basicConfig(
@@ -34,18 +38,8 @@ response_format = """return the name of the selected knowledge base.
                   }"""
 
 
-def agent_model(user_query: str) -> str:
-    """
-    Determines the appropriate knowledge base for a given query using Azure OpenAI.
-
-    Args:
-        user_query (str): User's input question.
-
-    Returns:
-        str: A JSON-formatted string indicating the selected knowledge base.
-    """
-    try:
-        prompt = f"""
+def build_prompt(user_query: str) -> str:
+    return f"""
         System Prompt:
                 - You are an Agent responsible for selecting the most appropriate Knowledge Base (KB) to use for retrieving context for a Retrieval-Augmented Generation (RAG) system.
 
@@ -68,16 +62,58 @@ def agent_model(user_query: str) -> str:
                   {user_query}
         """
 
+COMPLETION_PARAMS = dict(
+    max_completion_tokens=800,
+    temperature=0.3,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+    model=DEPLOYMENT_NAME
+)
+
+def agent_model(user_query: str) -> str:
+    """
+    Determines the appropriate knowledge base for a given query using Azure OpenAI.
+
+    Args:
+        user_query (str): User's input question.
+
+    Returns:
+        str: A JSON-formatted string indicating the selected knowledge base.
+    """
+    try:
         response = client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}],
-            max_completion_tokens=800,
-            temperature=0.3,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model=DEPLOYMENT_NAME
+            messages=[{"role": "system", "content": build_prompt(user_query)}],
+            **COMPLETION_PARAMS
+        )
+
+        record_usage(response.usage)
+        reply = response.choices[0].message.content
+        logging.info(f"Agent model selected case_category: {reply}")
+        return reply
+
+    except Exception as e:
+        logging.exception(f"500: Error in agent_model - {e}")
+        return json.dumps({"case_category": "Undecided"})
+
+async def agent_model_async(user_query: str) -> str:
+    """
+    Async variant of ``agent_model`` on the shared async client.
+
+    Args:
+        user_query (str): User's input question.
+
+    Returns:
+        str: A JSON-formatted string indicating the selected knowledge base.
+    """
+    try:
+        response = await async_clients.get_chat_client().chat.completions.create(
+            messages=[{"role": "system", "content": build_prompt(user_query)}],
+            **COMPLETION_PARAMS,
+            **timeout_kwargs()
         )
 
+        record_usage(response.usage)
         reply = response.choices[0].message.content
         logging.info(f"Agent model selected case_category: {reply}")
         return reply
@@ -5,6 +5,9 @@ from openai import AzureOpenAI
 from dotenv import load_dotenv
 from typing import List, Dict
 
+import async_clients
+from telemetry import record_usage
+
 load_dotenv()
 
 logger = logging.getLogger("query_generator")
@@ -35,18 +38,8 @@ RESPONSE_FORMAT_EXAMPLE = json.dumps({
     "Summarize":" Summary of the validation and improvements"
 }, indent=2)
 
-def Result_validation(user_query: str, context: List, LLMRes: str) -> str:
-    """
-    Generates structured sub-queries from a complex user query using Azure OpenAI.
-
-    Args:
-        user_query: A string containing the user's question.
-
-    Returns:
-        A stringified JSON containing the list of sub-queries.
-    """
-    try:
-        prompt = f"""
+def build_prompt(user_query: str, context: List, LLMRes: str) -> str:
+    return f"""
                 You are an expert AI response critic. Your task is to critically evaluate whether the answer provided by another AI is accurate, complete, and relevant based on the given context and question.
                     Carefully read the Question, Context, and the LLM Response.
 
@@ -69,20 +62,152 @@ def Result_validation(user_query: str, context: List, LLMRes: str) -> str:
 
                 """
 
+COMPLETION_PARAMS = dict(
+    model=DEPLOYMENT,
+    max_tokens=800,
+    temperature=0.3,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+)
+
+def Result_validation(user_query: str, context: List, LLMRes: str) -> str:
+    """
+    Generates structured sub-queries from a complex user query using Azure OpenAI.
+
+    Args:
+        user_query: A string containing the user's question.
+
+    Returns:
+        A stringified JSON containing the list of sub-queries.
+    """
+    try:
         response = azure_client.chat.completions.create(
-            messages=[{"role": "system", "content": prompt}],
-            model=DEPLOYMENT,
-            max_tokens=800,
-            temperature=0.3,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
+            messages=[{"role": "system", "content": build_prompt(user_query, context, LLMRes)}],
+            **COMPLETION_PARAMS
+        )
+
+        record_usage(response.usage)
+        result = response.choices[0].message.content.strip()
+        logger.info("Query validation succeeded for user input: %s", user_query)
+        return result
+
+    except Exception as e:
+        logger.exception("Error during query validation for user input '%s': %s", user_query, str(e))
+        return json.dumps({"queries": []})
+
+async def Result_validation_async(user_query: str, context: List, LLMRes: str) -> str:
+    """
+    Async variant of ``Result_validation`` on the shared async client.
+
+    Args:
+        user_query: A string containing the user's question.
+        context: Context the answer was generated from.
+        LLMRes: The answer to critique.
+
+    Returns:
+        A stringified JSON critique.
+    """
+    try:
+        response = await async_clients.get_chat_client().chat.completions.create(
+            messages=[{"role": "system", "content": build_prompt(user_query, context, LLMRes)}],
+            **COMPLETION_PARAMS
         )
 
+        record_usage(response.usage)
         result = response.choices[0].message.content.strip()
         logger.info("Query validation succeeded for user input: %s", user_query)
         return result
 
     except Exception as e:
         logger.exception("Error during query validation for user input '%s': %s", user_query, str(e))
-        return json.dumps({"queries": []})
\ No newline at end of file
+        return json.dumps({"queries": []})
+
+
+BATCH_RESPONSE_FORMAT_EXAMPLE = json.dumps({
+    "evaluations": [
+        {"id": 0, "Validation": "Good/Average/bad", "Improvements": "List of suggestions", "Summarize": "Summary"}
+    ]
+}, indent=2)
+
+# Per-item context budget in batched critiques, so one prompt stays a reasonable size.
+VALIDATION_CONTEXT_CHARS = int(os.getenv("VALIDATION_CONTEXT_CHARS", "4000"))
+
+def build_batch_prompt(items: List[Dict]) -> str:
+    cases = "\n".join(
+        f"""
+                    Case {i}:
+                    Question:
+                    {item["user_query"]}
+
+                    Context:
+                    {str(item["context"])[:VALIDATION_CONTEXT_CHARS]}
+
+                    LLM Response:
+                    {item["result"]}
+"""
+        for i, item in enumerate(items)
+    )
+    return f"""
+                You are an expert AI response critic. For each case below, critically evaluate whether the answer provided by another AI is accurate, complete, and relevant based on the given context and question.
+                    Judge every case independently and only against its own context.
+                    {cases}
+                    Now give your evaluation of every case, identified by its case number, in this format.
+                    {BATCH_RESPONSE_FORMAT_EXAMPLE}
+
+                """
+
+def _parse_batch(reply: str, count: int) -> List[Dict]:
+    evaluations = json.loads(reply).get("evaluations", [])
+    by_id = {int(evaluation.get("id", -1)): evaluation for evaluation in evaluations}
+    return [by_id.get(i) for i in range(count)]
+
+def Result_validation_batch(items: List[Dict]) -> List[Dict]:
+    """
+    Critiques several answers in one completion.
+
+    Args:
+        items: Dicts with "user_query", "context" and "result".
+
+    Returns:
+        One critique dict per item, in order; None where the model gave no usable verdict.
+    """
+    try:
+        response = azure_client.chat.completions.create(
+            messages=[{"role": "system", "content": build_batch_prompt(items)}],
+            response_format={"type": "json_object"},
+            **{**COMPLETION_PARAMS, "max_tokens": 400 * len(items)}
+        )
+        record_usage(response.usage)
+        evaluations = _parse_batch(response.choices[0].message.content, len(items))
+        logger.info("Batch validation succeeded for %d answers", len(items))
+        return evaluations
+
+    except Exception as e:
+        logger.exception("Error during batch validation of %d answers: %s", len(items), str(e))
+        return [None] * len(items)
+
+async def Result_validation_batch_async(items: List[Dict]) -> List[Dict]:
+    """
+    Async variant of ``Result_validation_batch`` on the shared async client.
+
+    Args:
+        items: Dicts with "user_query", "context" and "result".
+
+    Returns:
+        One critique dict per item, in order; None where the model gave no usable verdict.
+    """
+    try:
+        response = await async_clients.get_chat_client().chat.completions.create(
+            messages=[{"role": "system", "content": build_batch_prompt(items)}],
+            response_format={"type": "json_object"},
+            **{**COMPLETION_PARAMS, "max_tokens": 400 * len(items)}
+        )
+        record_usage(response.usage)
+        evaluations = _parse_batch(response.choices[0].message.content, len(items))
+        logger.info("Batch validation succeeded for %d answers", len(items))
+        return evaluations
+
+    except Exception as e:
+        logger.exception("Error during batch validation of %d answers: %s", len(items), str(e))
+        return [None] * len(items)
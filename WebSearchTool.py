@@ -1,16 +1,246 @@
+"""
+DuckDuckGo web search with reused sessions, a per-call deadline and a result cache.
+
+Searches run on a small dedicated thread pool, and every worker thread keeps its own
+long-lived ``DDGS`` session. Several sub-queries are therefore searched concurrently
+without paying a new session handshake per call. ``DDGS.text`` returns its results all
+at once, so a search that misses the deadline returns no results; it keeps running in
+the background and still fills the cache. Completed searches are cached by normalized
+query for WEB_SEARCH_CACHE_TTL seconds, and identical searches already in flight are
+shared until their own deadline has passed.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Sequence, Tuple
+
 from duckduckgo_search import DDGS
 
+from deadlines import remaining
+
+logger = logging.getLogger("web_search")
+
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "4"))
+WEB_SEARCH_MAX_WORKERS = int(os.getenv("WEB_SEARCH_MAX_WORKERS", "4"))
+WEB_SEARCH_CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", "3600"))
+WEB_SEARCH_CACHE_SIZE = int(os.getenv("WEB_SEARCH_CACHE_SIZE", "1024"))
+WEB_SEARCH_REGION = os.getenv("WEB_SEARCH_REGION", "wt-wt")
+
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", str(query).strip().lower())
+    return query.rstrip(" ?!.")
+
+
+class WebSearcher:
+    """
+    Bounded-latency DuckDuckGo text search.
+
+    Usage:
+        searcher = WebSearcher()
+        results = searcher.search("CEO of google")                   # [{'title', 'href', 'body'}, ...]
+        results = await searcher.search_async("CEO of google")
+        batches = await searcher.search_many_async(["q1", "q2"])   # searched concurrently
+    """
+
+    def __init__(
+        self,
+        timeout: float = WEB_SEARCH_TIMEOUT,
+        max_workers: int = WEB_SEARCH_MAX_WORKERS,
+        cache_ttl: float = WEB_SEARCH_CACHE_TTL,
+        cache_size: int = WEB_SEARCH_CACHE_SIZE,
+        region: str = WEB_SEARCH_REGION,
+        safesearch: str = "moderate",
+    ):
+        """
+        Args:
+            timeout: Per-call deadline in seconds; the caller never waits longer.
+            max_workers: Searches run concurrently (one DDGS session per worker).
+            cache_ttl: Seconds a completed search is served from the cache.
+            cache_size: Number of cached queries kept, least recently used evicted first.
+        """
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.region = region
+        self.safesearch = safesearch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web-search")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Tuple[float, int, List[Dict]]]" = OrderedDict()
+        self._flights: Dict[Tuple[str, int], Future] = {}
+
+        self.searches = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    # ------------------------------------------------------------------ sessions
+
+    def _session(self) -> DDGS:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = DDGS(timeout=max(1, int(self.timeout + 0.999)))
+        return session
+
+    def _fetch(self, query: str, no_result: int) -> List[Dict]:
+        """Runs on a worker thread."""
+        try:
+            hits = self._session().text(query, region=self.region, safesearch=self.safesearch, max_results=no_result)
+        except Exception as e:
+            # A failed session may be in a bad state; the next search on this thread opens a new one.
+            self._local.session = None
+            with self._lock:
+                self.errors += 1
+            logger.warning("Web search failed for %r: %s", query, e)
+            raise
+        return [{'title': r.get('title'), 'href': r.get('href'), 'body': r.get('body')} for r in hits[:no_result]]
+
+    # ------------------------------------------------------------------ cache
+
+    def _cache_get(self, key: str, no_result: int) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, requested, results = entry
+            # A cached search that asked for fewer hits than now wanted cannot answer for it.
+            if expires < time.monotonic() or (requested < no_result and len(results) >= requested):
+                return None
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return results[:no_result]
+
+    def _cache_put(self, key: str, no_result: int, results: List[Dict]):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, no_result, list(results))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ------------------------------------------------------------------ search
+
+    def _start(self, query: str, no_result: int) -> Future:
+        """
+        Submits a search, or joins the identical one already in flight. A flight past
+        its deadline is not joined (a new caller would wait a full timeout on it again).
+        """
+        key = (normalize_query(query), no_result)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.deadline > time.monotonic():
+                return flight
+            self.searches += 1
+            flight = self._executor.submit(self._fetch, query, no_result)
+            flight.deadline = time.monotonic() + self.timeout
+            self._flights[key] = flight
+
+        def finished(future: Future):
+            with self._lock:
+                if self._flights.get(key) is future:
+                    del self._flights[key]
+            if not future.cancelled() and future.exception() is None:
+                self._cache_put(key[0], no_result, future.result())
+
+        flight.add_done_callback(finished)
+        return flight
+
+    def _late(self, query: str) -> List[Dict]:
+        with self._lock:
+            self.timeouts += 1
+        logger.warning("Web search for %r missed the %.1fs deadline; no results", query, self.timeout)
+        return []
+
+    def search(self, query: str, no_result: int = 10) -> List[Dict]:
+        """
+        Web results for ``query``, returned within ``timeout`` seconds.
+
+        Returns:
+            Up to ``no_result`` dicts with 'title', 'href' and 'body'; none when the
+            deadline passed or the search failed.
+        """
+        cached = self._cache_get(normalize_query(query), no_result)
+        if cached is not None:
+            return cached
+        flight = self._start(query, no_result)
+        try:
+            return list(flight.result(timeout=self.timeout))
+        except FutureTimeout:
+            return self._late(query)
+        except Exception:
+            return []
+
+    async def search_async(self, query: str, no_result: int = 10) -> List[Dict]:
+        """Async variant of ``search``; the event loop is never blocked."""
+        cached = self._cache_get(normalize_query(query), no_result)
+        if cached is not None:
+            return cached
+        flight = self._start(query, no_result)
+        try:
+            # Never past the request deadline, when there is one
+            timeout = min(self.timeout, remaining(self.timeout))
+            return list(await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), timeout))
+        except asyncio.TimeoutError:
+            return self._late(query)
+        except Exception:
+            return []
+
+    def search_many(self, queries: Sequence[str], no_result: int = 10) -> List[List[Dict]]:
+        """Searches several queries concurrently; the whole batch shares one deadline."""
+        started = [(query, self._cache_get(normalize_query(query), no_result)) for query in queries]
+        flights = [(query, cached) if cached is not None else (query, self._start(query, no_result)) for query, cached in started]
+        deadline = time.monotonic() + self.timeout
+        results = []
+        for query, flight in flights:
+            if isinstance(flight, list):
+                results.append(flight)
+                continue
+            try:
+                results.append(list(flight.result(timeout=max(0.0, deadline - time.monotonic()))))
+            except FutureTimeout:
+                results.append(self._late(query))
+            except Exception:
+                results.append([])
+        return results
+
+    async def search_many_async(self, queries: Sequence[str], no_result: int = 10) -> List[List[Dict]]:
+        return list(await asyncio.gather(*(self.search_async(query, no_result) for query in queries)))
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.searches + self.cache_hits
+        return {
+            "searches": self.searches,
+            "cache_hits": self.cache_hits,
+            "hit_rate": self.cache_hits / requests if requests else 0.0,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_searcher: Optional[WebSearcher] = None
+
+
+def get_web_searcher() -> WebSearcher:
+    global _searcher
+    if _searcher is None:
+        _searcher = WebSearcher()
+    return _searcher
+
+
 def search_DDG(query, no_result = 10):
-    results = []
-    with DDGS() as ddgs:
-        for r in ddgs.text(query, region="wt-wt", safesearch='moderate',max_results=no_result):
-            results.append(
-                {
-                    'title':r.get('title'),
-                    'href': r.get('href'),
-                    'body':r.get('body')
-                }
-            )
-            return results
-
-# print(search_DDG("CEO of google"))    
\ No newline at end of file
+    return get_web_searcher().search(query, no_result)
+
+
+async def search_DDG_async(query, no_result = 10):
+    return await get_web_searcher().search_async(query, no_result)
+
+# print(search_DDG("CEO of google"))
@@ -0,0 +1,288 @@
+"""
+Semantic answer cache for the chatbot.
+
+Answers are stored with the embedding of the question that produced them. A new
+question whose embedding is close enough (cosine similarity >= threshold) to a cached
+one is answered from the cache, skipping decomposition, routing, retrieval, generation
+and validation.
+
+Every entry is tagged with the knowledge bases it drew on and their index version at
+the time. ``bump_index_version`` (called by ingestion after it changes an index)
+evicts exactly the answers that used that KB; entries also expire after a TTL.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger("answer_cache")
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite3")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    kb_versions TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    cost_seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS answer_kbs (
+    answer_id INTEGER NOT NULL,
+    kb TEXT NOT NULL,
+    PRIMARY KEY (kb, answer_id)
+);
+CREATE TABLE IF NOT EXISTS index_versions (
+    kb TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(_SCHEMA)
+    db.commit()
+    return db
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def bump_index_version(kb: str, path: str = ANSWER_CACHE_PATH) -> int:
+    """
+    Record that ``kb`` was re-ingested and drop every cached answer that used it.
+
+    Safe to call from another process (e.g. the ingestion pipeline); running chatbots
+    notice the new version on their next lookup.
+
+    Returns:
+        The new index version.
+    """
+    db = _connect(path)
+    try:
+        db.execute(
+            "INSERT INTO index_versions (kb, version) VALUES (?, 1) "
+            "ON CONFLICT(kb) DO UPDATE SET version = version + 1",
+            (kb,),
+        )
+        ids = [row[0] for row in db.execute("SELECT answer_id FROM answer_kbs WHERE kb = ?", (kb,))]
+        db.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in ids])
+        db.executemany("DELETE FROM answer_kbs WHERE answer_id = ?", [(i,) for i in ids])
+        db.commit()
+        version = db.execute("SELECT version FROM index_versions WHERE kb = ?", (kb,)).fetchone()[0]
+    finally:
+        db.close()
+    logger.info("Index %s is now version %d; evicted %d cached answers", kb, version, len(ids))
+    return version
+
+
+class AnswerCache:
+    """Nearest-neighbour cache of final answers, keyed on the question embedding."""
+
+    def __init__(
+        self,
+        path: str = ANSWER_CACHE_PATH,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = _connect(path)
+
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+        # In-memory copy for the similarity scan: row i of _matrix belongs to _ids[i].
+        self._ids: List[int] = []
+        self._entries: Dict[int, dict] = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+    def _load(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+            self._db.execute("DELETE FROM answer_kbs WHERE answer_id NOT IN (SELECT id FROM answers)")
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT id, answer, vector, kb_versions, expires_at, cost_seconds FROM answers ORDER BY id"
+            ).fetchall()
+            vectors = []
+            for answer_id, answer, blob, kb_versions, expires_at, cost_seconds in rows:
+                values = array("f")
+                values.frombytes(blob)
+                vectors.append(_normalize(values))
+                self._ids.append(answer_id)
+                self._entries[answer_id] = {
+                    "answer": answer,
+                    "kb_versions": json.loads(kb_versions),
+                    "expires_at": expires_at,
+                    "cost_seconds": cost_seconds,
+                }
+            if vectors:
+                self._matrix = np.stack(vectors)
+
+    def _versions(self, kbs: Iterable[str]) -> Dict[str, int]:
+        kbs = list(kbs)
+        if not kbs:
+            return {}
+        placeholders = ",".join("?" * len(kbs))
+        rows = self._db.execute(
+            f"SELECT kb, version FROM index_versions WHERE kb IN ({placeholders})", kbs
+        ).fetchall()
+        versions = dict(rows)
+        return {kb: versions.get(kb, 0) for kb in kbs}
+
+    def versions(self) -> Dict[str, int]:
+        """
+        Current index version of every knowledge base. Taken before retrieval and passed
+        to ``store``, so ingestion that lands meanwhile makes the stored answer stale.
+        """
+        with self._lock:
+            return dict(self._db.execute("SELECT kb, version FROM index_versions").fetchall())
+
+    def _drop_locked(self, answer_ids: Sequence[int]):
+        if not answer_ids:
+            return
+        drop = set(answer_ids)
+        keep = [i for i, answer_id in enumerate(self._ids) if answer_id not in drop]
+        self._matrix = self._matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+        self._ids = [self._ids[i] for i in keep]
+        for answer_id in drop:
+            self._entries.pop(answer_id, None)
+        self._db.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in drop])
+        self._db.executemany("DELETE FROM answer_kbs WHERE answer_id = ?", [(i,) for i in drop])
+        self._db.commit()
+
+    def lookup(self, vector) -> Optional[str]:
+        """
+        Returns the cached answer for the nearest live stored question, or None if no
+        live entry is similar enough. Expired or stale entries met on the way are dropped.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            if not self._ids:
+                self.misses += 1
+                return None
+            scores = self._matrix @ _normalize(vector)
+            candidates = np.flatnonzero(scores >= self.threshold)
+            found, stale = None, []
+            for position in candidates[np.argsort(-scores[candidates])].tolist():
+                answer_id = self._ids[position]
+                entry = self._entries[answer_id]
+                if entry["expires_at"] > time.time():
+                    current = self._versions(entry["kb_versions"])
+                    if all(current[kb] == version for kb, version in entry["kb_versions"].items()):
+                        found = position
+                        break
+                stale.append(answer_id)
+            similarity = float(scores[found]) if found is not None else 0.0
+            self._drop_locked(stale)
+            if found is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.seconds_saved += max(entry["cost_seconds"] - (time.perf_counter() - started), 0.0)
+        logger.info("Answer cache hit (similarity %.3f)", similarity)
+        return entry["answer"]
+
+    def store(
+        self,
+        query: str,
+        vector,
+        answer: str,
+        kbs: Iterable[str],
+        cost_seconds: float,
+        versions: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Cache ``answer`` for ``query``.
+
+        Args:
+            query: The question as asked (kept for inspection only).
+            vector: Embedding of ``query``.
+            answer: Final answer returned to the user.
+            kbs: Knowledge bases whose content the answer was generated from.
+            cost_seconds: How long producing the answer took, for the latency-saved stat.
+            versions: ``versions()`` as read before the answer's retrieval ran; the
+                versions at store time when omitted.
+        """
+        now = time.time()
+        vector = _normalize(vector)
+        with self._lock:
+            if versions is None:
+                kb_versions = self._versions(set(kbs))
+            else:
+                kb_versions = {kb: versions.get(kb, 0) for kb in set(kbs)}
+            cursor = self._db.execute(
+                "INSERT INTO answers (query, answer, vector, kb_versions, created_at, expires_at, cost_seconds) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query, answer, array("f", vector.tolist()).tobytes(), json.dumps(kb_versions),
+                 now, now + self.ttl_seconds, cost_seconds),
+            )
+            answer_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO answer_kbs (answer_id, kb) VALUES (?, ?)", [(answer_id, kb) for kb in kb_versions]
+            )
+            self._db.commit()
+
+            if self._ids and self._matrix.shape[1] != vector.shape[0]:
+                # Embedding model changed: the old entries can never match again.
+                self._drop_locked(list(self._ids))
+            self._matrix = np.vstack([self._matrix, vector[None, :]]) if self._ids else vector[None, :]
+            self._ids.append(answer_id)
+            self._entries[answer_id] = {
+                "answer": answer,
+                "kb_versions": kb_versions,
+                "expires_at": now + self.ttl_seconds,
+                "cost_seconds": cost_seconds,
+            }
+            if len(self._ids) > self.max_entries:
+                self._drop_locked(self._ids[: len(self._ids) - self.max_entries])
+
+    def invalidate(self, kb: str) -> int:
+        """Bump ``kb``'s index version in this process; returns the new version."""
+        version = bump_index_version(kb, self.path)
+        with self._lock:
+            self._drop_locked([
+                answer_id for answer_id, entry in self._entries.items() if kb in entry["kb_versions"]
+            ])
+        return version
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "seconds_saved": self.seconds_saved,
+            "entries": len(self._ids),
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
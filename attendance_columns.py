@@ -0,0 +1,170 @@
+"""
+Columnar cache for the attendance sheet.
+
+The CSV is parsed once and stored as one memory-mapped NumPy file per column, plus a
+small JSON header holding the column index and the source file's mtime, size and
+sha256. Later lookups only stat the CSV and slice the requested column, so a tool call
+costs the same however large the sheet grows. A changed CSV (by mtime/size, confirmed
+by hash) is re-converted on the next lookup. Each conversion writes a new version
+directory and then switches ``meta.json`` to it atomically, so columns that callers
+still have mapped are never rewritten in place (Windows refuses to overwrite a mapped
+file; elsewhere a reader could see a half-written column).
+
+Layout (``<ATTENDANCE_CACHE_DIR>/<source-digest>/``):
+    meta.json               source stat + hash, row count, current version, column name -> file
+    <version>/col_<n>.npy   values of column n (numeric dtype where possible, else fixed-width unicode)
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ingest_manifest import file_sha256
+
+logger = logging.getLogger("attendance_columns")
+
+ATTENDANCE_CSV_PATH = os.getenv("ATTENDANCE_CSV_PATH", "C:/Users/junai/Codes/INextLabs/AgenticRag/KB/Attandance_sheet.csv")
+ATTENDANCE_CACHE_DIR = os.getenv("ATTENDANCE_CACHE_DIR", "attendance_cache")
+
+
+class ColumnarAttendance:
+    """Memory-mapped, per-column view of an attendance CSV."""
+
+    def __init__(self, csv_path: str = ATTENDANCE_CSV_PATH, cache_dir: str = ATTENDANCE_CACHE_DIR):
+        self.csv_path = Path(csv_path)
+        digest = hashlib.sha256(str(self.csv_path.resolve()).encode("utf-8")).hexdigest()[:16]
+        self.path = Path(cache_dir) / digest
+        self._meta_path = self.path / "meta.json"
+        self._lock = threading.Lock()
+        self._meta: Optional[Dict[str, Any]] = None
+        self._columns: Dict[str, np.ndarray] = {}
+        self.conversions = 0
+
+    # ------------------------------------------------------------------ cache
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        if not self._meta_path.exists():
+            return None
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _is_current(self, meta: Optional[Dict[str, Any]], stat: os.stat_result) -> bool:
+        if meta is None or "version" not in meta:
+            return False
+        if meta["mtime"] == stat.st_mtime and meta["size"] == stat.st_size:
+            return True
+        if meta["sha256"] != file_sha256(self.csv_path):
+            return False
+        # Touched but unchanged: remember the new stat so the hash is not recomputed
+        meta.update(mtime=stat.st_mtime, size=stat.st_size)
+        self._write_meta(meta)
+        return True
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        tmp = self._meta_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+
+    def _convert(self, stat: os.stat_result) -> Dict[str, Any]:
+        import pandas as pd
+
+        dataset = pd.read_csv(self.csv_path)
+        previous = (self._read_meta() or {}).get("version")
+        version = f"v{time.time_ns()}_{os.getpid()}"
+        (self.path / version).mkdir(parents=True)
+        files = {}
+        for position, column in enumerate(dataset.columns):
+            series = dataset[column]
+            if series.dtype.kind in "biuf":
+                values = series.to_numpy()
+            else:
+                values = series.fillna("").astype(str).to_numpy(dtype=str)
+            name = f"col_{position}.npy"
+            np.save(self.path / version / name, values)
+            files[str(column)] = name
+        meta = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": file_sha256(self.csv_path),
+            "rows": len(dataset),
+            "version": version,
+            "columns": files,
+        }
+        self._write_meta(meta)
+        self._remove_old_versions({version, previous})
+        self.conversions += 1
+        logger.info("Converted %s to columnar cache (%d rows, %d columns)", self.csv_path, len(dataset), len(files))
+        return meta
+
+    def _remove_old_versions(self, keep: set):
+        """
+        Deletes versions other than ``keep``. The previous version is kept too: another
+        process may have read the old meta.json and not yet mapped its columns. Best
+        effort: a version still mapped somewhere (Windows) is retried next time.
+        """
+        for entry in self.path.iterdir():
+            if entry.is_dir() and entry.name not in keep:
+                shutil.rmtree(entry, ignore_errors=True)
+        for entry in self.path.glob("col_*.npy"):
+            # Layout before versioned directories
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+
+    def _current_meta(self) -> Dict[str, Any]:
+        """Header for the up-to-date cache, converting the CSV first if it changed."""
+        stat = os.stat(self.csv_path)
+        with self._lock:
+            meta = self._meta
+            if meta is not None and meta["mtime"] == stat.st_mtime and meta["size"] == stat.st_size:
+                return meta
+            meta = self._read_meta()
+            if not self._is_current(meta, stat):
+                meta = self._convert(stat)
+            self._meta = meta
+            self._columns = {}
+            return meta
+
+    # ------------------------------------------------------------------ reads
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._current_meta()["columns"])
+
+    def column(self, name: str) -> Optional[np.ndarray]:
+        """Memory-mapped values of one column, or None if there is no such column."""
+        meta = self._current_meta()
+        file_name = meta["columns"].get(name)
+        if file_name is None:
+            return None
+        with self._lock:
+            values = self._columns.get(name)
+            if values is None:
+                values = self._columns[name] = np.load(self.path / meta["version"] / file_name, mmap_mode="r")
+            return values
+
+    def series(self, employee_id: str) -> Optional[List[Any]]:
+        """The employee's column as a list of Python values, or None if unknown."""
+        values = self.column(employee_id)
+        return None if values is None else values.tolist()
+
+
+_loaders: Dict[str, ColumnarAttendance] = {}
+
+
+def get_loader(csv_path: str = ATTENDANCE_CSV_PATH) -> ColumnarAttendance:
+    """Shared loader per CSV path, so the column index and memory maps are reused."""
+    loader = _loaders.get(csv_path)
+    if loader is None:
+        loader = _loaders[csv_path] = ColumnarAttendance(csv_path)
+    return loader
@@ -0,0 +1,368 @@
+"""
+Precomputed attendance rollups.
+
+Raw per-day attendance records (MongoDB ``attendance`` collection or the attendance
+CSV used by ``csv_accesss``) are folded into a materialized ``attendance_rollups``
+collection with per-employee aggregates at three grains:
+
+    day     one document per employee and date, with the normalized status
+    month   present / absent / leave / other counts and longest streaks for the month
+    year    the same for the calendar year
+
+Rollups are kept up to date incrementally by a background thread: only MongoDB records
+added since the stored watermark are read, in insertion order (``_id``, or the field
+named by ROLLUP_CHANGE_FIELD), so back-filled days are picked up too. CSV sheets are
+re-imported when their mtime changes. Only the months and years a batch touches are
+recomputed.
+Aggregate questions ("how many days was E004 absent last month") are answered from the
+rollups in a few lines, without waiting for a refresh; until the first build has
+finished, and for other attendance questions, the raw records are used.
+"""
+
+import os
+import re
+import sys
+import time
+import math
+import calendar
+import logging
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+import database_access
+from attendance_columns import get_loader
+from database_access import (
+    ATTENDANCE_DATE_FIELD,
+    ATTENDANCE_STATUS_FIELD,
+    MONGO_DB,
+    extract_date_range,
+    extract_employee_ids,
+)
+
+logger = logging.getLogger("attendance_rollups")
+
+ROLLUP_COLLECTION = os.getenv("ROLLUP_COLLECTION", "attendance_rollups")
+ROLLUP_REFRESH_SECONDS = float(os.getenv("ROLLUP_REFRESH_SECONDS", "300"))
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+# Raw-record field that grows with every insert (or update); ``_id`` is insertion order.
+ROLLUP_CHANGE_FIELD = os.getenv("ROLLUP_CHANGE_FIELD", "_id")
+
+STATUSES = ("present", "absent", "leave")
+_STATUS_ALIASES = {
+    "p": "present", "present": "present", "wfh": "present", "remote": "present", "1": "present",
+    "a": "absent", "absent": "absent", "0": "absent",
+    "l": "leave", "leave": "leave", "sick": "leave", "vacation": "leave", "holiday": "leave",
+}
+_AGGREGATE_QUESTION = re.compile(
+    r"\b(how many|count|number of|total|percent|percentage|rate|streak|summary|summar\w*|overall)\b",
+    re.IGNORECASE,
+)
+
+_META_ID = "__meta__"
+# Largest ROLLUP_CHANGE_FIELD value folded in (the older "mongo_watermark" held a date)
+_MONGO_WATERMARK = "mongo_change_watermark"
+_MONGO_REFRESHED = "mongo_refreshed_at"
+
+
+def normalize_status(value) -> str:
+    if value is None:
+        return "other"
+    if isinstance(value, float):
+        # A 1/0 column with blank cells is loaded as float (1.0, 0.0, nan)
+        if not math.isfinite(value):
+            return "other"
+        if value.is_integer():
+            value = int(value)
+    return _STATUS_ALIASES.get(str(value).strip().lower(), "other")
+
+
+def _to_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def is_aggregate_question(question: str) -> bool:
+    return bool(_AGGREGATE_QUESTION.search(str(question)))
+
+
+def summarize_days(days: Sequence[Tuple[str, str]]) -> Dict[str, int]:
+    """
+    Counts and longest streaks over (iso_date, status) pairs. Streaks run over
+    consecutive recorded days, so non-working days without a record do not break them.
+    """
+    summary = {status: 0 for status in STATUSES}
+    summary.update({"other": 0, "days": len(days), "longest_present_streak": 0, "longest_absent_streak": 0})
+    run_status, run = None, 0
+    for _, status in sorted(days):
+        summary[status] = summary.get(status, 0) + 1
+        run = run + 1 if status == run_status else 1
+        run_status = status
+        if status in ("present", "absent"):
+            key = f"longest_{status}_streak"
+            summary[key] = max(summary[key], run)
+    return summary
+
+
+class AttendanceRollups:
+    """Materialized attendance aggregates in a MongoDB collection."""
+
+    def __init__(self, client=None, collection=None):
+        """
+        Args:
+            client: MongoClient to use instead of the shared pooled one (e.g. mongomock).
+            collection: Rollup collection to use directly, overriding ``client``.
+        """
+        self.client = client
+        if collection is None:
+            collection = (client or database_access.get_client())[MONGO_DB][ROLLUP_COLLECTION]
+        self.collection = collection
+        self.collection.create_index(
+            [("emp_id", ASCENDING), ("period", ASCENDING), ("key", ASCENDING)], name="emp_period_key"
+        )
+
+    # ------------------------------------------------------------------ writes
+
+    def apply(self, records: Iterable[Tuple[str, object, object]]) -> int:
+        """
+        Fold raw (emp_id, date, status) records into the rollups.
+
+        Returns:
+            Number of day records written.
+        """
+        days: Dict[Tuple[str, str], str] = {}
+        for emp_id, day, status in records:
+            day = _to_date(day)
+            if not emp_id or day is None:
+                continue
+            days[(str(emp_id).upper(), day.isoformat())] = normalize_status(status)
+        if not days:
+            return 0
+
+        self.collection.bulk_write([
+            UpdateOne(
+                {"_id": f"{emp_id}:day:{key}"},
+                {"$set": {"emp_id": emp_id, "period": "day", "key": key, "status": status}},
+                upsert=True,
+            )
+            for (emp_id, key), status in days.items()
+        ], ordered=False)
+
+        months = {(emp_id, key[:7]) for emp_id, key in days}
+        years = {(emp_id, key[:4]) for emp_id, key in days}
+        for emp_id, month in sorted(months):
+            self._rollup(emp_id, "month", month)
+        for emp_id, year in sorted(years):
+            self._rollup(emp_id, "year", year)
+
+        self.collection.update_one({"_id": _META_ID}, {"$set": {"updated_at": time.time()}}, upsert=True)
+        logger.info("Rolled up %d day records (%d months, %d years)", len(days), len(months), len(years))
+        return len(days)
+
+    def _day_docs(self, emp_id: str, start: str, end: str) -> List[Tuple[str, str]]:
+        docs = self.collection.find(
+            {"emp_id": emp_id, "period": "day", "key": {"$gte": start, "$lte": end}},
+            {"_id": 0, "key": 1, "status": 1},
+        )
+        return [(doc["key"], doc["status"]) for doc in docs]
+
+    def _rollup(self, emp_id: str, period: str, key: str):
+        start, end = (f"{key}-01", f"{key}-31") if period == "month" else (f"{key}-01-01", f"{key}-12-31")
+        summary = summarize_days(self._day_docs(emp_id, start, end))
+        self.collection.update_one(
+            {"_id": f"{emp_id}:{period}:{key}"},
+            {"$set": {"emp_id": emp_id, "period": period, "key": key, **summary}},
+            upsert=True,
+        )
+
+    def watermark(self):
+        """Largest ROLLUP_CHANGE_FIELD value folded in from MongoDB, or None."""
+        meta = self.collection.find_one({"_id": _META_ID})
+        return meta.get(_MONGO_WATERMARK) if meta else None
+
+    def ready(self) -> bool:
+        """True once a MongoDB refresh has completed, so the rollups are complete up to it."""
+        meta = self.collection.find_one({"_id": _META_ID}, {_MONGO_REFRESHED: 1})
+        return bool(meta and meta.get(_MONGO_REFRESHED))
+
+    def refresh_from_mongo(self, client=None, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+        """
+        Fold in the raw records added since the watermark, oldest first. The watermark
+        is advanced after every batch, so an interrupted first build resumes.
+        """
+        raw = database_access.get_collection(client or self.client)
+        watermark = self.watermark()
+        # _id is unique; another change field may repeat its last value in a later insert
+        operator = "$gt" if ROLLUP_CHANGE_FIELD == "_id" else "$gte"
+        query = {} if watermark is None else {ROLLUP_CHANGE_FIELD: {operator: watermark}}
+        projection = {ROLLUP_CHANGE_FIELD: 1, "emp_id": 1, ATTENDANCE_DATE_FIELD: 1, ATTENDANCE_STATUS_FIELD: 1}
+        cursor = raw.find(query, projection).sort(ROLLUP_CHANGE_FIELD, ASCENDING).batch_size(batch_size)
+
+        written = 0
+        batch: List[dict] = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                written += self._apply_mongo_batch(batch)
+                batch = []
+        if batch:
+            written += self._apply_mongo_batch(batch)
+        self.collection.update_one({"_id": _META_ID}, {"$set": {_MONGO_REFRESHED: time.time()}}, upsert=True)
+        return written
+
+    def _apply_mongo_batch(self, docs: List[dict]) -> int:
+        written = self.apply(
+            (doc.get("emp_id"), doc.get(ATTENDANCE_DATE_FIELD), doc.get(ATTENDANCE_STATUS_FIELD)) for doc in docs
+        )
+        # Sorted by the change field, so the last document holds the largest value
+        latest = docs[-1].get(ROLLUP_CHANGE_FIELD)
+        if latest is not None:
+            self.collection.update_one({"_id": _META_ID}, {"$max": {_MONGO_WATERMARK: latest}}, upsert=True)
+        return written
+
+    def refresh_from_csv(self, path: str, date_column: str = "Date") -> int:
+        """
+        Fold in an attendance sheet with one row per date and one column per employee ID.
+        Skipped when the file has not changed since the last import.
+        """
+        mtime = os.stat(path).st_mtime
+        meta = self.collection.find_one({"_id": _META_ID}) or {}
+        if meta.get("csv_mtime", {}).get(_csv_key(path)) == mtime:
+            return 0
+        sheet = get_loader(path)
+        dates = sheet.column(date_column).tolist()
+        records = [
+            (employee, day, status)
+            for employee in sheet.columns if employee != date_column
+            for day, status in zip(dates, sheet.column(employee).tolist())
+        ]
+        written = self.apply(records)
+        self.collection.update_one({"_id": _META_ID}, {"$set": {f"csv_mtime.{_csv_key(path)}": mtime}}, upsert=True)
+        return written
+
+    # ------------------------------------------------------------------ reads
+
+    def summary(self, emp_id: str, start: date, end: date) -> Dict[str, int]:
+        """Aggregates for one employee over an inclusive date range."""
+        if start.day == 1 and end.day == calendar.monthrange(end.year, end.month)[1]:
+            if start.month == 1 and end.month == 12 and start.year == end.year:
+                doc = self.collection.find_one({"_id": f"{emp_id}:year:{start.year}"})
+                return _summary_fields(doc)
+            if (start.year, start.month) == (end.year, end.month):
+                doc = self.collection.find_one({"_id": f"{emp_id}:month:{start.isoformat()[:7]}"})
+                return _summary_fields(doc)
+        return summarize_days(self._day_docs(emp_id, start.isoformat(), end.isoformat()))
+
+    def answer(self, question: str) -> Optional[str]:
+        """
+        Compact rollup answer for an attendance question, or None if the question
+        names no employee ID.
+        """
+        employee_ids = extract_employee_ids(question)
+        if not employee_ids:
+            return None
+        start, end = extract_date_range(question)
+        lines = [f"Attendance summary {start.isoformat()} to {end.isoformat()}"]
+        for emp_id in employee_ids:
+            s = self.summary(emp_id, start, end)
+            if not s["days"]:
+                lines.append(f"{emp_id}: no attendance records")
+                continue
+            rate = 100.0 * s["present"] / s["days"]
+            lines.append(
+                f"{emp_id}: present {s['present']}, absent {s['absent']}, leave {s['leave']}"
+                f"{', other ' + str(s['other']) if s['other'] else ''} of {s['days']} recorded days "
+                f"({rate:.0f}% present); longest present streak {s['longest_present_streak']}, "
+                f"longest absent streak {s['longest_absent_streak']}"
+            )
+        return "\n".join(lines)
+
+
+def _csv_key(path: str) -> str:
+    # Mongo field names may not contain dots
+    return os.path.abspath(path).replace(".", "_")
+
+
+def _summary_fields(doc: Optional[dict]) -> Dict[str, int]:
+    if not doc:
+        return summarize_days([])
+    fields = summarize_days([])
+    fields.update({key: doc.get(key, 0) for key in fields})
+    return fields
+
+
+_rollups: Optional[AttendanceRollups] = None
+
+
+def get_rollups() -> AttendanceRollups:
+    global _rollups
+    if _rollups is None:
+        _rollups = AttendanceRollups()
+    return _rollups
+
+
+_refresher: Optional[threading.Thread] = None
+_refresher_lock = threading.Lock()
+_stop_refresh = threading.Event()
+
+
+def _refresh_loop(interval: float):
+    while True:
+        try:
+            get_rollups().refresh_from_mongo()
+        except Exception as e:
+            logger.exception("Rollup refresh failed: %s", e)
+        if _stop_refresh.wait(interval):
+            return
+
+
+def start_background_refresh(interval: float = ROLLUP_REFRESH_SECONDS) -> threading.Thread:
+    """
+    Starts the daemon thread that builds the rollups and then folds in new MongoDB
+    records every ``interval`` seconds; a no-op while it is running.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _stop_refresh.clear()
+            _refresher = threading.Thread(
+                target=_refresh_loop, args=(interval,), name="attendance-rollups", daemon=True
+            )
+            _refresher.start()
+        return _refresher
+
+
+def stop_background_refresh():
+    _stop_refresh.set()
+
+
+def get_attendance_context(question: str) -> str:
+    """
+    DataBase component for the chatbot: aggregate questions are answered from the
+    rollups once they have been built, anything else returns the raw records from
+    ``get_attendance_data``. Never waits for a refresh.
+    """
+    if is_aggregate_question(question):
+        start_background_refresh()
+        rollups = get_rollups()
+        if rollups.ready():
+            answer = rollups.answer(question)
+            if answer is not None:
+                return answer
+    return database_access.get_attendance_data(question)
+
+
+if __name__ == "__main__":
+    # python attendance_rollups.py [attendance.csv]  - refresh from MongoDB and/or a CSV sheet
+    rollups = get_rollups()
+    print(f"Rolled up {rollups.refresh_from_mongo()} day records from MongoDB")
+    for csv_path in sys.argv[1:]:
+        print(f"Rolled up {rollups.refresh_from_csv(csv_path)} day records from {csv_path}")
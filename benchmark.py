@@ -0,0 +1,457 @@
+"""
+Offline end-to-end benchmark of ``RAGChatBot.handle_query``.
+
+Every external service (the LLM deployments, embeddings, Azure Search, MongoDB and
+DuckDuckGo) is replaced by an in-process fake. Each fake's latency is lognormal around
+a configurable median and it fails at a configurable error rate. The bot is wired as in
+``main`` (answer cache, retrieval planner, context packing, deadlines, hedging,
+background validation, telemetry), and queries are driven through it at rising
+concurrency levels. No network is used.
+
+Per level it reports throughput, p50/p95/p99 latency, error and degraded answers, and a
+per-stage breakdown taken from the telemetry spans. Results are written as JSON, so runs
+on two commits can be compared with ``--compare``:
+
+    python benchmark.py --levels 1,8,32 --requests 200
+    python benchmark.py --compare benchmark_results/<earlier run>.json
+    python benchmark.py --profile slow_llm.json --scale 0.1     # override fakes, run 10x faster
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+# Stand-in settings: the pipeline modules build their SDK clients at import time, and local
+# caches and sinks must not touch the working copy's files.
+_SCRATCH = tempfile.mkdtemp(prefix="rag-benchmark-")
+for _name, _value in {
+    "GEN_MODEL_ENDPOINT": "https://benchmark.invalid", "GEN_MODEL": "benchmark",
+    "GEN_MODEL_API": "benchmark", "GEN_MODEL_VERSION": "2024-06-01",
+    "AZURE_OPENAI_ENDPOINT": "https://benchmark.invalid", "AZURE_OPENAI_API_KEY": "benchmark",
+    "AZURE_OPENAI_API_VERSION": "2024-06-01",
+    "AZURE_SEARCH_ENDPOINT": "https://benchmark.invalid", "AZURE_SEARCH_API_KEY": "benchmark",
+    "DB_USERNAME": "benchmark", "DB_PASSWORD": "benchmark",
+    "EMBEDDING_CACHE_PATH": os.path.join(_SCRATCH, "embedding_cache.sqlite3"),
+    "ANSWER_CACHE_PATH": os.path.join(_SCRATCH, "answer_cache.sqlite3"),
+    "METRICS_PORT": "0",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import main  # noqa: E402
+import telemetry  # noqa: E402
+import context_packer  # noqa: E402
+from main import RAGChatBot  # noqa: E402
+from answer_cache import AnswerCache  # noqa: E402
+from deadlines import Hedger  # noqa: E402
+from embeddings import get_tokenizer  # noqa: E402
+from validation_queue import ValidationQueue  # noqa: E402
+
+logger = logging.getLogger("benchmark")
+
+BENCHMARK_RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", "benchmark_results")
+
+# Replies the bot gives instead of an answer.
+ERROR_REPLIES = {
+    "Something went wrong on my side. Please try again.",
+    "Something went wrong while understanding your question.",
+    "That took longer than expected. Please try again.",
+}
+DEGRADED_REPLIES = {
+    "I'm sorry, I couldn't understand your question.",
+    "I couldn't find enough information to answer that.",
+}
+
+QUERIES = [
+    "How long should I proof sourdough before baking?",
+    "What is the difference between baking soda and baking powder?",
+    "What did the Tyrannosaurus rex eat and how fast could it run?",
+    "Which dinosaurs lived in the Jurassic period?",
+    "Show attendance for E001 last month",
+    "How many days was E004 absent in 2025?",
+    "Who is the current CEO of Google?",
+    "What is the weather like in Paris today and who won the last world cup?",
+    "Give me a cake recipe and tell me about Velociraptor feathers",
+    "How do I fix a dense loaf of bread?",
+]
+
+_KB_KEYWORDS = [
+    ("junaidh-text-DB", ("attendance", "absent", "e00")),
+    ("junaidh-text-dino", ("dinosaur", "tyrannosaurus", "jurassic", "velociraptor")),
+    ("junaidh-text-bake", ("bake", "baking", "bread", "sourdough", "loaf", "cake", "recipe")),
+]
+
+
+@dataclass
+class LatencyProfile:
+    """Lognormal latency around ``median`` seconds, and the share of calls that fail."""
+
+    median: float
+    sigma: float = 0.4
+    error_rate: float = 0.0
+
+
+DEFAULT_PROFILES: Dict[str, LatencyProfile] = {
+    "decompose": LatencyProfile(0.6, 0.35, 0.005),
+    "route": LatencyProfile(0.35, 0.35, 0.005),
+    "embedding": LatencyProfile(0.08, 0.5, 0.002),
+    "search": LatencyProfile(0.12, 0.5, 0.002),
+    "database": LatencyProfile(0.05, 0.6, 0.002),
+    "web": LatencyProfile(0.9, 0.7, 0.02),
+    "generate": LatencyProfile(1.8, 0.3, 0.005),
+    "validate": LatencyProfile(1.2, 0.3, 0.01),
+}
+
+
+class FakeServiceError(RuntimeError):
+    pass
+
+
+class FakeService:
+    """One stand-in dependency: sleeps for a sampled latency, then succeeds or fails."""
+
+    def __init__(self, name: str, profile: LatencyProfile, scale: float, seed: int):
+        self.name = name
+        self.profile = profile
+        self.scale = scale
+        self._random = random.Random(f"{seed}:{name}")
+        self.calls = 0
+        self.errors = 0
+
+    async def __call__(self):
+        self.calls += 1
+        delay = self.profile.median * math.exp(self._random.gauss(0.0, self.profile.sigma))
+        await asyncio.sleep(delay * self.scale)
+        if self._random.random() < self.profile.error_rate:
+            self.errors += 1
+            raise FakeServiceError(f"{self.name} failed")
+
+
+class Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class FakeBackends:
+    """Component functions for ``RAGChatBot`` backed by ``FakeService``s."""
+
+    def __init__(self, profiles: Dict[str, LatencyProfile], scale: float = 1.0, seed: int = 0):
+        self.services = {name: FakeService(name, profile, scale, seed) for name, profile in profiles.items()}
+
+    async def query_gen(self, user_query: str) -> str:
+        await self.services["decompose"]()
+        telemetry.record_usage(Usage(450 + len(user_query) // 4, 40))
+        parts = [part.strip(" ?") for part in user_query.replace(" and ", "|").split("|")]
+        return json.dumps({"queries": [part for part in parts if part]})
+
+    async def agent(self, sub_query: str) -> str:
+        await self.services["route"]()
+        telemetry.record_usage(Usage(380 + len(sub_query) // 4, 12))
+        lowered = sub_query.lower()
+        for kb, keywords in _KB_KEYWORDS:
+            if any(keyword in lowered for keyword in keywords):
+                return json.dumps({"knowledge_base": kb})
+        return json.dumps({"knowledge_base": "junaidh-text-NoKB"})
+
+    async def vectorize(self, text: str) -> List[float]:
+        await self.services["embedding"]()
+        telemetry.record_usage(Usage(len(text) // 4 + 1, 0))
+        rng = random.Random(text)
+        return [rng.uniform(-1.0, 1.0) for _ in range(8)]
+
+    async def vectorize_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        """One embedding call for the whole batch, like ``embeddings.vectorize_batch_async``."""
+        await self.services["embedding"]()
+        telemetry.record_usage(Usage(sum(len(text) // 4 + 1 for text in texts), 0))
+        return [[random.Random(text).uniform(-1.0, 1.0) for _ in range(8)] for text in texts]
+
+    async def vectorizer(self, question: str, kb: str) -> List[str]:
+        await self.vectorize(question)
+        await self.services["search"]()
+        return [f"[{kb}] passage {i} about {question}" for i in range(5)]
+
+    async def multi_vectorizer(self, questions: Sequence[str], kb: str) -> List[str]:
+        await asyncio.gather(*(self.vectorize(question) for question in questions))
+        await self.services["search"]()
+        return [f"[{kb}] passage {i} about {question}" for question in questions for i in range(3)]
+
+    async def web_search(self, question: str) -> List[Dict[str, str]]:
+        await self.services["web"]()
+        return [{"title": f"Result {i}", "href": f"https://example.com/{i}", "body": question} for i in range(5)]
+
+    async def database(self, question: str) -> str:
+        await self.services["database"]()
+        return f"Attendance summary for: {question}\nE001: present 20, absent 2, leave 1 of 23 recorded days"
+
+    async def rag(self, user_query: str, context: Any) -> str:
+        await self.services["generate"]()
+        telemetry.record_usage(Usage(900 + len(str(context)) // 4, 180))
+        return f"Answer to {user_query}"
+
+    async def validate_batch(self, items: List[Dict]) -> List[Dict]:
+        await self.services["validate"]()
+        return [{"verdict": "pass"} for _ in items]
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"calls": s.calls, "errors": s.errors} for name, s in self.services.items()}
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+class ApproximateTokenizer:
+    """About four characters per token; stands in when the tiktoken encoding is not cached locally."""
+
+    def encode(self, text: str, disallowed_special=()) -> List[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def decode(self, tokens: Sequence[str]) -> str:
+        return "".join(tokens)
+
+
+def build_bot(
+    backends: FakeBackends, deadline: Optional[float], hedging: bool, validation: bool, answer_cache: bool = True,
+) -> RAGChatBot:
+    # The answer-cache probe and the context packer embed through module-level functions
+    main.vectorize_async = backends.vectorize
+    context_packer.vectorize_batch_async = backends.vectorize_batch
+    try:
+        get_tokenizer()
+    except Exception:
+        context_packer.get_tokenizer = ApproximateTokenizer
+    kwargs = {} if deadline is None else {"request_deadline": deadline}
+    return RAGChatBot(
+        vectorizer=backends.vectorizer,
+        multi_vectorizer=backends.multi_vectorizer,
+        context_packer=context_packer.pack_context_async,
+        answer_cache=AnswerCache(os.path.join(_SCRATCH, f"answer_cache-{time.time_ns()}.sqlite3")) if answer_cache else None,
+        agent=backends.agent,
+        rag=backends.rag,
+        web_search=backends.web_search,
+        query_gen=backends.query_gen,
+        Validate=None,
+        DataBase=backends.database,
+        validation_queue=ValidationQueue(
+            backends.validate_batch, sink_path=os.path.join(_SCRATCH, "validation_results.jsonl")
+        ) if validation else None,
+        hedger=Hedger() if hedging else None,
+        **kwargs,
+    )
+
+
+async def run_level(bot: RAGChatBot, concurrency: int, requests: int, seed: int) -> Dict[str, Any]:
+    """Sends ``requests`` queries with ``concurrency`` in flight and summarizes them."""
+    rng = random.Random(seed + concurrency)
+    queries = [rng.choice(QUERIES) for _ in range(requests)]
+    latencies: List[float] = []
+    outcomes = defaultdict(int)
+    stages: Dict[str, List[float]] = defaultdict(list)
+
+    def on_span(span):
+        key = span.name if "source" not in span.attributes else f"{span.name}:{span.attributes['source']}"
+        stages[key].append(span.duration)
+
+    pending: asyncio.Queue = asyncio.Queue()
+    for query in queries:
+        pending.put_nowait(query)
+
+    async def worker():
+        while True:
+            try:
+                query = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            reply = await bot.handle_query(query)
+            latencies.append(time.perf_counter() - started)
+            if reply in ERROR_REPLIES:
+                outcomes["errors"] += 1
+            elif reply in DEGRADED_REPLIES:
+                outcomes["degraded"] += 1
+            else:
+                outcomes["answered"] += 1
+
+    telemetry.add_span_listener(on_span)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        telemetry.remove_span_listener(on_span)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 3) if elapsed else 0.0,
+        "latency": summarize(latencies),
+        "outcomes": dict(outcomes),
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(
+    levels: Sequence[int],
+    requests: int,
+    profiles: Dict[str, LatencyProfile],
+    scale: float = 1.0,
+    seed: int = 0,
+    deadline: Optional[float] = None,
+    hedging: bool = True,
+    validation: bool = True,
+    answer_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Runs every concurrency level against one freshly wired bot.
+
+    Returns:
+        The JSON-serializable benchmark report.
+    """
+    backends = FakeBackends(profiles, scale, seed)
+    bot = build_bot(backends, deadline, hedging, validation, answer_cache)
+    results = []
+    try:
+        for concurrency in levels:
+            result = await run_level(bot, concurrency, requests, seed)
+            results.append(result)
+            print(
+                f"concurrency {concurrency:>4}: {result['throughput_rps']:>8.2f} req/s  "
+                f"p50 {result['latency']['p50']:.3f}s  p95 {result['latency']['p95']:.3f}s  "
+                f"p99 {result['latency']['p99']:.3f}s  {result['outcomes']}"
+            )
+    finally:
+        await bot.close()
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "requests_per_level": requests,
+            "scale": scale,
+            "seed": seed,
+            "deadline": bot.request_deadline,
+            "hedging": hedging,
+            "validation": validation,
+            "answer_cache": answer_cache,
+            "profiles": {name: asdict(profile) for name, profile in profiles.items()},
+        },
+        "services": backends.counts(),
+        "levels": results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """
+    Prints per-level changes against ``baseline``.
+
+    Returns:
+        True if any level's p95 latency or throughput regressed by more than ``tolerance``.
+    """
+    regressed = False
+    base_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    print(f"\nAgainst {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for level in report["levels"]:
+        base = base_levels.get(level["concurrency"])
+        if base is None:
+            continue
+        p95_change = level["latency"]["p95"] / base["latency"]["p95"] - 1 if base["latency"]["p95"] else 0.0
+        rps_change = level["throughput_rps"] / base["throughput_rps"] - 1 if base["throughput_rps"] else 0.0
+        flag = ""
+        if p95_change > tolerance or rps_change < -tolerance:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"concurrency {level['concurrency']:>4}: p95 {p95_change:+.1%}  throughput {rps_change:+.1%}{flag}")
+    return regressed
+
+
+def load_profiles(path: Optional[str]) -> Dict[str, LatencyProfile]:
+    """Default profiles, with entries from a JSON file ({"web": {"median": 2.0, ...}}) overriding them."""
+    profiles = dict(DEFAULT_PROFILES)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        for name, values in overrides.items():
+            profiles[name] = LatencyProfile(**{**asdict(profiles.get(name, LatencyProfile(0.1))), **values})
+    return profiles
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the RAG pipeline.")
+    parser.add_argument("--levels", default="1,4,16,64", help="Comma-separated concurrency levels.")
+    parser.add_argument("--requests", type=int, default=200, help="Queries sent per level.")
+    parser.add_argument("--profile", help="JSON file overriding the fake services' latency profiles.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier on every fake latency.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--deadline", type=float, help="Request deadline in seconds (default: REQUEST_DEADLINE_SECONDS).")
+    parser.add_argument("--no-hedging", action="store_true")
+    parser.add_argument("--no-validation", action="store_true")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Run every query through the full pipeline.")
+    parser.add_argument("--output", help="Result file (default: benchmark_results/<timestamp>-<commit>.json).")
+    parser.add_argument("--compare", help="Earlier result file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change reported as a regression.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Per-request INFO lines would dominate the run; keep warnings only.
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(
+        levels=[int(level) for level in args.levels.split(",") if level.strip()],
+        requests=args.requests,
+        profiles=load_profiles(args.profile),
+        scale=args.scale,
+        seed=args.seed,
+        deadline=args.deadline,
+        hedging=not args.no_hedging,
+        validation=not args.no_validation,
+        answer_cache=not args.no_answer_cache,
+    ))
+
+    output = args.output
+    if output is None:
+        os.makedirs(BENCHMARK_RESULTS_DIR, exist_ok=True)
+        stamp = report["timestamp"].replace(":", "").replace("-", "")
+        output = os.path.join(BENCHMARK_RESULTS_DIR, f"{stamp}-{report['commit'] or 'nocommit'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            sys.exit(1 if compare(report, json.load(f), args.tolerance) else 0)
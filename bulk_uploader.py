@@ -0,0 +1,196 @@
+"""
+Buffered bulk uploader for search indexes.
+
+Documents are buffered and flushed by document count or estimated payload size
+(1536-float vectors make every document ~30 KB of JSON). Several flushes run at once,
+each batch's per-key ``IndexingResult`` is inspected, and only the failed keys with a
+retriable status are re-sent with exponential backoff.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("bulk_uploader")
+
+# Azure AI Search accepts at most 1000 documents and 16 MB per indexing request.
+UPLOAD_BATCH_MAX_DOCUMENTS = int(os.getenv("UPLOAD_BATCH_MAX_DOCUMENTS", "1000"))
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(12 * 1024 * 1024)))
+UPLOAD_MAX_CONCURRENT_FLUSHES = int(os.getenv("UPLOAD_MAX_CONCURRENT_FLUSHES", "3"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "5"))
+
+RETRIABLE_STATUS_CODES = {409, 422, 429, 500, 502, 503, 504}
+
+# Rough JSON size of one float in a serialized vector, including the separator.
+_BYTES_PER_FLOAT = 20
+
+
+def estimate_document_bytes(document: Dict[str, Any]) -> int:
+    """Cheap upper-bound estimate of a document's JSON payload size."""
+    size = 2
+    for key, value in document.items():
+        size += len(key) + 4
+        if isinstance(value, str):
+            size += len(value.encode("utf-8")) + 2
+        elif isinstance(value, (list, tuple)):
+            size += sum(
+                len(item.encode("utf-8")) + 3 if isinstance(item, str) else _BYTES_PER_FLOAT
+                for item in value
+            ) + 2
+        else:
+            size += len(str(value))
+    return size
+
+
+class BulkUploader:
+    """
+    Buffers documents and uploads them in concurrent, size-bounded batches.
+
+    Usage:
+        with BulkUploader(search_client) as uploader:
+            for document in documents:
+                uploader.add(document)
+        print(uploader.stats())
+    """
+
+    def __init__(
+        self,
+        search_client,
+        max_documents: int = UPLOAD_BATCH_MAX_DOCUMENTS,
+        max_bytes: int = UPLOAD_BATCH_MAX_BYTES,
+        max_concurrent_flushes: int = UPLOAD_MAX_CONCURRENT_FLUSHES,
+        max_retries: int = UPLOAD_MAX_RETRIES,
+        on_success: Optional[Callable[[List[str]], None]] = None,
+        on_failure: Optional[Callable[[List[str]], None]] = None,
+    ):
+        """
+        Args:
+            on_success: Called from a flush thread with the keys the index acknowledged.
+            on_failure: Called with keys that failed permanently or ran out of retries.
+        """
+        self.search_client = search_client
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_bytes = 0
+        self._buffer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Bounds in-flight flushes; add() blocks once they are all busy (backpressure).
+        self._slots = threading.BoundedSemaphore(max_concurrent_flushes)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_flushes)
+        self._futures: List[Future] = []
+
+        self.uploaded = 0
+        self.failed_keys: Dict[str, str] = {}
+        self.batches = 0
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, document: Dict[str, Any]):
+        """Queue one document; triggers a flush when the buffer hits either bound."""
+        size = estimate_document_bytes(document)
+        with self._buffer_lock:
+            if self._buffer and (
+                len(self._buffer) >= self.max_documents or self._buffer_bytes + size > self.max_bytes
+            ):
+                self._flush_locked()
+            self._buffer.append(document)
+            self._buffer_bytes += size
+
+    def flush(self):
+        with self._buffer_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        self._slots.acquire()
+        future = self._executor.submit(self._upload_batch, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def close(self) -> Dict[str, float]:
+        """Flush the remainder, wait for every in-flight batch and return the stats."""
+        self.flush()
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        self._executor.shutdown(wait=True)
+        return self.stats()
+
+    def _upload_batch(self, batch: List[Dict[str, Any]]):
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            try:
+                results = self.search_client.upload_documents(documents=pending)
+            except Exception as e:
+                logger.warning("Upload of %d documents failed (attempt %d): %s", len(pending), attempt + 1, e)
+                errors = {document["id"]: (503, str(e)) for document in pending}
+            else:
+                errors = {
+                    result.key: (result.status_code, result.error_message)
+                    for result in results if not result.succeeded
+                }
+                with self._stats_lock:
+                    self.uploaded += len(results) - len(errors)
+                    self.batches += 1
+                if self.on_success:
+                    self.on_success([result.key for result in results if result.succeeded])
+
+            retry = []
+            given_up = []
+            for document in pending:
+                error = errors.get(document["id"])
+                if error is None:
+                    continue
+                status_code, message = error
+                if status_code in RETRIABLE_STATUS_CODES and attempt < self.max_retries:
+                    retry.append(document)
+                else:
+                    given_up.append(document["id"])
+                    with self._stats_lock:
+                        self.failed_keys[document["id"]] = f"{status_code}: {message}"
+            if given_up and self.on_failure:
+                self.on_failure(given_up)
+            if not retry:
+                return
+            logger.info("Retrying %d failed keys (attempt %d)", len(retry), attempt + 2)
+            time.sleep(min(2 ** attempt, 30))
+            pending = retry
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = time.perf_counter() - self._started
+        return {
+            "uploaded": self.uploaded,
+            "failed": len(self.failed_keys),
+            "batches": self.batches,
+            "elapsed_seconds": elapsed,
+            "docs_per_second": self.uploaded / elapsed if elapsed else 0.0,
+        }
+
+
+def delete_documents_by_key(search_client, keys, batch_size: int = UPLOAD_BATCH_MAX_DOCUMENTS) -> int:
+    """Delete documents by key in batches; returns the number the index acknowledged."""
+    keys = list(keys)
+    deleted = 0
+    for start in range(0, len(keys), batch_size):
+        batch = [{"id": key} for key in keys[start:start + batch_size]]
+        try:
+            results = search_client.delete_documents(documents=batch)
+            deleted += sum(1 for result in results if result.succeeded)
+        except Exception as e:
+            logger.warning("Deleting %d documents failed: %s", len(batch), e)
+    return deleted
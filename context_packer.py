@@ -0,0 +1,193 @@
+"""
+Context assembly between retrieval and generation.
+
+Retrieved results (KB chunks, web-search hits, database records) are flattened into
+passages, overlapping text between neighbouring chunks is cut, passages are ordered by
+relevance to the question with MMR diversity, and the best of them are packed into an
+exact token budget as compact, source-tagged text:
+
+    [1] (junaidh-text-bake) Preheat the oven to 180C ...
+    [2] (web: https://example.com/page) Title: snippet ...
+"""
+
+import os
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embeddings import get_tokenizer, vectorize_batch, vectorize_batch_async
+
+logger = logging.getLogger("context_packer")
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Shortest shared suffix/prefix (in characters) treated as chunk overlap.
+CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "40"))
+# A truncated last passage is only worth including with at least this many tokens.
+CONTEXT_MIN_TAIL_TOKENS = 40
+
+
+@dataclass
+class Passage:
+    source: str
+    text: str
+    # Text exactly as retrieved (KB chunks as ingestion embedded them); embedded instead
+    # of ``text`` so chunk vectors hit the embedding cache.
+    original: str
+
+
+def _item_passage(source: str, item: Any) -> Optional[Passage]:
+    original = None
+    if isinstance(item, str):
+        original = item
+        text = " ".join(item.split())
+        label = source
+    elif isinstance(item, dict) and ("body" in item or "href" in item):
+        text = " ".join(f"{item.get('title') or ''}: {item.get('body') or ''}".split())
+        label = f"{source}: {item['href']}" if item.get("href") else source
+    elif isinstance(item, dict):
+        record = {key: value for key, value in item.items() if key != "_id"}
+        text = json.dumps(record, default=str, separators=(",", ":"))
+        label = source
+    else:
+        text = " ".join(str(item).split())
+        label = source
+    if not text.strip(": "):
+        return None
+    return Passage(source=label, text=text, original=text if original is None else original)
+
+
+def flatten(tagged_context: Sequence[Tuple[str, Any]]) -> List[Passage]:
+    """Turns (source, result) pairs from retrieval into one passage per chunk/hit/record."""
+    passages = []
+    for source, result in tagged_context:
+        for item in result if isinstance(result, list) else [result]:
+            passage = _item_passage(source, item)
+            if passage is not None:
+                passages.append(passage)
+    return passages
+
+
+def _overlap(previous: str, text: str, min_chars: int) -> int:
+    """Length of the longest suffix of ``previous`` that is a prefix of ``text``."""
+    probe = text[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    start = previous.find(probe)
+    while start != -1:
+        tail = previous[start:]
+        if text.startswith(tail):
+            return len(tail)
+        start = previous.find(probe, start + 1)
+    return 0
+
+
+def remove_overlaps(passages: List[Passage], min_chars: int = CONTEXT_MIN_OVERLAP_CHARS) -> List[Passage]:
+    """
+    Drops passages contained in another one and cuts the text a chunk shares with the
+    end of another chunk (the splitter's chunk overlap).
+    """
+    kept: List[Passage] = []
+    for passage in passages:
+        if any(passage.text in other.text for other in kept):
+            continue
+        kept = [other for other in kept if other.text not in passage.text]
+        for other in kept:
+            cut = _overlap(other.text, passage.text, min_chars)
+            if cut:
+                passage.text = passage.text[cut:].lstrip()
+        if passage.text:
+            kept.append(passage)
+    return kept
+
+
+def mmr_order(query_vector, vectors: np.ndarray, mmr_lambda: float = CONTEXT_MMR_LAMBDA) -> List[int]:
+    """
+    Maximal marginal relevance ordering: each step picks the passage with the best
+    trade-off between similarity to the question and dissimilarity to those already picked.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query
+
+    order: List[int] = []
+    remaining = list(range(len(vectors)))
+    redundancy = np.full(len(vectors), -np.inf)
+    while remaining:
+        scores = [
+            mmr_lambda * relevance[i] - (1 - mmr_lambda) * (redundancy[i] if order else 0.0)
+            for i in remaining
+        ]
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return order
+
+
+def pack(passages: Sequence[Passage], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Emits passages in order as "[n] (source) text" lines until ``budget`` tokens are
+    used; the passage that crosses the budget is truncated to fit exactly.
+    """
+    tokenizer = get_tokenizer()
+    lines: List[str] = []
+    used = 0
+    for passage in passages:
+        line = f"[{len(lines) + 1}] ({passage.source}) {passage.text}"
+        tokens = tokenizer.encode(line + "\n", disallowed_special=())
+        if used + len(tokens) <= budget:
+            lines.append(line)
+            used += len(tokens)
+            continue
+        remaining = budget - used - 1
+        if remaining >= CONTEXT_MIN_TAIL_TOKENS:
+            lines.append(tokenizer.decode(tokens[:remaining]).rstrip())
+        break
+    return "\n".join(lines)
+
+
+def _order(passages: List[Passage], vectors) -> List[Passage]:
+    query_vector, passage_vectors = vectors[0], vectors[1:]
+    usable = [i for i, vector in enumerate(passage_vectors) if vector is not None]
+    if query_vector is None or not usable:
+        return passages
+    order = mmr_order(query_vector, np.asarray([passage_vectors[i] for i in usable], dtype=np.float32))
+    unranked = [passages[i] for i, vector in enumerate(passage_vectors) if vector is None]
+    return [passages[usable[i]] for i in order] + unranked
+
+
+def pack_context(user_query: str, tagged_context: Sequence[Tuple[str, Any]], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Builds the prompt context for ``rag`` from retrieval output.
+
+    Args:
+        user_query: The question the answer is for; ranking is by relevance to it.
+        tagged_context: (source, result) pairs, e.g. from ``RetrievalPlanner.retrieve_tagged``.
+        budget: Maximum number of tokens in the returned text.
+
+    Returns:
+        Source-tagged passages, most useful first, within ``budget`` tokens.
+    """
+    passages = remove_overlaps(flatten(tagged_context))
+    if len(passages) > 1:
+        vectors = vectorize_batch([user_query] + [passage.original for passage in passages])
+        passages = _order(passages, vectors)
+    return _log(pack(passages, budget), passages)
+
+
+async def pack_context_async(user_query: str, tagged_context: Sequence[Tuple[str, Any]], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Async variant of ``pack_context``."""
+    passages = remove_overlaps(flatten(tagged_context))
+    if len(passages) > 1:
+        vectors = await vectorize_batch_async([user_query] + [passage.original for passage in passages])
+        passages = _order(passages, vectors)
+    return _log(pack(passages, budget), passages)
+
+
+def _log(packed: str, passages: List[Passage]) -> str:
+    logger.info("Packed %d of %d passages into the context", packed.count("\n") + 1 if packed else 0, len(passages))
+    return packed
@@ -0,0 +1,232 @@
+"""
+Token-bounded conversation history for function-calling chat loops.
+
+``ConversationHistory`` keeps the pinned instruction message, a running summary of
+older turns, and the most recent turns verbatim. A turn starts with a user message and
+holds the assistant replies and function results that follow it. When a new turn starts,
+the oldest turns are folded into the summary (one summarizer call per evicted turn)
+until at most ``keep_turns`` remain and the rendered history fits ``token_budget``.
+Function results are sent in full only within their own turn. Afterwards they are
+replaced by a short digest ("get_attendance_data: 365 values; P 300, A 40, ...").
+The prompt resent on every call therefore stays roughly the same size however long
+the session runs.
+"""
+
+import os
+import json
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from embeddings import get_tokenizer
+
+logger = logging.getLogger("conversation_history")
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "200"))
+HISTORY_DIGEST_TOKENS = int(os.getenv("HISTORY_DIGEST_TOKENS", "60"))
+# Per-message overhead of the chat format (role, separators), as counted by OpenAI.
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    tokenizer = get_tokenizer()
+    tokens = _MESSAGE_OVERHEAD_TOKENS
+    for key in ("content", "name"):
+        if message.get(key):
+            tokens += len(tokenizer.encode(str(message[key]), disallowed_special=()))
+    if message.get("function_call"):
+        tokens += len(tokenizer.encode(json.dumps(message["function_call"]), disallowed_special=()))
+    return tokens
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokenizer = get_tokenizer()
+    tokens = tokenizer.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return tokenizer.decode(tokens[:max_tokens]).rstrip() + " ..."
+
+
+def digest_result(name: str, content: str, max_tokens: int = HISTORY_DIGEST_TOKENS) -> str:
+    """
+    Short stand-in for a function result: lists become their length and most common
+    values, anything else is truncated to ``max_tokens``.
+    """
+    try:
+        value = json.loads(content)
+    except (TypeError, ValueError):
+        value = content
+    if isinstance(value, list):
+        try:
+            counts = Counter(value).most_common(5)
+            text = f"{name}: {len(value)} values; " + ", ".join(f"{item} {count}" for item, count in counts)
+        except TypeError:
+            text = f"{name}: {len(value)} values; first {json.dumps(value[:3], default=str)}"
+    else:
+        text = f"{name}: {value if isinstance(value, str) else json.dumps(value, default=str)}"
+    return truncate_tokens(text, max_tokens)
+
+
+def build_summary_prompt(summary: str, transcript: str, max_tokens: int = HISTORY_SUMMARY_TOKENS) -> str:
+    """Prompt that folds one more turn into the running summary."""
+    return f"""
+                Update the running summary of a conversation between a user and an attendance assistant.
+                Keep employee IDs, dates, figures and open questions; drop pleasantries.
+                Answer with the updated summary only, in at most {max_tokens} tokens.
+
+                Current summary:
+                {summary or "(empty)"}
+
+                New exchange:
+                {transcript}
+                """
+
+
+def _as_dict(message: Any) -> Dict[str, Any]:
+    """Chat message as a plain dict (SDK message objects are converted)."""
+    if isinstance(message, dict):
+        return dict(message)
+    message = message.model_dump(exclude_none=True)
+    message.setdefault("content", None)
+    return {key: message[key] for key in ("role", "content", "name", "function_call") if key in message}
+
+
+def _transcript(turn: List[Dict[str, Any]]) -> str:
+    lines = []
+    for message in turn:
+        if message["role"] == "function":
+            lines.append(f"Tool result: {message['_digest']}")
+        elif message.get("function_call"):
+            call = message["function_call"]
+            lines.append(f"Assistant called {call.get('name')}({call.get('arguments')})")
+        elif message.get("content"):
+            lines.append(f"{message['role'].capitalize()}: {message['content']}")
+    return "\n".join(lines)
+
+
+class ConversationHistory:
+    """
+    Message list for ``chat.completions.create`` with a bounded token size.
+
+    Usage:
+        history = ConversationHistory(system_message, summarizer=summarize_turns)
+        history.add_user(user_query)
+        response = client.chat.completions.create(messages=history.messages(), ...)
+        history.add_assistant(response.choices[0].message)
+    """
+
+    def __init__(
+        self,
+        system_message: Dict[str, Any],
+        summarizer: Optional[Callable[[str, str], str]] = None,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_turns: int = HISTORY_KEEP_TURNS,
+        summary_tokens: int = HISTORY_SUMMARY_TOKENS,
+        digest_tokens: int = HISTORY_DIGEST_TOKENS,
+    ):
+        """
+        Args:
+            system_message: Instruction message pinned at the start of every request.
+            summarizer: ``summarizer(summary, transcript) -> new summary``, e.g. an LLM call
+                built on ``build_summary_prompt``. Without one, evicted turns are appended
+                to the summary as truncated transcripts.
+            token_budget: Target size of ``messages()``; the current turn is always sent whole.
+            keep_turns: Most recent turns kept verbatim.
+            summary_tokens: Cap on the running summary.
+            digest_tokens: Cap on the digest that replaces an older function result.
+        """
+        self.system_message = _as_dict(system_message)
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.keep_turns = max(1, keep_turns)
+        self.summary_tokens = summary_tokens
+        self.digest_tokens = digest_tokens
+        self.summary = ""
+        self._turns: List[List[Dict[str, Any]]] = []
+        self._folded_turns = 0
+        self._last_tokens = 0
+
+    # ------------------------------------------------------------------ writes
+
+    def add_user(self, content: str):
+        """Starts a new turn, compacting older ones first."""
+        self._turns.append([{"role": "user", "content": content}])
+        self._compact()
+
+    def add_assistant(self, message: Any):
+        self._current().append(_as_dict(message))
+
+    def add_function_result(self, name: str, result: Any):
+        content = result if isinstance(result, str) else json.dumps(result, default=str)
+        self._current().append({
+            "role": "function",
+            "name": name,
+            "content": content,
+            "_digest": digest_result(name, content, self.digest_tokens),
+        })
+
+    def _current(self) -> List[Dict[str, Any]]:
+        if not self._turns:
+            self._turns.append([])
+        return self._turns[-1]
+
+    def _fold(self, turn: List[Dict[str, Any]]):
+        transcript = _transcript(turn)
+        if self.summarizer is not None:
+            try:
+                self.summary = self.summarizer(self.summary, transcript).strip()
+            except Exception as e:
+                logger.exception("History summarization failed: %s", e)
+                self.summary = f"{self.summary}\n{transcript}".strip()
+        else:
+            self.summary = f"{self.summary}\n{transcript}".strip()
+        # Keep the most recent part of an over-long summary.
+        tokenizer = get_tokenizer()
+        tokens = tokenizer.encode(self.summary, disallowed_special=())
+        if len(tokens) > self.summary_tokens:
+            self.summary = "... " + tokenizer.decode(tokens[-self.summary_tokens:]).lstrip()
+        self._folded_turns += 1
+
+    def _compact(self):
+        while len(self._turns) > 1 and (
+            len(self._turns) > self.keep_turns or self._count(self._render()) > self.token_budget
+        ):
+            self._fold(self._turns.pop(0))
+        logger.debug("History: %d turns kept, %d folded into the summary", len(self._turns), self._folded_turns)
+
+    # ------------------------------------------------------------------ reads
+
+    def _render(self) -> List[Dict[str, Any]]:
+        messages = [self.system_message]
+        if self.summary:
+            messages.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        last = len(self._turns) - 1
+        for position, turn in enumerate(self._turns):
+            for message in turn:
+                message = dict(message)
+                digest = message.pop("_digest", None)
+                if digest is not None and position != last:
+                    message["content"] = digest
+                messages.append(message)
+        return messages
+
+    @staticmethod
+    def _count(messages: List[Dict[str, Any]]) -> int:
+        return sum(count_message_tokens(message) for message in messages)
+
+    def messages(self) -> List[Dict[str, Any]]:
+        """The messages to send for the current request."""
+        messages = self._render()
+        self._last_tokens = self._count(messages)
+        return messages
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "turns_kept": len(self._turns),
+            "turns_summarized": self._folded_turns,
+            "last_request_tokens": self._last_tokens,
+        }
@@ -106,6 +106,18 @@ fields = [
         type=SearchFieldDataType.Collection(SearchFieldDataType.String),
         filterable=True,
         facetable=True
+    ),
+    SimpleField(
+        name="page_start",
+        type=SearchFieldDataType.Int32,
+        filterable=True,
+        sortable=True
+    ),
+    SimpleField(
+        name="page_end",
+        type=SearchFieldDataType.Int32,
+        filterable=True,
+        sortable=True
     )
 ]
 
@@ -1,9 +1,10 @@
 from openai import AzureOpenAI
-import pandas as pd
 import os
 from dotenv import load_dotenv
 import json
 load_dotenv()
+from attendance_columns import ATTENDANCE_CSV_PATH, get_loader
+from conversation_history import ConversationHistory, HISTORY_SUMMARY_TOKENS, build_summary_prompt
 
 client = AzureOpenAI(
     api_key=os.getenv("GEN_MODEL_API"),
@@ -11,20 +12,12 @@ client = AzureOpenAI(
     azure_endpoint = os.getenv("GEN_MODEL_ENDPOINT")
     )
 
-user_query = input("User:")
-
-def get_attendance_data(employee_id):
-    dataset = pd.read_csv("C:/Users/junai/Codes/INextLabs/AgenticRag/KB/Attandance_sheet.csv")
-    result = []
-    if employee_id in dataset.columns:
-        for column in dataset.columns:
-            result.append(f"Column Name: {column}")
-            result.append("Values:")
-            result.append(dataset[column].tolist())
-            result.append("\n")
-        return dataset[employee_id].tolist()
-    else:
+def get_attendance_data(employee_id, csv_path=ATTENDANCE_CSV_PATH):
+    # Served from the columnar cache: a stat of the CSV plus a slice of one column
+    series = get_loader(csv_path).series(employee_id)
+    if series is None:
         return "Employee ID not found"
+    return series
     
 functions = [
     {
@@ -44,8 +37,7 @@ functions = [
     }
 ]
 
-messages = [
-        {
+system_message = {
         "role": "user",
          "content": """You are a helpful assistant. 
             If the user is asking about attendance, extract the employee ID and call the tool 'get_attendance_data'. 
@@ -53,50 +45,56 @@ messages = [
             If the user doesn’t mention an employee ID, ask them for it for security purposes.
             """
         }
-    ]
-
-while True:
-    user_query = input("User:")
-    if user_query.lower() in {"exit", "quit"}:
-        print("chat ended")
-        break
-    
-    messages.append({"role":"user","content":user_query})
 
+def summarize_turns(summary, transcript):
+    # Folds one evicted turn into the running summary of the session
     response = client.chat.completions.create(
         model=os.getenv("GEN_MODEL"),
-        messages=messages,
-        functions=functions,
-        function_call="auto"  
+        messages=[{"role": "system", "content": build_summary_prompt(summary, transcript)}],
+        max_tokens=HISTORY_SUMMARY_TOKENS,
+        temperature=0.0,
     )
+    return response.choices[0].message.content
+
+if __name__ == "__main__":
+    # Bounded history: system message, a running summary and the latest turns only
+    history = ConversationHistory(system_message, summarizer=summarize_turns)
+    while True:
+        user_query = input("User:")
+        if user_query.lower() in {"exit", "quit"}:
+            print("chat ended")
+            break
+    
+        history.add_user(user_query)
 
-    response_message = response.choices[0].message
-    messages.append(response_message)
+        response = client.chat.completions.create(
+            model=os.getenv("GEN_MODEL"),
+            messages=history.messages(),
+            functions=functions,
+            function_call="auto"  
+        )
 
-    if response_message.function_call:
-        function_name = response_message.function_call.name
-        function_args = json.loads(response_message.function_call.arguments)
-        print("Function call detected:",function_name)
-        
-        if function_name == "get_attendance_data":
-            employee_id = function_args.get("employee_id")
-            result = get_attendance_data(employee_id)
+        response_message = response.choices[0].message
+        history.add_assistant(response_message)
 
-            function_result_message = {
-                "role": "function",
-                "name":function_name,
-                "content":json.dumps(result)
-            }
-            messages.append(function_result_message)
+        if response_message.function_call:
+            function_name = response_message.function_call.name
+            function_args = json.loads(response_message.function_call.arguments)
+            print("Function call detected:",function_name)
+        
+            if function_name == "get_attendance_data":
+                employee_id = function_args.get("employee_id")
+                result = get_attendance_data(employee_id)
+                history.add_function_result(function_name, result)
 
-            second_response = client.chat.completions.create(
-                model=os.getenv("GEN_MODEL"),
-                messages=messages,
-            )
+                second_response = client.chat.completions.create(
+                    model=os.getenv("GEN_MODEL"),
+                    messages=history.messages(),
+                )
 
-            Final_message = second_response.choices[0].message
-            messages.append(Final_message)
-            print("Assistant:", Final_message.content)
-    else:
-        print("No function call made. Response:")
-        print(response_message.content)
\ No newline at end of file
+                Final_message = second_response.choices[0].message
+                history.add_assistant(Final_message)
+                print("Assistant:", Final_message.content)
+        else:
+            print("No function call made. Response:")
+            print(response_message.content)
\ No newline at end of file
@@ -0,0 +1,259 @@
+"""
+Request deadlines, per-stage budgets and hedged calls.
+
+``handle_query`` opens a ``deadline_scope`` for every request. The deadline lives in a
+context variable, so it reaches every component: coroutines directly, and sync
+components because ``RAGChatBot._call`` copies the context into the executor. Each
+pipeline stage gets at most its share of the total (STAGE_BUDGETS), capped by the time
+left. The async SDK calls pass the remaining time as their request ``timeout``.
+
+``Hedger`` bounds the tail of idempotent calls (embedding, routing, search). When the
+first attempt has not finished after the p95 latency observed for that call, a second
+identical attempt is started, and whichever succeeds first wins.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional
+
+logger = logging.getLogger("deadlines")
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "20"))
+# Largest share of the request deadline each stage may use; generation gets the rest.
+STAGE_BUDGETS = {
+    "cache": 0.05,
+    "decompose": 0.15,
+    "route": 0.10,
+    "retrieve": 0.25,
+    "pack": 0.10,
+}
+# Inline validation is skipped when less than this is left.
+VALIDATION_MIN_SECONDS = float(os.getenv("VALIDATION_MIN_SECONDS", "3"))
+
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+# At most this share of calls may send a second request, so hedging cannot double the load.
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+_LATENCY_WINDOW = 200
+
+_deadline: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar("deadline", default=None)
+
+
+class Deadline:
+    """Absolute point in time a request must be answered by."""
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def budget(self, stage: str) -> float:
+        """Seconds ``stage`` may take: its share of the deadline, capped by the time left."""
+        share = STAGE_BUDGETS.get(stage)
+        if share is None:
+            return self.remaining()
+        return min(self.remaining(), share * self.seconds)
+
+
+@contextmanager
+def deadline_scope(seconds: float = REQUEST_DEADLINE_SECONDS) -> Iterator[Deadline]:
+    """Makes a new deadline current for the enclosed code (and tasks it starts)."""
+    deadline = Deadline(seconds)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a streaming generator finalized by the loop)
+            pass
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _deadline.get()
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    deadline = _deadline.get()
+    return default if deadline is None else deadline.remaining()
+
+
+def timeout_kwargs() -> Dict[str, float]:
+    """
+    ``timeout`` argument for an SDK request: the time left before the current
+    deadline, or nothing (the SDK default) outside a deadline scope.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return {}
+    # A zero timeout would fail before sending; leave the stage timeout to cut it off.
+    return {"timeout": max(deadline.remaining(), 0.1)}
+
+
+async def run_stage(stage: str, awaitable: Awaitable, default: Any = None) -> Any:
+    """
+    Awaits ``awaitable`` within the stage budget of the current deadline.
+
+    Returns:
+        Its result, or ``default`` when the budget ran out (the work is cancelled).
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return await awaitable
+    budget = deadline.budget(stage)
+    try:
+        return await asyncio.wait_for(awaitable, timeout=budget)
+    except asyncio.TimeoutError:
+        logger.warning("Stage '%s' exceeded its %.2fs budget; degrading", stage, budget)
+        return default
+
+
+class LatencyTracker:
+    """Rolling window of call durations per key."""
+
+    def __init__(self, window: int = _LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, key: str, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < min_samples or not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Hedger:
+    """
+    Hedged requests for idempotent calls.
+
+    Usage:
+        hedger = Hedger()
+        vector = await hedger.run("embedding", lambda: vectorize_async(text))
+    """
+
+    def __init__(
+        self,
+        quantile: float = HEDGE_QUANTILE,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        min_delay: float = HEDGE_MIN_DELAY,
+        max_ratio: float = HEDGE_MAX_RATIO,
+    ):
+        """
+        Args:
+            quantile: Latency quantile after which the second request is sent.
+            min_samples: Calls observed for a key before it is hedged at all.
+            min_delay: Lower bound on the hedge delay.
+            max_ratio: Largest share of calls that may be hedged.
+        """
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging ``key``, or None when it should not be hedged."""
+        if self.hedged >= self.max_ratio * self.calls:
+            return None
+        observed = self.latency.quantile(key, self.quantile, self.min_samples)
+        return None if observed is None else max(observed, self.min_delay)
+
+    async def _timed(self, key: str, factory: Callable[[], Awaitable]) -> Any:
+        started = time.perf_counter()
+        result = await factory()
+        self.latency.record(key, time.perf_counter() - started)
+        return result
+
+    async def run(self, key: str, factory: Callable[[], Awaitable]) -> Any:
+        """
+        Runs ``factory()`` and, if it is slower than the hedge delay for ``key``, a second
+        ``factory()`` alongside it.
+
+        Returns:
+            The result of the first attempt to succeed; raises if every attempt failed.
+        """
+        self.calls += 1
+        delay = self.delay(key)
+        first = asyncio.ensure_future(self._timed(key, factory))
+        if delay is None:
+            return await first
+        attempts = {first}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done:
+                return first.result()
+            self.hedged += 1
+            second = asyncio.ensure_future(self._timed(key, factory))
+            attempts.add(second)
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is second:
+                            self.hedge_wins += 1
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+        }
+
+
+# ``gather_within`` default that tells calls cut off by the time limit from other results
+DROPPED = object()
+
+
+async def gather_within(awaitables, timeout: Optional[float], default: Any = None) -> list:
+    """
+    Like ``asyncio.gather`` with a time limit that keeps whatever finished: results of
+    failed calls are None, those of calls still running when ``timeout`` passes are
+    ``default``, and the stragglers are cancelled.
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("Dropped %d of %d calls still running after %.2fs", len(pending), len(tasks), timeout)
+    return [
+        default if task in pending else task.result() if task.exception() is None else None
+        for task in tasks
+    ]
@@ -0,0 +1,176 @@
+"""
+Persistent, content-addressed embedding cache shared by ingestion and query paths.
+
+Entries are keyed by (model, dimensions, sha256(text)). A small in-memory LRU sits in
+front of an SQLite table on disk; the disk tier is bounded by entry count and evicts
+the least recently used rows first.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger("embedding_cache")
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096"))
+
+# Evict down to this fraction of the bound so eviction does not run on every insert.
+_EVICT_TO = 0.9
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + SQLite) cache of embedding vectors."""
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, dimensions: int, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}:{dimensions}:{digest}"
+
+    def _remember(self, key: str, blob: bytes):
+        self._memory[key] = blob
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, dimensions: int, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Look up several texts at once.
+
+        Returns:
+            A list aligned with ``texts`` holding the cached vector or None on a miss.
+        """
+        keys = [self.make_key(model, dimensions, text) for text in texts]
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            disk_keys = set()
+            for key in keys:
+                blob = self._memory.get(key)
+                if blob is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = blob
+                else:
+                    disk_keys.add(key)
+
+            if disk_keys:
+                placeholders = ",".join("?" * len(disk_keys))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", list(disk_keys)
+                ).fetchall()
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key, _ in rows]
+                )
+                self._db.commit()
+                for key, blob in rows:
+                    found[key] = blob
+                    self._remember(key, blob)
+
+            results = []
+            for key in keys:
+                blob = found.get(key)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    if key in disk_keys:
+                        self.hits_disk += 1
+                    else:
+                        self.hits_memory += 1
+                    results.append(_unpack(blob))
+        return results
+
+    def get(self, model: str, dimensions: int, text: str) -> Optional[List[float]]:
+        return self.get_many(model, dimensions, [text])[0]
+
+    def put_many(self, model: str, dimensions: int, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Store vectors for the given texts in both tiers and evict if over the bound."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(model, dimensions, text)
+                blob = _pack(vector)
+                self._remember(key, blob)
+                rows.append((key, blob, now))
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            self._entries += self._db.total_changes - before
+            self._db.commit()
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def put(self, model: str, dimensions: int, text: str, vector: Sequence[float]):
+        self.put_many(model, dimensions, [text], [vector])
+
+    def _evict(self):
+        target = int(self.max_entries * _EVICT_TO)
+        excess = self._entries - target
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (excess,),
+        )
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info("Embedding cache evicted %d entries (now %d)", excess, self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters since start-up plus the current disk entry count."""
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "entries": self._entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,223 @@
+"""
+Shared embedding client used by both document ingestion and query vectorization.
+
+Every call goes through the persistent ``EmbeddingCache``, so text that has been
+embedded before (re-ingested chunks, repeated questions) costs no API call. Cache
+misses are packed into batched requests bounded by input count and token total.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+import tiktoken
+from openai import AzureOpenAI, RateLimitError
+from dotenv import load_dotenv
+
+import async_clients
+from telemetry import record_cache, record_usage
+from deadlines import timeout_kwargs
+from embedding_cache import EmbeddingCache
+
+load_dotenv()
+
+logger = logging.getLogger("embedding_cache")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+# Azure OpenAI accepts up to 2048 inputs per request; 8191 tokens is the per-input limit.
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "4"))
+
+embedding_cache = EmbeddingCache()
+
+_client = None
+_api_requests = 0
+
+def get_embedding_client() -> AzureOpenAI:
+    global _client
+    if _client is None:
+        _client = AzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        )
+    return _client
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text, disallowed_special=()))
+
+def _truncate(text: str) -> str:
+    tokens = get_tokenizer().encode(text, disallowed_special=())
+    if len(tokens) <= EMBEDDING_MAX_INPUT_TOKENS:
+        return text
+    logger.warning("Truncating embedding input from %d to %d tokens", len(tokens), EMBEDDING_MAX_INPUT_TOKENS)
+    return get_tokenizer().decode(tokens[:EMBEDDING_MAX_INPUT_TOKENS])
+
+def _pack_batches(texts: Sequence[str]) -> List[List[int]]:
+    """Group text positions into batches bounded by input count and total tokens."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for position, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (
+            len(current) >= EMBEDDING_BATCH_MAX_INPUTS
+            or current_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS
+        ):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(position)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _embed_request(texts: List[str]) -> List[List[float]]:
+    global _api_requests
+    _api_requests += 1
+    response = get_embedding_client().embeddings.create(
+        input=texts,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS
+    )
+    record_usage(response.usage)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def _embed_with_retry(texts: List[str], attempt: int = 0) -> List[Optional[List[float]]]:
+    """
+    Embeds one batch. Rate limits back off and retry the whole batch; other failures
+    split the batch in half so a single bad input cannot sink its neighbours.
+    """
+    try:
+        return _embed_request(texts)
+    except RateLimitError:
+        if attempt >= EMBEDDING_MAX_RETRIES:
+            raise
+        time.sleep(2 ** attempt)
+        return _embed_with_retry(texts, attempt + 1)
+    except Exception as e:
+        if len(texts) > 1:
+            middle = len(texts) // 2
+            logger.warning("Embedding batch of %d failed (%s); splitting", len(texts), e)
+            return _embed_with_retry(texts[:middle]) + _embed_with_retry(texts[middle:])
+        if attempt < EMBEDDING_MAX_RETRIES:
+            time.sleep(2 ** attempt)
+            return _embed_with_retry(texts, attempt + 1)
+        logger.error("Embedding failed for input after %d retries: %s", attempt, e)
+        return [None]
+
+def _cache_lookup(texts: Sequence[str]):
+    """Returns (truncated texts, cached vectors aligned with them, distinct uncached texts)."""
+    texts = [_truncate(text) for text in texts]
+    cached = embedding_cache.get_many(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, texts)
+    pending = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    misses = sum(vector is None for vector in cached)
+    record_cache("embedding", len(texts) - misses, misses)
+    return texts, cached, pending
+
+def _cache_store(texts: List[str], vectors: List[Optional[List[float]]], embedded: Dict[str, List[float]]):
+    done = [(text, vector) for text, vector in zip(texts, vectors) if vector is not None]
+    if done:
+        embedding_cache.put_many(
+            EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, [t for t, _ in done], [v for _, v in done]
+        )
+        embedded.update(done)
+
+def vectorize_batch(texts: Sequence[str]) -> List[Optional[List[float]]]:
+    """
+    Returns embeddings for many texts, in input order, using as few requests as possible.
+
+    Cached texts are served locally, duplicates are embedded once, and the remaining
+    texts are packed into requests of at most EMBEDDING_BATCH_MAX_INPUTS inputs and
+    EMBEDDING_BATCH_MAX_TOKENS tokens.
+
+    Args:
+        texts: Chunk or question texts to embed.
+
+    Returns:
+        A list aligned with ``texts``; an entry is None if that text could not be embedded.
+    """
+    texts, cached, pending = _cache_lookup(texts)
+    if not pending:
+        return cached
+
+    embedded: Dict[str, List[float]] = {}
+    for batch in _pack_batches(pending):
+        batch_texts = [pending[position] for position in batch]
+        _cache_store(batch_texts, _embed_with_retry(batch_texts), embedded)
+
+    return [vector if vector is not None else embedded.get(text) for text, vector in zip(texts, cached)]
+
+def vectorize(text: str) -> Optional[List[float]]:
+    """
+    Returns the embedding for a single text, served from the cache when possible.
+
+    Args:
+        text: Chunk or question text to embed.
+
+    Returns:
+        The embedding vector as a list of floats, or None if embedding failed.
+    """
+    return vectorize_batch([text])[0]
+
+async def _embed_request_async(texts: List[str]) -> List[List[float]]:
+    global _api_requests
+    _api_requests += 1
+    response = await async_clients.get_embedding_client().embeddings.create(
+        input=texts,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,
+        **timeout_kwargs()
+    )
+    record_usage(response.usage)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def _embed_with_retry_async(texts: List[str], attempt: int = 0) -> List[Optional[List[float]]]:
+    """Async counterpart of ``_embed_with_retry`` with the same back-off/split policy."""
+    try:
+        return await _embed_request_async(texts)
+    except RateLimitError:
+        if attempt >= EMBEDDING_MAX_RETRIES:
+            raise
+        await asyncio.sleep(2 ** attempt)
+        return await _embed_with_retry_async(texts, attempt + 1)
+    except Exception as e:
+        if len(texts) > 1:
+            middle = len(texts) // 2
+            logger.warning("Embedding batch of %d failed (%s); splitting", len(texts), e)
+            return (await _embed_with_retry_async(texts[:middle])) + (await _embed_with_retry_async(texts[middle:]))
+        if attempt < EMBEDDING_MAX_RETRIES:
+            await asyncio.sleep(2 ** attempt)
+            return await _embed_with_retry_async(texts, attempt + 1)
+        logger.error("Embedding failed for input after %d retries: %s", attempt, e)
+        return [None]
+
+async def vectorize_batch_async(texts: Sequence[str]) -> List[Optional[List[float]]]:
+    """Async ``vectorize_batch`` on the shared async client; batches are sent concurrently."""
+    texts, cached, pending = _cache_lookup(texts)
+    if not pending:
+        return cached
+
+    batches = [[pending[position] for position in batch] for batch in _pack_batches(pending)]
+    results = await asyncio.gather(*(_embed_with_retry_async(batch) for batch in batches))
+    embedded: Dict[str, List[float]] = {}
+    for batch_texts, vectors in zip(batches, results):
+        _cache_store(batch_texts, vectors, embedded)
+
+    return [vector if vector is not None else embedded.get(text) for text, vector in zip(texts, cached)]
+
+async def vectorize_async(text: str) -> Optional[List[float]]:
+    return (await vectorize_batch_async([text]))[0]
+
+def cache_stats() -> dict:
+    return {**embedding_cache.stats(), "api_requests": _api_requests}
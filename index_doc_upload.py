@@ -4,7 +4,9 @@ from typing import List
 from azure.search.documents import SearchClient 
 from azure.search.documents.models import VectorizedQuery 
 from azure.core.credentials import AzureKeyCredential 
-from chunks import vectorize  
+from embeddings import vectorize_batch
+from index_search import get_search_client
+from bulk_uploader import BulkUploader
 from openai import AzureOpenAI 
 # import numpy as np 
 import os 
@@ -15,6 +17,8 @@ from dotenv import load_dotenv
 from pathlib import Path 
 import uuid
 import hashlib
+from bisect import bisect_right
+from functools import lru_cache
 
 load_dotenv()  
 
@@ -22,43 +26,96 @@ endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
 api_key = os.getenv("AZURE_SEARCH_API_KEY") 
 index = os.getenv("INDEX")   
 
-credential=AzureKeyCredential(api_key)  
+# Honours SEARCH_BACKEND / LOCAL_INDEXES, so ingestion can also populate the local index.
+search_client = get_search_client(index)
 
-search_client = SearchClient(     
-    endpoint=endpoint,      
-    index_name=index,      
-    credential=AzureKeyCredential(api_key)     
-)  
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+@lru_cache(maxsize=1)
+def get_text_splitter():
+    """Tokenizer-based splitter, built once per process (i.e. once per pool worker)."""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        add_start_index=True
+    )
+
+def iter_pages(document):
+    """Yield (page_number, text) for each page, 1-based, without holding the whole text."""
+    doc = fitz.open(document)
+    try:
+        for page_number, page in enumerate(doc, 1):
+            yield page_number, page.get_text()
+    finally:
+        doc.close()
 
 def extract_txt(document):     
-    doc = fitz.open(document)     
-    text = ""     
-    for page in doc:         
-        text += page.get_text()     
-    doc.close()     
-    return text  
+    return "".join(text for _, text in iter_pages(document))
 
 def chunks(text):     
     doc = Document(page_content=text)     
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(         
-        chunk_size=500,         
-        chunk_overlap=50         
-    )     
-    chunk = text_splitter.split_documents([doc])      
+    chunk = get_text_splitter().split_documents([doc])      
     return chunk  
 
-def vectorize(chunk):     
-    client = AzureOpenAI(         
-        api_key = os.getenv("AZURE_OPENAI_API_KEY"),           
-        api_version= os.getenv("AZURE_OPENAI_API_VERSION"),         
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")     
-    )     
-    response = client.embeddings.create(         
-        input = str(chunk),         
-        model = "text-embedding-3-small"     
-    )     
-    result_embedding = response.data[0].embedding      
-    return result_embedding  
+def _page_at(boundaries, offset):
+    """Page containing ``offset``, given sorted (start_offset, page_number) boundaries."""
+    position = bisect_right([start for start, _ in boundaries], offset) - 1
+    return boundaries[max(position, 0)][1]
+
+def iter_chunks(document):
+    """
+    Stream chunks page by page, carrying only the unfinished tail across pages.
+    
+    Each page is appended to the tail left over from the previous pages and split;
+    every piece but the last is final and is yielded straight away, the last piece
+    (at most one chunk long) becomes the new tail. Memory therefore stays bounded by
+    one page plus one chunk, however large the PDF is.
+    
+    Args:
+        document: Path to the PDF file
+    
+    Yields:
+        Document chunks with "page_start" and "page_end" (1-based) in their metadata
+    """
+    splitter = get_text_splitter()
+    tail = ""
+    boundaries = []  # (offset in tail, page number) for each page present in the tail
+    
+    def with_pages(piece, buffer_boundaries):
+        start = max(piece.metadata.get("start_index", 0), 0)
+        end = start + max(len(piece.page_content) - 1, 0)
+        return Document(
+            page_content=piece.page_content,
+            metadata={
+                "page_start": _page_at(buffer_boundaries, start),
+                "page_end": _page_at(buffer_boundaries, end)
+            }
+        )
+    
+    for page_number, text in iter_pages(document):
+        if not text.strip():
+            continue
+        buffer_boundaries = boundaries + [(len(tail), page_number)]
+        buffer = tail + text
+        pieces = splitter.create_documents([buffer])
+        if not pieces:
+            continue
+        for piece in pieces[:-1]:
+            yield with_pages(piece, buffer_boundaries)
+        
+        tail_start = pieces[-1].metadata.get("start_index", -1)
+        if tail_start < 0:
+            # Offset unknown: fall back to re-splitting just the last piece's text
+            tail_start = max(buffer.rfind(pieces[-1].page_content), 0)
+        tail = buffer[tail_start:]
+        boundaries = [(0, _page_at(buffer_boundaries, tail_start))] + [
+            (start - tail_start, page) for start, page in buffer_boundaries if start > tail_start
+        ]
+    
+    if tail.strip():
+        for piece in splitter.create_documents([tail]):
+            yield with_pages(piece, boundaries)
 
 def sanitize_filename(filename):
     """
@@ -74,7 +131,7 @@ def sanitize_filename(filename):
         sanitized = f"doc_{sanitized}" 
     return sanitized
 
-def generate_unique_id(file_path, chunk_index, method="filename_index"):
+def generate_unique_id(file_path, chunk_index, method="filename_index", chunk_text=None):
     """
     Generate unique ID using different methods - Azure Search key compliant
     
@@ -82,6 +139,7 @@ def generate_unique_id(file_path, chunk_index, method="filename_index"):
         file_path: Path to the PDF file
         chunk_index: Index of the chunk within the document
         method: Method to use for ID generation
+        chunk_text: Chunk content, required by the "content_hash" method
     
     Returns:
         Unique string ID (Azure Search compliant)
@@ -101,10 +159,13 @@ def generate_unique_id(file_path, chunk_index, method="filename_index"):
         return f"{file_name}_{timestamp}_{chunk_index:04d}"
     elif method == "simple_counter":
         return f"doc_{abs(hash(str(file_path)))%100000:05d}_{chunk_index:04d}"
+    elif method == "content_hash":
+        # Stable across re-chunking: an unchanged chunk keeps its ID wherever it moves
+        return f"{file_name}_{hashlib.sha256(chunk_text.encode()).hexdigest()[:16]}"
     else:
         return f"{file_name}_chunk_{chunk_index:04d}"
 
-def document_upload(chunks_list, file_path, id_method="filename_index"):     
+def document_upload(chunks_list, file_path, id_method="filename_index", uploader=None):     
     """
     Upload document chunks with unique IDs
     
@@ -112,67 +173,60 @@ def document_upload(chunks_list, file_path, id_method="filename_index"):
         chunks_list: List of document chunks
         file_path: Path to the source PDF file
         id_method: Method to use for generating unique IDs
+        uploader: Shared BulkUploader; when omitted a private one is created and drained
+    
+    Returns:
+        Number of chunks uploaded, or queued when a shared uploader is passed
     """
-    uploaded_count = 0
+    owns_uploader = uploader is None
+    if owns_uploader:
+        uploader = BulkUploader(search_client)
+    queued_count = 0
+    vectors = vectorize_batch([chunk.page_content for chunk in chunks_list])
     
-    for chunk_index, chunk in enumerate(chunks_list, 1):
+    for chunk_index, (chunk, vector) in enumerate(zip(chunks_list, vectors), 1):
         
         unique_id = generate_unique_id(file_path, chunk_index, method=id_method)
+        if vector is None:
+            print(f"Error embedding chunk {chunk_index} from {Path(file_path).name}; skipped")
+            continue
         
         document = {             
             "id": unique_id,  
             "chunks": chunk.page_content,             
-            "embeddings": vectorize(chunk.page_content),             
+            "embeddings": vector,             
             "category": ["drugs","decisions"]  
         }
-        
-        try:
-            result = search_client.upload_documents(documents=[document])
-            uploaded_count += 1
-            print(f"File: {Path(file_path).name} | Chunk: {chunk_index} | ID: {unique_id} | Status: Success")
-        except Exception as e:
-            print(f"Error uploading chunk {chunk_index} from {Path(file_path).name}: {e}")
+        uploader.add(document)
+        queued_count += 1
     
-    print(f"Upload complete for {Path(file_path).name}! Uploaded {uploaded_count} chunks.")
-    return uploaded_count
-
-def upload_documents_From_folder():          
-    folder_path = Path("Your folder path")     
-    pdf_files = list(folder_path.glob("*.pdf"))
+    if not owns_uploader:
+        print(f"Queued {queued_count} chunks from {Path(file_path).name}")
+        return queued_count
     
-    total_uploaded = 0
-    processed_files = 0
+    stats = uploader.close()
+    for key, error in uploader.failed_keys.items():
+        print(f"Error uploading {key} from {Path(file_path).name}: {error}")
+    print(f"Upload complete for {Path(file_path).name}! Uploaded {stats['uploaded']} chunks "
+          f"({stats['docs_per_second']:.1f} docs/s).")
+    return stats["uploaded"]
+
+def upload_documents_From_folder(folder_path="Your folder path", **pipeline_options):
+    """
+    Ingest every PDF in a folder through the staged pipeline (see ingest_pipeline.py)
     
-    print(f"Found {len(pdf_files)} PDF files to process...")
+    Args:
+        folder_path: Folder containing the PDF files
+        pipeline_options: Per-stage concurrency, queue sizes and incremental mode for IngestionPipeline
     
-    for pdf_index, pdf in enumerate(pdf_files, 1):         
-        print(f"\n{'='*50}")
-        print(f"Processing file {pdf_index}/{len(pdf_files)}: {pdf.name}")
-        print(f"{'='*50}")
-        
-        try:
-            text = extract_txt(pdf)
-            if not text.strip():
-                print(f"Warning: No text extracted from {pdf.name}")
-                continue
-                
-            chunk_list = chunks(text)
-            print(f"Created {len(chunk_list)} chunks from {pdf.name}")
-        
-            uploaded = document_upload(chunk_list, pdf, id_method="filename_index")
-            
-            total_uploaded += uploaded
-            processed_files += 1
-            
-        except Exception as e:
-            print(f"Error processing {pdf.name}: {e}")
+    Returns:
+        Summary dict with counts, stage timings and throughput
+    """
+    from ingest_pipeline import run_pipeline
     
-    print(f"\n{'='*60}")
-    print(f"UPLOAD SUMMARY")
-    print(f"{'='*60}")
-    print(f"Files processed: {processed_files}/{len(pdf_files)}")
-    print(f"Total chunks uploaded: {total_uploaded}")
-    print(f"Upload complete!")
+    pdf_files = list(Path(folder_path).glob("*.pdf"))
+    print(f"Found {len(pdf_files)} PDF files to process...")
+    return run_pipeline(pdf_files, folders=[Path(folder_path)], **pipeline_options)
 
 class DocumentUploader:
     def __init__(self):
@@ -186,26 +240,27 @@ class DocumentUploader:
     
     def upload_with_global_counter(self, chunks_list, file_path):
         """Upload using global counter for IDs"""
-        uploaded_count = 0
+        uploader = BulkUploader(search_client)
+        vectors = vectorize_batch([chunk.page_content for chunk in chunks_list])
         
-        for chunk in chunks_list:
+        for chunk, vector in zip(chunks_list, vectors):
             unique_id = self.generate_global_unique_id(file_path)
+            if vector is None:
+                print(f"Error embedding {unique_id}; skipped")
+                continue
             
             document = {
                 "id": unique_id,
                 "chunks": chunk.page_content,
-                "embeddings": vectorize(chunk.page_content),
+                "embeddings": vector,
                 "doc_category": "familyCode_decisions"
             }
-            
-            try:
-                result = search_client.upload_documents(documents=[document])
-                uploaded_count += 1
-                print(f"Global ID: {unique_id} | Status: Success")
-            except Exception as e:
-                print(f"Error uploading {unique_id}: {e}")
+            uploader.add(document)
         
-        return uploaded_count
+        stats = uploader.close()
+        for key, error in uploader.failed_keys.items():
+            print(f"Error uploading {key}: {error}")
+        return stats["uploaded"]
 
 if __name__ == "__main__":    
     upload_documents_From_folder()    
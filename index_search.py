@@ -5,11 +5,14 @@ connection reuse, environment safety, and performance optimizations.
 
 import os
 import logging
-from typing import List
+from typing import List, Sequence
 from azure.search.documents import SearchClient
 from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
-from chunks import vectorize
+from embeddings import vectorize, vectorize_async, vectorize_batch, vectorize_batch_async
+from local_index import LocalVectorIndex
+from keyword_index import BM25Index, is_keyword_query, reciprocal_rank_fusion
+import async_clients
 
 logger = logging.getLogger("vector_search")
 logger.setLevel(logging.INFO)
@@ -21,32 +24,86 @@ logger.addHandler(handler)
 endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
 api_key = os.getenv("AZURE_SEARCH_API_KEY")
 
-if not endpoint or not api_key:
+# "azure" (default) or "local"; LOCAL_INDEXES pins individual hot KBs to the local backend.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "azure").lower()
+LOCAL_INDEXES = {name.strip() for name in os.getenv("LOCAL_INDEXES", "").split(",") if name.strip()}
+# "auto" (default): use the local BM25 index wherever ingestion built one; "off": never
+KEYWORD_SEARCH = os.getenv("KEYWORD_SEARCH", "auto").lower()
+
+if SEARCH_BACKEND != "local" and (not endpoint or not api_key):
     raise EnvironmentError("AZURE_SEARCH_ENDPOINT or AZURE_SEARCH_API_KEY not set in environment.")
 
 _client_cache = {}
 
-def get_search_client(index_name: str) -> SearchClient:
+def use_local_backend(index_name: str) -> bool:
+    return SEARCH_BACKEND == "local" or index_name in LOCAL_INDEXES
+
+def get_search_client(index_name: str):
+    """
+    Returns a cached search client for the index: an Azure ``SearchClient`` or,
+    for locally served indexes, a ``LocalVectorIndex`` exposing the same calls.
+    """
     if index_name not in _client_cache:
-        _client_cache[index_name] = SearchClient(
-            endpoint=endpoint,
-            index_name=index_name,
-            credential=AzureKeyCredential(api_key)
-        )
+        if use_local_backend(index_name):
+            _client_cache[index_name] = LocalVectorIndex(index_name)
+        else:
+            _client_cache[index_name] = SearchClient(
+                endpoint=endpoint,
+                index_name=index_name,
+                credential=AzureKeyCredential(api_key)
+            )
     return _client_cache[index_name]
 
+_keyword_cache = {}
+
+def get_keyword_index(index_name: str):
+    """
+    Returns the local BM25 index for ``index_name``, or None if there is none. The index
+    is reloaded when ingestion has saved a newer version.
+    """
+    if KEYWORD_SEARCH == "off":
+        return None
+    mtime = BM25Index.saved_mtime(index_name)
+    cached = _keyword_cache.get(index_name)
+    if cached is None or cached[0] != mtime:
+        cached = _keyword_cache[index_name] = (mtime, BM25Index(index_name) if mtime is not None else None)
+    return cached[1]
+
+def _keyword_only(question: str, index: str, top: int = 5) -> List[str]:
+    """Exact-term questions are answered from the keyword index alone, without embedding."""
+    keyword_index = get_keyword_index(index)
+    if keyword_index is None or not is_keyword_query(question):
+        return []
+    chunks = keyword_index.search_chunks(question, top)
+    if chunks:
+        logger.info("Keyword search answered question: '%s' | Results: %d", question, len(chunks))
+    return chunks
+
+def _fuse_keyword(questions: List[str], index: str, chunks: List[str], top: int) -> List[str]:
+    """Reciprocal rank fusion of vector results with BM25 results for each question."""
+    keyword_index = get_keyword_index(index)
+    if keyword_index is None:
+        return chunks
+    rankings = [chunks] + [keyword_index.search_chunks(question, top) for question in questions]
+    return reciprocal_rank_fusion(rankings)[:top * len(questions)]
+
 def qstn_vectorize(question: str, index: str) -> List[str]:
     """
-    Fetches top 5 relevant context chunks from Azure Search using vector similarity.
+    Fetches top 5 relevant context chunks using vector similarity, from Azure Search
+    or from the local index backend.
 
     Args:
         question: The user input/question.
-        index: The name of the Azure Search index.
+        index: The name of the search index.
 
     Returns:
         List of string chunks as context.
     """
     try:
+        chunks = _keyword_only(question, index)
+        if chunks:
+            return chunks
+
         search_client = get_search_client(index)
 
         question_vector = vectorize(question)
@@ -67,6 +124,55 @@ def qstn_vectorize(question: str, index: str) -> List[str]:
         )
 
         chunks = [result["chunks"] for result in results if "chunks" in result]
+        chunks = _fuse_keyword([question], index, chunks, 5)
+        logger.info("Vector search succeeded for question: '%s' | Results: %d", question, len(chunks))
+        return chunks
+
+    except Exception as e:
+        logger.exception("Error during vector search for question '%s' on index '%s': %s", question, index, str(e))
+        return []
+
+async def qstn_vectorize_async(question: str, index: str) -> List[str]:
+    """
+    Async variant of ``qstn_vectorize`` using the shared async embedding and search
+    clients. Locally served indexes are searched in-process.
+
+    Args:
+        question: The user input/question.
+        index: The name of the search index.
+
+    Returns:
+        List of string chunks as context.
+    """
+    try:
+        chunks = _keyword_only(question, index)
+        if chunks:
+            return chunks
+
+        question_vector = await vectorize_async(question)
+        if not question_vector:
+            logger.warning("Vectorization failed for question: %s", question)
+            return []
+
+        vector_query = VectorizedQuery(
+            vector=question_vector,
+            fields="embeddings"
+        )
+        search_kwargs = dict(
+            search_text=question,
+            vector_queries=[vector_query],
+            search_fields=["chunks"],
+            top=5
+        )
+
+        if use_local_backend(index):
+            results = get_search_client(index).search(**search_kwargs)
+            chunks = [result["chunks"] for result in results if "chunks" in result]
+        else:
+            results = await async_clients.get_search_client(index).search(**search_kwargs)
+            chunks = [result["chunks"] async for result in results if "chunks" in result]
+
+        chunks = _fuse_keyword([question], index, chunks, 5)
         logger.info("Vector search succeeded for question: '%s' | Results: %d", question, len(chunks))
         return chunks
 
@@ -74,6 +180,82 @@ def qstn_vectorize(question: str, index: str) -> List[str]:
         logger.exception("Error during vector search for question '%s' on index '%s': %s", question, index, str(e))
         return []
 
+def _multi_search_kwargs(questions: Sequence[str], vectors, top: int) -> dict:
+    vector_queries = [
+        VectorizedQuery(vector=vector, k_nearest_neighbors=top, fields="embeddings")
+        for vector in vectors if vector
+    ]
+    return dict(
+        search_text=" ".join(questions),
+        vector_queries=vector_queries,
+        search_fields=["chunks"],
+        top=top * len(vector_queries)
+    )
+
+def qstn_vectorize_multi(questions: Sequence[str], index: str, top: int = 5) -> List[str]:
+    """
+    Retrieves context for several questions against one index in a single request:
+    the questions are embedded in one batch and sent as one multi-vector search.
+
+    Args:
+        questions: Distinct questions targeting ``index``.
+        index: The name of the search index.
+        top: Results per question.
+
+    Returns:
+        List of string chunks as context, without duplicates.
+    """
+    try:
+        vectors = vectorize_batch(list(questions))
+        search_kwargs = _multi_search_kwargs(questions, vectors, top)
+        if not search_kwargs["vector_queries"]:
+            logger.warning("Vectorization failed for questions: %s", questions)
+            return []
+
+        results = get_search_client(index).search(**search_kwargs)
+        chunks = list(dict.fromkeys(result["chunks"] for result in results if "chunks" in result))
+        chunks = _fuse_keyword(list(questions), index, chunks, top)
+        logger.info("Multi-vector search succeeded for %d questions | Results: %d", len(questions), len(chunks))
+        return chunks
+
+    except Exception as e:
+        logger.exception("Error during multi-vector search on index '%s': %s", index, str(e))
+        return []
+
+async def qstn_vectorize_multi_async(questions: Sequence[str], index: str, top: int = 5) -> List[str]:
+    """
+    Async variant of ``qstn_vectorize_multi``.
+
+    Args:
+        questions: Distinct questions targeting ``index``.
+        index: The name of the search index.
+        top: Results per question.
+
+    Returns:
+        List of string chunks as context, without duplicates.
+    """
+    try:
+        vectors = await vectorize_batch_async(list(questions))
+        search_kwargs = _multi_search_kwargs(questions, vectors, top)
+        if not search_kwargs["vector_queries"]:
+            logger.warning("Vectorization failed for questions: %s", questions)
+            return []
+
+        if use_local_backend(index):
+            results = get_search_client(index).search(**search_kwargs)
+            chunks = [result["chunks"] for result in results if "chunks" in result]
+        else:
+            results = await async_clients.get_search_client(index).search(**search_kwargs)
+            chunks = [result["chunks"] async for result in results if "chunks" in result]
+
+        chunks = _fuse_keyword(list(questions), index, list(dict.fromkeys(chunks)), top)
+        logger.info("Multi-vector search succeeded for %d questions | Results: %d", len(questions), len(chunks))
+        return chunks
+
+    except Exception as e:
+        logger.exception("Error during multi-vector search on index '%s': %s", index, str(e))
+        return []
+
 # print(qstn_vectorize("How to make a cookie","junaidh-text-bake"))
 
 
@@ -0,0 +1,170 @@
+"""
+Local manifest that makes folder ingestion incremental and resumable.
+
+For every ingested file the manifest stores its sha256, mtime and size, plus the IDs
+of the chunks that the index has acknowledged. Chunk IDs are content-addressed
+(``generate_unique_id(..., method="content_hash")``), so on a rerun:
+
+    - files whose mtime/size (or, failing that, hash) match a committed entry are skipped;
+    - only chunks whose ID the index has not acknowledged are embedded and uploaded;
+    - previously acknowledged IDs that no longer occur in the file are deleted as stale.
+
+Chunk IDs are recorded per acknowledged upload batch, and a file is only marked
+committed once all of its chunks are in, so a crashed run resumes where it stopped.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "ingest_manifest.sqlite3")
+
+
+@dataclass
+class FileState:
+    path: str
+    sha256: str
+    mtime: float
+    size: int
+
+
+def file_sha256(path, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """SQLite-backed record of ingested files and acknowledged chunk IDs for one index."""
+
+    def __init__(self, index_name: str, path: str = INGEST_MANIFEST_PATH):
+        self.index_name = index_name
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                index_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                committed INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (index_name, path)
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                index_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (index_name, path, chunk_id)
+            );
+            """
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _key(path) -> str:
+        return str(Path(path).resolve())
+
+    def check_file(self, path) -> Optional[FileState]:
+        """
+        Returns None if the file is unchanged since its last committed ingestion,
+        otherwise the file's current state (to be passed to ``commit_file``).
+        """
+        key = self._key(path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, mtime, size, committed FROM files WHERE index_name = ? AND path = ?",
+                (self.index_name, key),
+            ).fetchone()
+        if row and row[3] and row[1] == stat.st_mtime and row[2] == stat.st_size:
+            return None
+
+        sha = file_sha256(path)
+        if row and row[3] and row[0] == sha:
+            with self._lock:
+                self._db.execute(
+                    "UPDATE files SET mtime = ?, size = ?, updated_at = ? WHERE index_name = ? AND path = ?",
+                    (stat.st_mtime, stat.st_size, time.time(), self.index_name, key),
+                )
+                self._db.commit()
+            return None
+        return FileState(path=key, sha256=sha, mtime=stat.st_mtime, size=stat.st_size)
+
+    def uploaded_ids(self, path) -> Set[str]:
+        """Chunk IDs of this file that the index has acknowledged, committed or not."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chunk_id FROM chunks WHERE index_name = ? AND path = ?",
+                (self.index_name, self._key(path)),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record_chunks(self, path, chunk_ids: Iterable[str]):
+        """Record chunk IDs acknowledged by the index (called once per upload batch)."""
+        key = self._key(path)
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO chunks (index_name, path, chunk_id) VALUES (?, ?, ?)",
+                [(self.index_name, key, chunk_id) for chunk_id in chunk_ids],
+            )
+            self._db.commit()
+
+    def commit_file(self, state: FileState, chunk_ids: Iterable[str]):
+        """Mark the file ingested with exactly ``chunk_ids`` as its live chunks."""
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM chunks WHERE index_name = ? AND path = ?", (self.index_name, state.path)
+            )
+            self._db.executemany(
+                "INSERT INTO chunks (index_name, path, chunk_id) VALUES (?, ?, ?)",
+                [(self.index_name, state.path, chunk_id) for chunk_id in chunk_ids],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (index_name, path, sha256, mtime, size, committed, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?)",
+                (self.index_name, state.path, state.sha256, state.mtime, state.size, time.time()),
+            )
+            self._db.commit()
+
+    def missing_files(self, folders: Iterable, present: Iterable) -> Dict[str, Set[str]]:
+        """
+        Files recorded under ``folders`` that are no longer in ``present``.
+
+        Returns:
+            Mapping of manifest path -> chunk IDs that should be deleted from the index.
+        """
+        folders = [self._key(folder) for folder in folders]
+        present = {self._key(path) for path in present}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM files WHERE index_name = ?", (self.index_name,)
+            ).fetchall()
+        missing = [
+            path for (path,) in rows
+            if path not in present and str(Path(path).parent) in folders
+        ]
+        return {path: self.uploaded_ids(path) for path in missing}
+
+    def forget_file(self, path):
+        key = self._key(path)
+        with self._lock:
+            self._db.execute("DELETE FROM chunks WHERE index_name = ? AND path = ?", (self.index_name, key))
+            self._db.execute("DELETE FROM files WHERE index_name = ? AND path = ?", (self.index_name, key))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
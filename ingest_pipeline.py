@@ -0,0 +1,528 @@
+"""
+Staged, overlapping ingestion pipeline for folders of PDFs.
+
+    extract + chunk  ->  embed  ->  upload
+    (process pool)      (threads)   (BulkUploader flushes)
+
+Extraction workers stream chunks page by page (``iter_chunks``) in small batches, so
+embedding and upload of a large PDF start long before the PDF is fully read. Stages
+are joined by bounded queues, so a slow downstream stage pushes back on the ones
+before it and memory stays flat regardless of folder or file size.
+
+In incremental mode (the default) an ``IngestManifest`` skips unchanged files, only
+embeds and uploads chunks the index has not acknowledged yet, and deletes stale chunk
+IDs once a changed file is fully uploaded.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from answer_cache import bump_index_version
+from bulk_uploader import BulkUploader, UPLOAD_MAX_CONCURRENT_FLUSHES, delete_documents_by_key
+from embeddings import vectorize_batch, cache_stats
+from index_doc_upload import iter_chunks, generate_unique_id, search_client, index
+from ingest_manifest import IngestManifest
+from keyword_index import BM25Index, KeywordMirror
+from local_index import LocalVectorIndex
+
+logger = logging.getLogger("ingest_pipeline")
+
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+INGEST_CHUNK_BATCH = int(os.getenv("INGEST_CHUNK_BATCH", "64"))
+# Upload page_start/page_end with each chunk. Opt-in: an index created before those
+# fields were added to create_index.py rejects every document that carries them.
+INDEX_PAGE_FIELDS = os.getenv("INDEX_PAGE_FIELDS", "false").lower() in ("1", "true", "yes")
+# Maintain the local BM25 keyword index (keyword_index.py) alongside the search index
+INGEST_KEYWORD_INDEX = os.getenv("INGEST_KEYWORD_INDEX", "true").lower() in ("1", "true", "yes")
+
+_DONE = object()
+
+
+def _stream_chunks(pdf_path: str, out_queue, batch_size: int):
+    """
+    Process-pool worker: streams ("part", path, first_chunk_index, [(text, page_start, page_end)])
+    batches followed by one ("end", path, None, error_or_None) message.
+    """
+    batch = []
+    first_index = 1
+    try:
+        for chunk in iter_chunks(pdf_path):
+            batch.append((chunk.page_content, chunk.metadata["page_start"], chunk.metadata["page_end"]))
+            if len(batch) >= batch_size:
+                out_queue.put(("part", pdf_path, first_index, batch))
+                first_index += len(batch)
+                batch = []
+        if batch:
+            out_queue.put(("part", pdf_path, first_index, batch))
+        out_queue.put(("end", pdf_path, None, None))
+    except Exception as e:
+        out_queue.put(("end", pdf_path, None, str(e)))
+
+
+class IngestionPipeline:
+    """
+    Runs extraction, embedding and upload concurrently over a list of PDFs.
+
+    Args:
+        extract_workers: Processes used for CPU-bound text extraction and chunking.
+        embed_workers: Threads issuing batched embedding requests.
+        upload_concurrency: Concurrent index flushes in the BulkUploader.
+        queue_size: Capacity (in chunk batches) of each inter-stage queue.
+        chunk_batch: Chunks per batch streamed from an extraction worker.
+        id_method: Passed through to ``generate_unique_id``; incremental runs always
+            use "content_hash" so unchanged chunks keep their IDs.
+        incremental: Skip unchanged files and chunks using an ``IngestManifest``.
+        manifest: Manifest to use instead of the default one for the target index.
+        keyword_index: Keep the local BM25 index in step with every acknowledged
+            upload and delete.
+    """
+
+    def __init__(
+        self,
+        extract_workers: int = INGEST_EXTRACT_WORKERS,
+        embed_workers: int = INGEST_EMBED_WORKERS,
+        upload_concurrency: int = UPLOAD_MAX_CONCURRENT_FLUSHES,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        chunk_batch: int = INGEST_CHUNK_BATCH,
+        id_method: str = "filename_index",
+        client=None,
+        incremental: bool = True,
+        manifest: Optional[IngestManifest] = None,
+        keyword_index: bool = INGEST_KEYWORD_INDEX,
+    ):
+        self.extract_workers = extract_workers
+        self.embed_workers = embed_workers
+        self.upload_concurrency = upload_concurrency
+        self.queue_size = queue_size
+        self.chunk_batch = chunk_batch
+        self.client = client if client is not None else search_client
+        self.keyword_index = None
+        if keyword_index:
+            self.keyword_index = BM25Index(index)
+            self.client = KeywordMirror(self.client, self.keyword_index)
+        self.manifest = None
+        self.id_method = id_method
+        if incremental:
+            self.manifest = manifest if manifest is not None else IngestManifest(index)
+            self.id_method = "content_hash"
+
+        self._chunk_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._document_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._counters = {
+            "files": 0, "skipped_files": 0, "empty_files": 0, "failed_files": 0,
+            "chunks": 0, "reused_chunks": 0, "embedded": 0, "stale_deleted": 0,
+        }
+        self._stage_seconds = {"extract": 0.0, "embed": 0.0, "upload": 0.0}
+        self._total_files = 0
+        # Per-file bookkeeping, keyed by str(path):
+        #   _known_ids: acknowledged IDs at first sight + IDs already planned this run
+        #   _tracked:   chunk IDs, outstanding keys and part counts until the file is committed
+        self._known_ids: Dict[str, dict] = {}
+        self._tracked: Dict[str, dict] = {}
+        self._key_owner: Dict[str, str] = {}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _busy(self, stage: str, seconds: float):
+        with self._lock:
+            self._stage_seconds[stage] += seconds
+
+    # ------------------------------------------------------------------ stages
+
+    def _extract_stage(self, pdf_files: Sequence[Path]):
+        try:
+            self._extract_files(pdf_files)
+        finally:
+            for _ in range(self.embed_workers):
+                self._chunk_queue.put(_DONE)
+
+    def _extract_files(self, pdf_files: Sequence[Path]):
+        manager = multiprocessing.Manager()
+        try:
+            # Bounded, so extraction workers block once embedding falls behind
+            out_queue = manager.Queue(maxsize=self.queue_size)
+            in_flight: Dict[str, dict] = {}
+            files = iter(pdf_files)
+            with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+                try:
+                    self._dispatch(pool, files, out_queue, in_flight)
+                except BaseException as e:
+                    self._abort_extraction(out_queue, in_flight, e)
+                    raise
+        finally:
+            manager.shutdown()
+
+    def _dispatch(self, pool: ProcessPoolExecutor, files: Iterator[Path], out_queue, in_flight: Dict[str, dict]):
+        """Keeps ``extract_workers`` files in the pool and forwards their messages to the embed stage."""
+        while True:
+            while len(in_flight) < self.extract_workers:
+                pdf = next(files, None)
+                if pdf is None:
+                    break
+                state = None
+                if self.manifest is not None:
+                    try:
+                        state = self.manifest.check_file(pdf)
+                    except Exception as e:
+                        # E.g. deleted since it was listed: a failed file, not a failed run
+                        self._chunk_queue.put(("end", pdf, None, 0, str(e)))
+                        continue
+                    if state is None:
+                        self._count("skipped_files")
+                        continue
+                in_flight[str(pdf)] = {
+                    "pdf": pdf, "state": state, "parts": 0, "started": time.perf_counter(),
+                    "future": pool.submit(_stream_chunks, str(pdf), out_queue, self.chunk_batch),
+                }
+            if not in_flight:
+                return
+
+            try:
+                kind, path, first_index, payload = out_queue.get(timeout=1.0)
+            except queue.Empty:
+                self._reap_crashed_workers(in_flight)
+                continue
+            entry = in_flight.get(path)
+            if entry is None:
+                continue
+            if kind == "part":
+                entry["parts"] += 1
+                self._count("chunks", len(payload))
+                self._chunk_queue.put(("part", entry["pdf"], entry["state"], first_index, payload))
+            else:
+                del in_flight[path]
+                self._busy("extract", time.perf_counter() - entry["started"])
+                self._chunk_queue.put(("end", entry["pdf"], entry["state"], entry["parts"], payload))
+
+    def _abort_extraction(self, out_queue, in_flight: Dict[str, dict], error: BaseException):
+        """
+        Cancels queued extractions and drains the bounded queue until the running ones
+        finish; a worker blocked on a full queue would otherwise keep the pool's exit
+        waiting forever. Files still in flight are closed out as failed.
+        """
+        futures = [entry["future"] for entry in in_flight.values()]
+        for future in futures:
+            future.cancel()
+        while not all(future.done() for future in futures):
+            try:
+                out_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for entry in in_flight.values():
+            self._chunk_queue.put(("end", entry["pdf"], entry["state"], entry["parts"], f"extraction aborted: {error!r}"))
+        in_flight.clear()
+
+    def _reap_crashed_workers(self, in_flight: Dict[str, dict]):
+        """A worker process that died never sends its "end" message; close those files out."""
+        for path, entry in list(in_flight.items()):
+            future = entry["future"]
+            if future.done() and future.exception() is not None:
+                del in_flight[path]
+                self._chunk_queue.put(("end", entry["pdf"], entry["state"], entry["parts"], str(future.exception())))
+
+    def _plan_part(self, pdf: Path, chunk_ids: List[str]) -> List[int]:
+        """Positions in ``chunk_ids`` that still need embedding and uploading."""
+        if self.manifest is None:
+            return list(range(len(chunk_ids)))
+        path = str(pdf)
+        with self._lock:
+            known = self._known_ids.get(path)
+            if known is None:
+                known = self._known_ids[path] = {"uploaded": self.manifest.uploaded_ids(pdf), "seen": set()}
+            pending = []
+            for position, chunk_id in enumerate(chunk_ids):
+                if chunk_id in known["uploaded"] or chunk_id in known["seen"]:
+                    continue
+                known["seen"].add(chunk_id)
+                pending.append(position)
+            self._counters["reused_chunks"] += len(chunk_ids) - len(pending)
+        return pending
+
+    def _restore_keywords(self, chunk_ids: List[str], payload: list, pending: List[int]):
+        """
+        Chunks the index acknowledged in a run that crashed before the BM25 index was
+        saved are skipped now; index their text again so the two stores agree.
+        """
+        if self.keyword_index is None or len(pending) == len(chunk_ids):
+            return
+        pending = set(pending)
+        missing = [
+            {"id": chunk_id, "chunks": payload[position][0]}
+            for position, chunk_id in enumerate(chunk_ids)
+            if position not in pending and chunk_id not in self.keyword_index
+        ]
+        if missing:
+            self.keyword_index.add_documents(missing)
+
+    def _embed_stage(self):
+        while True:
+            item = self._chunk_queue.get()
+            if item is _DONE:
+                self._document_queue.put(_DONE)
+                return
+            kind, pdf, state, first_index, payload = item
+            if kind == "end":
+                self._document_queue.put(item)
+                continue
+
+            chunk_ids = [
+                generate_unique_id(pdf, first_index + offset, method=self.id_method, chunk_text=text)
+                for offset, (text, _, _) in enumerate(payload)
+            ]
+            pending = self._plan_part(pdf, chunk_ids)
+            self._restore_keywords(chunk_ids, payload, pending)
+
+            started = time.perf_counter()
+            try:
+                vectors = vectorize_batch([payload[position][0] for position in pending]) if pending else []
+            except Exception as e:
+                print(f"Error embedding chunks from {pdf.name}: {e}")
+                vectors = [None] * len(pending)
+            finally:
+                self._busy("embed", time.perf_counter() - started)
+
+            documents = []
+            for position, vector in zip(pending, vectors):
+                if vector is None:
+                    print(f"Error embedding chunk {first_index + position} from {pdf.name}; skipped")
+                    continue
+                text, page_start, page_end = payload[position]
+                document = {
+                    "id": chunk_ids[position],
+                    "chunks": text,
+                    "embeddings": vector,
+                    "category": ["drugs", "decisions"]
+                }
+                if INDEX_PAGE_FIELDS:
+                    document["page_start"] = page_start
+                    document["page_end"] = page_end
+                documents.append(document)
+            self._count("embedded", len(documents))
+            complete = len(documents) == len(pending)
+            self._document_queue.put(("part", pdf, state, (chunk_ids, complete), documents))
+
+    def _upload_stage(self, uploader: BulkUploader):
+        finished_embedders = 0
+        while finished_embedders < self.embed_workers:
+            item = self._document_queue.get()
+            if item is _DONE:
+                finished_embedders += 1
+                continue
+            kind, pdf, state, value, payload = item
+            started = time.perf_counter()
+            if kind == "part":
+                chunk_ids, complete = value
+                self._track_part(pdf, state, chunk_ids, payload, complete)
+                for document in payload:
+                    uploader.add(document)
+                self._busy("upload", time.perf_counter() - started)
+                continue
+
+            parts, error = value, payload
+            tracked = self._track_end(pdf, state, parts, error)
+            if error:
+                self._count("failed_files")
+                print(f"Error processing {pdf.name}: {error}")
+                continue
+            if not parts:
+                self._count("empty_files")
+                print(f"Warning: No text extracted from {pdf.name}")
+            self._count("files")
+            with self._lock:
+                done_files = self._counters["files"]
+            print(f"[{done_files}/{self._total_files}] {pdf.name}: {len(tracked['chunk_ids'])} chunks, "
+                  f"{tracked['queued']} queued | uploaded so far: {uploader.uploaded}")
+
+    # ------------------------------------------------------------------ manifest
+
+    def _tracker(self, pdf: Path, state) -> dict:
+        return self._tracked.setdefault(str(pdf), {
+            "pdf": pdf, "state": state, "chunk_ids": [], "remaining": set(),
+            "parts": 0, "expected_parts": None, "queued": 0, "failed": False,
+        })
+
+    def _track_part(self, pdf: Path, state, chunk_ids: List[str], documents: List[dict], complete: bool):
+        """Register a part's keys before they are queued, so acknowledgements can be matched."""
+        with self._lock:
+            tracked = self._tracker(pdf, state)
+            tracked["chunk_ids"].extend(chunk_ids)
+            tracked["parts"] += 1
+            tracked["queued"] += len(documents)
+            tracked["failed"] |= not complete
+            if self.manifest is not None:
+                for document in documents:
+                    tracked["remaining"].add(document["id"])
+                    self._key_owner[document["id"]] = str(pdf)
+        # With several embed workers the "end" message can overtake the last part; if that
+        # part queued nothing, no acknowledgement will arrive to finalize the file.
+        self._finalize_if_ready(str(pdf))
+
+    def _track_end(self, pdf: Path, state, parts: int, error: Optional[str]) -> dict:
+        with self._lock:
+            tracked = self._tracker(pdf, state)
+            tracked["expected_parts"] = parts
+            tracked["failed"] |= bool(error)
+            tracked["error"] = error
+        self._finalize_if_ready(str(pdf))
+        return tracked
+
+    def _on_uploaded(self, keys: List[str]):
+        by_path: Dict[str, List[str]] = {}
+        with self._lock:
+            for key in keys:
+                path = self._key_owner.pop(key, None)
+                if path is not None:
+                    self._tracked[path]["remaining"].discard(key)
+                    by_path.setdefault(path, []).append(key)
+        for path, path_keys in by_path.items():
+            self.manifest.record_chunks(path, path_keys)
+            self._finalize_if_ready(path)
+
+    def _on_upload_failed(self, keys: List[str]):
+        paths = set()
+        with self._lock:
+            for key in keys:
+                path = self._key_owner.pop(key, None)
+                if path is not None:
+                    tracked = self._tracked[path]
+                    tracked["failed"] = True
+                    tracked["remaining"].discard(key)
+                    paths.add(path)
+        for path in paths:
+            self._finalize_if_ready(path)
+
+    def _finalize_if_ready(self, path: str):
+        """Commit a file once every part arrived and every queued key was acknowledged."""
+        with self._lock:
+            tracked = self._tracked.get(path)
+            if (
+                tracked is None
+                or tracked["expected_parts"] is None
+                or tracked["parts"] < tracked["expected_parts"]
+                or tracked["remaining"]
+            ):
+                return
+            del self._tracked[path]
+            known = self._known_ids.pop(path, None)
+        if self.manifest is None:
+            return
+        if tracked["failed"]:
+            if not tracked.get("error"):
+                print(f"{tracked['pdf'].name}: some chunks failed; it will be retried on the next run")
+            return
+
+        uploaded_before = known["uploaded"] if known else self.manifest.uploaded_ids(tracked["pdf"])
+        stale = uploaded_before - set(tracked["chunk_ids"])
+        if stale:
+            self._count("stale_deleted", delete_documents_by_key(self.client, stale))
+        self._save_keywords()
+        self.manifest.commit_file(tracked["state"], dict.fromkeys(tracked["chunk_ids"]))
+
+    def _save_keywords(self):
+        # Saved before the manifest records a file, so a crash cannot leave the manifest ahead.
+        if self.keyword_index is not None:
+            self.keyword_index.save()
+
+    def _remove_missing_files(self, folders: Iterable[Path], pdf_files: Sequence[Path]):
+        for path, chunk_ids in self.manifest.missing_files(folders, pdf_files).items():
+            deleted = delete_documents_by_key(self.client, chunk_ids)
+            self._count("stale_deleted", deleted)
+            if deleted == len(chunk_ids):
+                self._save_keywords()
+                self.manifest.forget_file(path)
+            print(f"Removed {deleted} chunks of deleted file {Path(path).name}")
+
+    # ------------------------------------------------------------------ driver
+
+    def run(self, pdf_files: Sequence[Path], folders: Optional[Iterable[Path]] = None) -> Dict[str, float]:
+        """
+        Ingest the given PDFs and return a summary of counts, timings and throughput.
+
+        Args:
+            pdf_files: Files to ingest.
+            folders: Folders the files were listed from; in incremental mode, manifest
+                entries under these folders that are no longer present are deleted.
+        """
+        pdf_files = [Path(pdf) for pdf in pdf_files]
+        self._total_files = len(pdf_files)
+        started = time.perf_counter()
+        if self.manifest is not None:
+            self._remove_missing_files(folders or {pdf.parent for pdf in pdf_files}, pdf_files)
+            uploader = BulkUploader(
+                self.client,
+                max_concurrent_flushes=self.upload_concurrency,
+                on_success=self._on_uploaded,
+                on_failure=self._on_upload_failed,
+            )
+        else:
+            uploader = BulkUploader(self.client, max_concurrent_flushes=self.upload_concurrency)
+
+        threads = [threading.Thread(target=self._extract_stage, args=(pdf_files,), name="ingest-extract")]
+        threads += [
+            threading.Thread(target=self._embed_stage, name=f"ingest-embed-{i}")
+            for i in range(self.embed_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self._upload_stage(uploader)
+        for thread in threads:
+            thread.join()
+        upload_stats = uploader.close()
+        self._save_keywords()
+        target = self.client.client if isinstance(self.client, KeywordMirror) else self.client
+        if isinstance(target, LocalVectorIndex):
+            # Fold the batches the local index logged during the run into documents.json
+            target.save()
+        for key, error in uploader.failed_keys.items():
+            print(f"Error uploading {key}: {error}")
+
+        elapsed = time.perf_counter() - started
+        summary = {
+            **self._counters,
+            "total_files": self._total_files,
+            "uploaded": upload_stats["uploaded"],
+            "upload_failed": upload_stats["failed"],
+            "elapsed_seconds": elapsed,
+            "chunks_per_second": upload_stats["uploaded"] / elapsed if elapsed else 0.0,
+            **{f"{stage}_busy_seconds": seconds for stage, seconds in self._stage_seconds.items()},
+        }
+        if summary["uploaded"] or summary["stale_deleted"]:
+            # Cached chat answers drawn from this index may now be out of date.
+            bump_index_version(index)
+        self.print_summary(summary)
+        return summary
+
+    @staticmethod
+    def print_summary(summary: Dict[str, float]):
+        embedding = cache_stats()
+        print(f"\n{'='*60}")
+        print(f"UPLOAD SUMMARY")
+        print(f"{'='*60}")
+        print(f"Files processed: {summary['files']}/{summary['total_files']} "
+              f"({summary['skipped_files']} unchanged, {summary['empty_files']} empty, "
+              f"{summary['failed_files']} failed)")
+        print(f"Chunks: {summary['chunks']} created, {summary['reused_chunks']} unchanged, "
+              f"{summary['embedded']} embedded, {summary['uploaded']} uploaded, "
+              f"{summary['upload_failed']} failed, {summary['stale_deleted']} stale deleted")
+        print(f"Elapsed: {summary['elapsed_seconds']:.1f}s | Throughput: {summary['chunks_per_second']:.1f} chunks/s")
+        print(f"Stage busy time: extract {summary['extract_busy_seconds']:.1f}s, "
+              f"embed {summary['embed_busy_seconds']:.1f}s, upload {summary['upload_busy_seconds']:.1f}s")
+        print(f"Embedding cache: {embedding['hits_memory'] + embedding['hits_disk']} hits, "
+              f"{embedding['misses']} misses, {embedding['api_requests']} embedding requests")
+        print(f"Upload complete!")
+
+
+def run_pipeline(pdf_files: Sequence[Path], folders: Optional[Iterable[Path]] = None, **options) -> Dict[str, float]:
+    return IngestionPipeline(**options).run(pdf_files, folders=folders)
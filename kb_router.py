@@ -0,0 +1,417 @@
+"""
+Embedding-based knowledge-base router.
+
+Sub-queries are embedded (through the shared embedding cache) and compared with
+labelled exemplar questions for each KB. When the best KB wins with enough confidence
+the decision is made locally, in well under a millisecond once the embedding is known;
+otherwise the LLM router (``Query_routing_Agent``) is asked and its answer is logged.
+Logged LLM decisions can be fed back in as new exemplars, so the share of traffic that
+needs the LLM shrinks over time. The decisions log is written from a background thread
+and rotated by size.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import logging.handlers
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embeddings import vectorize, vectorize_batch, vectorize_async, vectorize_batch_async
+
+logger = logging.getLogger("kb_router")
+
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.45"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.03"))
+# "exemplar": best single exemplar per KB (nearest neighbour); "centroid": mean exemplar.
+ROUTER_MODE = os.getenv("ROUTER_MODE", "exemplar")
+ROUTER_MAX_EXEMPLARS_PER_KB = int(os.getenv("ROUTER_MAX_EXEMPLARS_PER_KB", "500"))
+ROUTER_DECISIONS_LOG = os.getenv("ROUTER_DECISIONS_LOG", "routing_decisions.jsonl")
+ROUTER_DECISIONS_LOG_MAX_BYTES = int(os.getenv("ROUTER_DECISIONS_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+ROUTER_DECISIONS_LOG_BACKUPS = int(os.getenv("ROUTER_DECISIONS_LOG_BACKUPS", "3"))
+# A decision for the same sub-query within this window (e.g. a hedged duplicate call) is recorded once.
+_RECORD_DEDUP_SECONDS = 60.0
+_RECENT_RECORDS = 4096
+
+KNOWLEDGE_BASES = (
+    "junaidh-text-dino",
+    "junaidh-text-bake",
+    "junaidh-text-fit",
+    "junaidh-text-DB",
+    "junaidh-text-NoKB",
+)
+
+DEFAULT_EXEMPLARS: Dict[str, List[str]] = {
+    "junaidh-text-dino": [
+        "What did the Tyrannosaurus rex eat?",
+        "When did the dinosaurs go extinct?",
+        "How big was a Brachiosaurus?",
+        "Which dinosaurs lived in the Jurassic period?",
+        "Were velociraptors covered in feathers?",
+        "How are dinosaur fossils dated?",
+    ],
+    "junaidh-text-bake": [
+        "How do I make sourdough bread at home?",
+        "What temperature should I bake chocolate chip cookies at?",
+        "Can I substitute baking soda for baking powder?",
+        "How long should a sponge cake be baked?",
+        "Give me a recipe for an apple pie.",
+        "Why did my bread dough not rise?",
+    ],
+    "junaidh-text-fit": [
+        "What is a good workout routine for beginners?",
+        "How many push-ups should I do a day?",
+        "How much protein do I need to build muscle?",
+        "What are the benefits of stretching before running?",
+        "How can I improve my cardio endurance?",
+        "How many hours of sleep help muscle recovery?",
+    ],
+    "junaidh-text-DB": [
+        "What is my attendance this month?",
+        "How many days was I absent?",
+        "Show the attendance record for employee E001.",
+        "Did I check in on Monday?",
+        "What is my attendance percentage?",
+    ],
+    "junaidh-text-NoKB": [
+        "What's the weather like in Paris today?",
+        "Who won the football match last night?",
+        "What is the capital of Australia?",
+        "Tell me a joke.",
+        "What is the latest news about the stock market?",
+    ],
+}
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+_decision_writers: Dict[str, logging.Logger] = {}
+_decision_writers_lock = threading.Lock()
+
+
+def _decision_writer(path: str) -> logging.Logger:
+    """
+    Logger appending one JSON line per record to ``path``, rotated at
+    ROUTER_DECISIONS_LOG_MAX_BYTES. The file is written by a listener thread, so callers
+    on the event loop only enqueue.
+    """
+    with _decision_writers_lock:
+        writer = _decision_writers.get(path)
+        if writer is None:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=ROUTER_DECISIONS_LOG_MAX_BYTES, backupCount=ROUTER_DECISIONS_LOG_BACKUPS,
+                encoding="utf-8", delay=True,
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            records: "queue.Queue" = queue.Queue()
+            listener = logging.handlers.QueueListener(records, handler)
+            listener.start()
+            atexit.register(listener.stop)
+            writer = logging.getLogger(f"kb_router.decisions.{path}")
+            writer.setLevel(logging.INFO)
+            writer.propagate = False
+            writer.addHandler(logging.handlers.QueueHandler(records))
+            _decision_writers[path] = writer
+        return writer
+
+
+def _parse_kb(reply) -> Optional[str]:
+    """Knowledge base named in an LLM router reply, or None if it is not a known KB."""
+    try:
+        kb = json.loads(reply).get("knowledge_base")
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return kb if kb in KNOWLEDGE_BASES else None
+
+
+class KBRouter:
+    """
+    Routes sub-queries to a knowledge base by similarity to labelled exemplars.
+
+    Usage:
+        router = KBRouter(fallback=agent_model, fallback_async=agent_model_async)
+        reply = await router.route_async(sub_query)   # same JSON shape as agent_model
+    """
+
+    def __init__(
+        self,
+        exemplars: Optional[Dict[str, List[str]]] = None,
+        fallback: Optional[Callable[[str], str]] = None,
+        fallback_async: Optional[Callable] = None,
+        threshold: float = ROUTER_CONFIDENCE_THRESHOLD,
+        min_margin: float = ROUTER_MIN_MARGIN,
+        mode: str = ROUTER_MODE,
+        decisions_log: Optional[str] = ROUTER_DECISIONS_LOG,
+        learn_from_log: bool = True,
+    ):
+        """
+        Args:
+            exemplars: KB name -> example questions; defaults to DEFAULT_EXEMPLARS.
+            fallback: LLM router used below the confidence threshold (sync path).
+            fallback_async: Async LLM router used by ``route_async``.
+            threshold: Minimum cosine similarity for a local decision.
+            min_margin: Minimum lead of the best KB over the runner-up for a local decision.
+            mode: "exemplar" (nearest exemplar) or "centroid" (mean exemplar per KB).
+            decisions_log: JSONL file that routing decisions are appended to; None disables it.
+            learn_from_log: Load LLM decisions from ``decisions_log`` as extra exemplars.
+        """
+        self.fallback = fallback
+        self.fallback_async = fallback_async
+        self.threshold = threshold
+        self.min_margin = min_margin
+        self.mode = mode
+        self.decisions_log = decisions_log
+        self._learn_from_log = learn_from_log
+
+        self._seed = {kb: list(texts) for kb, texts in (exemplars or DEFAULT_EXEMPLARS).items()}
+        self._texts: Dict[str, List[str]] = {kb: [] for kb in self._seed}
+        self._vectors: Dict[str, List[np.ndarray]] = {kb: [] for kb in self._seed}
+        self._matrix: Optional[np.ndarray] = None
+        self._labels: List[str] = []
+        self._kbs: List[str] = []
+        self._lock = threading.Lock()
+        self._ready = False
+        # (sub-query, source) -> time recorded, for ``_record``
+        self._recent: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        # Sub-query -> LLM router call in flight, shared by hedged duplicates
+        self._llm_flights: Dict[str, "asyncio.Future"] = {}
+
+        self.local_decisions = 0
+        self.llm_decisions = 0
+        self.classify_seconds = 0.0
+        self._classified = 0
+
+    # -- exemplars ---------------------------------------------------------------
+
+    def _logged_exemplars(self) -> List[Tuple[str, str]]:
+        """(query, kb) pairs the LLM decided, read from the decisions log and its rotated files."""
+        if not self.decisions_log:
+            return []
+        paths = [f"{self.decisions_log}.{i}" for i in range(ROUTER_DECISIONS_LOG_BACKUPS, 0, -1)]
+        pairs = []
+        for path in paths + [self.decisions_log]:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("source") == "llm" and record.get("kb") in self._texts:
+                        pairs.append((record["query"], record["kb"]))
+        return pairs
+
+    def _pending_seed(self) -> List[Tuple[str, str]]:
+        pairs = [(text, kb) for kb, texts in self._seed.items() for text in texts]
+        if self._learn_from_log:
+            pairs += self._logged_exemplars()
+        return pairs
+
+    def _add_locked(self, pairs: Sequence[Tuple[str, str]], vectors):
+        changed = False
+        for (text, kb), vector in zip(pairs, vectors):
+            if vector is None or kb not in self._texts or text in self._texts[kb]:
+                continue
+            self._texts[kb].append(text)
+            self._vectors[kb].append(np.asarray(vector, dtype=np.float32))
+            if len(self._texts[kb]) > ROUTER_MAX_EXEMPLARS_PER_KB:
+                # Keep the seed exemplars; drop the oldest learned one.
+                drop = min(len(self._seed.get(kb, [])), len(self._texts[kb]) - 1)
+                del self._texts[kb][drop]
+                del self._vectors[kb][drop]
+            changed = True
+        if changed:
+            self._rebuild_locked()
+
+    def _rebuild_locked(self):
+        kbs = [kb for kb in self._vectors if self._vectors[kb]]
+        if self.mode == "centroid":
+            rows = [np.mean(_normalize(np.stack(self._vectors[kb])), axis=0) for kb in kbs]
+            labels = kbs
+        else:
+            rows = [vector for kb in kbs for vector in self._vectors[kb]]
+            labels = [kb for kb in kbs for _ in self._vectors[kb]]
+        self._matrix = _normalize(np.stack(rows)) if rows else None
+        self._labels = labels
+        self._kbs = kbs
+
+    def _ensure_ready(self):
+        if self._ready:
+            return
+        pairs = self._pending_seed()
+        vectors = vectorize_batch([text for text, _ in pairs])
+        with self._lock:
+            if not self._ready:
+                self._add_locked(pairs, vectors)
+                self._ready = True
+
+    async def _ensure_ready_async(self):
+        if self._ready:
+            return
+        pairs = self._pending_seed()
+        vectors = await vectorize_batch_async([text for text, _ in pairs])
+        with self._lock:
+            if not self._ready:
+                self._add_locked(pairs, vectors)
+                self._ready = True
+
+    def learn(self, query: str, kb: str):
+        """Add one labelled example (e.g. a corrected routing decision)."""
+        self.learn_many([(query, kb)])
+
+    def learn_many(self, pairs: Sequence[Tuple[str, str]]):
+        self._ensure_ready()
+        vectors = vectorize_batch([text for text, _ in pairs])
+        with self._lock:
+            self._add_locked(pairs, vectors)
+
+    def learn_from_log(self, path: Optional[str] = None) -> int:
+        """
+        Load LLM routing decisions from a decisions log as exemplars.
+
+        Returns:
+            Number of exemplars after loading.
+        """
+        previous, self.decisions_log = self.decisions_log, path or self.decisions_log
+        try:
+            self.learn_many(self._logged_exemplars())
+        finally:
+            self.decisions_log = previous
+        return sum(len(texts) for texts in self._texts.values())
+
+    # -- classification ----------------------------------------------------------
+
+    def classify_vector(self, vector) -> Tuple[str, float, float]:
+        """
+        Classify an already embedded query.
+
+        Returns:
+            (kb, confidence, margin): the best KB, its cosine similarity and its lead
+            over the best other KB.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            matrix, labels, kbs = self._matrix, self._labels, self._kbs
+        if matrix is None:
+            return "junaidh-text-NoKB", 0.0, 0.0
+
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        scores = matrix @ query
+        best: Dict[str, float] = {}
+        for label, score in zip(labels, scores.tolist()):
+            if score > best.get(label, -1.0):
+                best[label] = score
+        ranked = sorted(kbs, key=lambda kb: best[kb], reverse=True)
+        confidence = best[ranked[0]]
+        margin = confidence - best[ranked[1]] if len(ranked) > 1 else confidence
+        self.classify_seconds += time.perf_counter() - started
+        self._classified += 1
+        return ranked[0], confidence, margin
+
+    def classify(self, query: str) -> Tuple[Optional[str], float]:
+        """
+        Returns:
+            (kb, confidence); kb is None if the query could not be embedded.
+        """
+        self._ensure_ready()
+        vector = vectorize(query)
+        if vector is None:
+            return None, 0.0
+        kb, confidence, _ = self.classify_vector(vector)
+        return kb, confidence
+
+    def _confident(self, confidence: float, margin: float) -> bool:
+        return confidence >= self.threshold and margin >= self.min_margin
+
+    def _record(self, query: str, kb: Optional[str], confidence: float, source: str):
+        now = time.monotonic()
+        with self._lock:
+            recorded = self._recent.get((query, source))
+            if recorded is not None and now - recorded < _RECORD_DEDUP_SECONDS:
+                return
+            self._recent[(query, source)] = now
+            self._recent.move_to_end((query, source))
+            while len(self._recent) > _RECENT_RECORDS:
+                self._recent.popitem(last=False)
+            if source == "llm":
+                self.llm_decisions += 1
+            else:
+                self.local_decisions += 1
+        logger.info("Routed '%s' -> %s (confidence %.3f, %s)", query, kb, confidence, source)
+        if not self.decisions_log or kb is None:
+            return
+        record = {"ts": time.time(), "query": query, "kb": kb, "confidence": round(confidence, 4), "source": source}
+        _decision_writer(self.decisions_log).info(json.dumps(record))
+
+    def _local_reply(self, query: str, kb: str, confidence: float) -> str:
+        self._record(query, kb, confidence, "router")
+        return json.dumps({"knowledge_base": kb, "confidence": round(confidence, 4)})
+
+    def route(self, sub_query: str) -> str:
+        """
+        Drop-in replacement for ``agent_model``.
+
+        Returns:
+            JSON string with "knowledge_base" (and "confidence" for local decisions).
+        """
+        self._ensure_ready()
+        vector = vectorize(sub_query)
+        if vector is not None:
+            kb, confidence, margin = self.classify_vector(vector)
+            if self._confident(confidence, margin) or self.fallback is None:
+                return self._local_reply(sub_query, kb, confidence)
+        elif self.fallback is None:
+            return json.dumps({"knowledge_base": "junaidh-text-NoKB"})
+        else:
+            confidence = 0.0
+
+        reply = self.fallback(sub_query)
+        self._record(sub_query, _parse_kb(reply), confidence, "llm")
+        return reply
+
+    async def route_async(self, sub_query: str) -> str:
+        """Async variant of ``route``; drop-in replacement for ``agent_model_async``."""
+        await self._ensure_ready_async()
+        vector = await vectorize_async(sub_query)
+        if vector is not None:
+            kb, confidence, margin = self.classify_vector(vector)
+            if self._confident(confidence, margin) or self.fallback_async is None:
+                return self._local_reply(sub_query, kb, confidence)
+        elif self.fallback_async is None:
+            return json.dumps({"knowledge_base": "junaidh-text-NoKB"})
+        else:
+            confidence = 0.0
+
+        # Hedged duplicates of this call share one LLM request
+        flight = self._llm_flights.get(sub_query)
+        if flight is None:
+            flight = asyncio.ensure_future(self._ask_llm_async(sub_query, confidence))
+            self._llm_flights[sub_query] = flight
+            flight.add_done_callback(lambda _: self._llm_flights.pop(sub_query, None))
+        return await asyncio.shield(flight)
+
+    async def _ask_llm_async(self, sub_query: str, confidence: float) -> str:
+        reply = await self.fallback_async(sub_query)
+        self._record(sub_query, _parse_kb(reply), confidence, "llm")
+        return reply
+
+    def stats(self) -> Dict[str, float]:
+        decisions = self.local_decisions + self.llm_decisions
+        return {
+            "local_decisions": self.local_decisions,
+            "llm_decisions": self.llm_decisions,
+            "local_rate": self.local_decisions / decisions if decisions else 0.0,
+            "avg_classify_ms": 1000 * self.classify_seconds / self._classified if self._classified else 0.0,
+            "exemplars": sum(len(texts) for texts in self._texts.values()),
+        }
@@ -0,0 +1,279 @@
+"""
+Local BM25 keyword index over the ingested ``chunks`` text.
+
+Keyword matching then works offline and can be tuned, independently of Azure's hybrid
+``search_text``. The index is maintained by ingestion (``KeywordMirror`` wraps the
+search client, so every acknowledged upload or delete is mirrored) and queried by
+``index_search``. There it either answers exact-term queries on its own (identifiers
+and quoted phrases: no embedding needed) or is fused with vector results by reciprocal
+rank fusion.
+
+On-disk layout per index (``<LOCAL_INDEX_DIR>/<index_name>/``):
+    keyword.json           document keys and texts (deleted documents are null), vocabulary
+    keyword_postings.npz   postings as flat arrays: per-term offsets, document numbers, term frequencies
+"""
+
+import os
+import re
+import json
+import math
+import logging
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from local_index import LOCAL_INDEX_DIR
+
+logger = logging.getLogger("keyword_search")
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Rebuild postings once this share of documents are tombstones.
+_COMPACT_RATIO = 0.3
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "should the to was what when where which who why will with you your".split()
+)
+# Upper-case prefix and a number (E001, SKU-12); "5k", "65M" or "covid19" are ordinary words.
+_ID_LIKE = re.compile(r"\b[A-Z]+-?\d+\b")
+_QUOTED = re.compile(r'"[^"]+"')
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def is_keyword_query(question: str) -> bool:
+    """
+    Exact-term queries that keyword search can answer alone: quoted phrases or
+    identifiers (E001, SKU-12). Everything else goes through vector search, fused
+    with BM25.
+    """
+    return bool(_QUOTED.search(question) or _ID_LIKE.search(question))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Any]], k: int = RRF_K) -> List[Any]:
+    """
+    Merges ranked lists of (hashable) results: score(d) = sum over lists of 1 / (k + rank).
+
+    Returns:
+        All distinct results, best fused score first.
+    """
+    scores: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """Incrementally updated BM25 index with array-backed postings."""
+
+    def __init__(self, index_name: str, root: str = LOCAL_INDEX_DIR, k1: float = BM25_K1, b: float = BM25_B):
+        self.index_name = index_name
+        self.k1 = k1
+        self.b = b
+        self.path = Path(root) / index_name
+        self._meta_path = self.path / "keyword.json"
+        self._postings_path = self.path / "keyword_postings.npz"
+        self._lock = threading.RLock()
+
+        self._keys: List[Optional[str]] = []
+        self._texts: List[Optional[str]] = []
+        self._lengths = array("I")
+        self._positions: Dict[str, int] = {}
+        # term -> (document numbers, term frequencies), parallel compact arrays
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._total_length = 0
+        self._dirty = False
+        self._load()
+
+    @classmethod
+    def exists(cls, index_name: str, root: str = LOCAL_INDEX_DIR) -> bool:
+        return (Path(root) / index_name / "keyword.json").exists()
+
+    @classmethod
+    def saved_mtime(cls, index_name: str, root: str = LOCAL_INDEX_DIR) -> Optional[float]:
+        """Modification time of the saved index (written last by ``save``), or None."""
+        try:
+            return os.stat(Path(root) / index_name / "keyword.json").st_mtime
+        except OSError:
+            return None
+
+    # ------------------------------------------------------------------ storage
+
+    def _load(self):
+        if not self._meta_path.exists():
+            return
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self._keys = meta["keys"]
+        self._texts = meta["texts"]
+        self._positions = {key: i for i, key in enumerate(self._keys) if key is not None}
+        self._lengths = array("I", meta["lengths"])
+        self._total_length = sum(length for key, length in zip(self._keys, self._lengths) if key is not None)
+
+        if self._postings_path.exists():
+            with np.load(self._postings_path) as data:
+                offsets, documents, frequencies = data["offsets"], data["documents"], data["frequencies"]
+            for i, term in enumerate(meta["terms"]):
+                start, end = int(offsets[i]), int(offsets[i + 1])
+                self._postings[term] = (
+                    array("I", documents[start:end].tobytes()),
+                    array("H", frequencies[start:end].tobytes()),
+                )
+
+    def save(self):
+        """Write the index if it changed since it was loaded or last saved."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            terms = list(self._postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(self._postings[term][0]) for term in terms])
+            documents = np.frombuffer(b"".join(self._postings[t][0].tobytes() for t in terms), dtype=np.uint32)
+            frequencies = np.frombuffer(b"".join(self._postings[t][1].tobytes() for t in terms), dtype=np.uint16)
+
+            tmp = self._postings_path.with_suffix(".tmp.npz")
+            np.savez(tmp, offsets=offsets, documents=documents, frequencies=frequencies)
+            os.replace(tmp, self._postings_path)
+            tmp = self._meta_path.with_suffix(".json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({
+                    "keys": self._keys, "texts": self._texts,
+                    "lengths": self._lengths.tolist(), "terms": terms,
+                }, f)
+            os.replace(tmp, self._meta_path)
+            self._dirty = False
+
+    # ------------------------------------------------------------------ writes
+
+    def _remove_locked(self, key: str):
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        # Postings of a tombstoned document are skipped at query time and dropped on compaction.
+        self._total_length -= self._lengths[position]
+        self._keys[position] = None
+        self._texts[position] = None
+
+    def add_documents(self, documents: Sequence[Dict[str, Any]]):
+        """Index documents by ``id`` and ``chunks``; a known id is replaced."""
+        with self._lock:
+            for document in documents:
+                key, text = document.get("id"), document.get("chunks")
+                if not key or not isinstance(text, str):
+                    continue
+                self._remove_locked(key)
+                counts: Dict[str, int] = {}
+                for token in tokenize(text):
+                    counts[token] = counts.get(token, 0) + 1
+                position = len(self._keys)
+                self._keys.append(key)
+                self._texts.append(text)
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._total_length += length
+                self._positions[key] = position
+                for term, count in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(position)
+                    postings[1].append(min(count, 65535))
+            self._dirty = True
+            self._maybe_compact_locked()
+
+    def delete_documents(self, keys: Sequence[str]):
+        with self._lock:
+            for key in keys:
+                self._remove_locked(key)
+            self._dirty = True
+            self._maybe_compact_locked()
+
+    def _maybe_compact_locked(self):
+        dead = len(self._keys) - len(self._positions)
+        if not dead or dead < _COMPACT_RATIO * len(self._keys):
+            return
+        live = [(key, text) for key, text in zip(self._keys, self._texts) if key is not None]
+        self._keys, self._texts, self._lengths = [], [], array("I")
+        self._positions, self._postings, self._total_length = {}, {}, 0
+        self.add_documents([{"id": key, "chunks": text} for key, text in live])
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    # ------------------------------------------------------------------ reads
+
+    def search(self, query: str, top: int = 5) -> List[Dict[str, Any]]:
+        """
+        BM25 top-k over live documents.
+
+        Returns:
+            Dicts with "id", "chunks" and "@search.score", best first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._positions)
+            if not terms or not count:
+                return []
+            average_length = self._total_length / count
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * lengths / max(average_length, 1e-9))
+            scores = np.zeros(len(self._keys), dtype=np.float32)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                documents = np.frombuffer(postings[0], dtype=np.uint32)
+                frequencies = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+                # Document frequency counts tombstoned postings too until compaction; close enough.
+                df = len(documents)
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                scores[documents] += idf * frequencies * (self.k1 + 1) / (frequencies + norm[documents])
+
+            candidates = np.flatnonzero(scores > 0)
+            candidates = [i for i in candidates.tolist() if self._keys[i] is not None]
+            candidates.sort(key=lambda i: scores[i], reverse=True)
+            return [
+                {"id": self._keys[i], "chunks": self._texts[i], "@search.score": float(scores[i])}
+                for i in candidates[:top]
+            ]
+
+    def search_chunks(self, query: str, top: int = 5) -> List[str]:
+        return [result["chunks"] for result in self.search(query, top)]
+
+
+class KeywordMirror:
+    """
+    Search-client wrapper that mirrors acknowledged uploads and deletes into a BM25Index,
+    so the keyword index is built and updated incrementally by ingestion.
+    """
+
+    def __init__(self, client, keyword_index: BM25Index):
+        self.client = client
+        self.keyword_index = keyword_index
+
+    def upload_documents(self, documents):
+        results = self.client.upload_documents(documents=documents)
+        succeeded = {result.key for result in results if result.succeeded}
+        self.keyword_index.add_documents([document for document in documents if document["id"] in succeeded])
+        return results
+
+    def delete_documents(self, documents):
+        results = self.client.delete_documents(documents=documents)
+        self.keyword_index.delete_documents([result.key for result in results if result.succeeded])
+        return results
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
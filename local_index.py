@@ -0,0 +1,340 @@
+"""
+In-process vector index that serves the junaidh-text-* knowledge bases from local disk.
+
+The index mirrors the subset of the Azure ``SearchClient`` API used by this project
+(``search``, ``upload_documents``, ``delete_documents``, ``get_document_count``), so it
+can be dropped in behind ``index_search.get_search_client`` for hot knowledge bases and
+as an offline stand-in for tests.
+
+On-disk layout per index (``<LOCAL_INDEX_DIR>/<index_name>/``):
+    embeddings.f32   memory-mapped float32 matrix, one L2-normalised row per chunk
+    documents.json   row metadata (id, chunks, category); deleted rows are null
+    documents.log    row changes since documents.json was written, one JSON line per row
+    hnsw.bin         optional HNSW graph, only built for large corpora
+
+Uploads and deletes append their rows to ``documents.log``, so a batch costs the same
+however large the index is; ``save``/``close`` fold the log into ``documents.json``.
+"""
+
+import os
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # exact search is used for every corpus size
+    hnswlib = None
+
+logger = logging.getLogger("vector_search")
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+HNSW_THRESHOLD = int(os.getenv("LOCAL_INDEX_HNSW_THRESHOLD", "50000"))
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+
+_INITIAL_CAPACITY = 1024
+
+
+@dataclass
+class IndexingResult:
+    """Per-document outcome, shaped like ``azure.search.documents.models.IndexingResult``."""
+    key: str
+    succeeded: bool
+    status_code: int
+    error_message: Optional[str] = None
+
+
+class LocalVectorIndex:
+    """
+    Memory-mapped vector store with exact top-k search for small corpora and an
+    HNSW graph (via ``hnswlib``) once the live row count reaches ``hnsw_threshold``.
+    """
+
+    def __init__(
+        self,
+        index_name: str,
+        root: str = LOCAL_INDEX_DIR,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        hnsw_threshold: int = HNSW_THRESHOLD,
+    ):
+        self.index_name = index_name
+        self.dimensions = dimensions
+        self.hnsw_threshold = hnsw_threshold
+        self.path = Path(root) / index_name
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self._matrix_path = self.path / "embeddings.f32"
+        self._docs_path = self.path / "documents.json"
+        self._log_path = self.path / "documents.log"
+        self._hnsw_path = self.path / "hnsw.bin"
+        self._lock = threading.RLock()
+
+        self._rows: List[Optional[Dict[str, Any]]] = []
+        self._positions: Dict[str, int] = {}
+        self._live = np.zeros(0, dtype=bool)
+        self._matrix: Optional[np.memmap] = None
+        self._capacity = 0
+        self._hnsw = None
+        self._load()
+
+    # ------------------------------------------------------------------ storage
+
+    def _load(self):
+        if self._docs_path.exists():
+            with open(self._docs_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dimensions", self.dimensions) != self.dimensions:
+                raise ValueError(
+                    f"Local index '{self.index_name}' has dimension {meta['dimensions']}, "
+                    f"expected {self.dimensions}"
+                )
+            self._rows = meta.get("rows", [])
+        logged = self._replay_log()
+        self._positions = {row["id"]: i for i, row in enumerate(self._rows) if row}
+        self._live = np.array([row is not None for row in self._rows], dtype=bool)
+
+        row_bytes = self.dimensions * 4
+        existing = self._matrix_path.stat().st_size // row_bytes if self._matrix_path.exists() else 0
+        self._open_matrix(max(existing, len(self._rows), _INITIAL_CAPACITY))
+
+        # The graph is only saved with documents.json; rows in the log may be missing from it.
+        if hnswlib is not None and self._hnsw_path.exists() and not logged:
+            index = hnswlib.Index(space="ip", dim=self.dimensions)
+            index.load_index(str(self._hnsw_path), max_elements=self._capacity)
+            if index.get_current_count() >= int(self._live.sum()):
+                self._hnsw = index
+            else:
+                logger.warning("Discarding stale HNSW graph for local index '%s'", self.index_name)
+
+    def _replay_log(self) -> int:
+        """Applies the logged row changes to ``self._rows``; returns how many were applied."""
+        if not self._log_path.exists():
+            return 0
+        applied = 0
+        with open(self._log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    position, row = json.loads(line)
+                except ValueError:
+                    # Torn last line of an interrupted write
+                    break
+                if position >= len(self._rows):
+                    self._rows.extend([None] * (position + 1 - len(self._rows)))
+                self._rows[position] = row
+                applied += 1
+        return applied
+
+    def _append_log(self, positions: List[int]):
+        """Persists a batch: vectors first, then the rows that point at them."""
+        self._matrix.flush()
+        with open(self._log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps([position, self._rows[position]]) + "\n" for position in positions))
+
+    def _open_matrix(self, capacity: int):
+        """(Re)map the embedding file, growing it on disk to ``capacity`` rows."""
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        size = capacity * self.dimensions * 4
+        with open(self._matrix_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._matrix = np.memmap(
+            self._matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimensions)
+        )
+        self._capacity = capacity
+        if self._hnsw is not None and self._hnsw.get_max_elements() < capacity:
+            self._hnsw.resize_index(capacity)
+
+    def save(self):
+        """Flush the embedding matrix, atomically rewrite the row metadata and clear the log."""
+        with self._lock:
+            self._matrix.flush()
+            tmp = self._docs_path.with_suffix(".json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"dimensions": self.dimensions, "rows": self._rows}, f)
+            os.replace(tmp, self._docs_path)
+            if self._hnsw is not None:
+                self._hnsw.save_index(str(self._hnsw_path))
+            if self._log_path.exists():
+                self._log_path.unlink()
+
+    def close(self):
+        self.save()
+
+    # ------------------------------------------------------------------ writes
+
+    def upload_documents(self, documents: List[Dict[str, Any]]) -> List[IndexingResult]:
+        """Insert or replace documents keyed by ``id``; ``embeddings`` must be a vector."""
+        results = []
+        touched = []
+        with self._lock:
+            for document in documents:
+                key = document.get("id")
+                vector = document.get("embeddings")
+                if not key or vector is None or len(vector) != self.dimensions:
+                    results.append(IndexingResult(
+                        key=str(key), succeeded=False, status_code=400,
+                        error_message="Document requires an id and a "
+                                      f"{self.dimensions}-dimensional 'embeddings' vector",
+                    ))
+                    continue
+
+                position = self._positions.get(key)
+                if position is None:
+                    position = len(self._rows)
+                    if position >= self._capacity:
+                        self._open_matrix(self._capacity * 2)
+                    self._rows.append(None)
+                    self._live = np.append(self._live, False)
+                    self._positions[key] = position
+
+                row = np.asarray(vector, dtype=np.float32)
+                norm = float(np.linalg.norm(row))
+                self._matrix[position] = row / norm if norm else row
+                self._rows[position] = {k: v for k, v in document.items() if k != "embeddings"}
+                self._live[position] = True
+                touched.append(position)
+                results.append(IndexingResult(key=key, succeeded=True, status_code=201))
+
+            if self._hnsw is not None and touched:
+                self._hnsw.add_items(self._matrix[touched], touched)
+            if touched:
+                self._append_log(touched)
+        return results
+
+    def delete_documents(self, documents: List[Dict[str, Any]]) -> List[IndexingResult]:
+        """Tombstone documents by ``id``; their rows are skipped by every search path."""
+        results = []
+        deleted = []
+        with self._lock:
+            for document in documents:
+                key = document.get("id")
+                position = self._positions.pop(key, None)
+                if position is not None:
+                    self._rows[position] = None
+                    self._live[position] = False
+                    if self._hnsw is not None:
+                        self._hnsw.mark_deleted(position)
+                    deleted.append(position)
+                results.append(IndexingResult(key=str(key), succeeded=True, status_code=200))
+            if deleted:
+                self._append_log(deleted)
+        return results
+
+    def get_document_count(self) -> int:
+        return int(self._live.sum())
+
+    # ------------------------------------------------------------------ reads
+
+    def _ensure_hnsw(self, live_count: int):
+        if hnswlib is None or self._hnsw is not None or live_count < self.hnsw_threshold:
+            return
+        logger.info("Building HNSW graph for local index '%s' (%d rows)", self.index_name, live_count)
+        index = hnswlib.Index(space="ip", dim=self.dimensions)
+        index.init_index(max_elements=self._capacity, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        positions = np.flatnonzero(self._live[: len(self._rows)])
+        index.add_items(self._matrix[positions], positions)
+        self._hnsw = index
+        self._hnsw.save_index(str(self._hnsw_path))
+
+    def _top_k(self, query: np.ndarray, k: int):
+        count = len(self._rows)
+        live_count = int(self._live.sum())
+        k = min(k, live_count)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        self._ensure_hnsw(live_count)
+        if self._hnsw is not None:
+            self._hnsw.set_ef(max(64, 2 * k))
+            labels, distances = self._hnsw.knn_query(query, k=k)
+            # hnswlib "ip" space returns 1 - <a, b>
+            return labels[0].astype(np.int64), 1.0 - distances[0]
+
+        scores = self._matrix[:count] @ query
+        scores[~self._live[:count]] = -np.inf
+        if k < count:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def search(
+        self,
+        search_text: Optional[str] = None,
+        vector_queries: Optional[List[Any]] = None,
+        search_fields: Optional[List[str]] = None,
+        top: int = 50,
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        """
+        Vector search compatible with ``SearchClient.search`` call sites.
+
+        Args:
+            search_text: Accepted for signature compatibility; keyword matching is not
+                applied by this backend.
+            vector_queries: ``VectorizedQuery``-like objects exposing ``vector`` and
+                optionally ``k_nearest_neighbors``. Multiple queries are merged by best score.
+            search_fields: Accepted for signature compatibility.
+            top: Maximum number of documents to return.
+
+        Returns:
+            List of document dicts (without embeddings) with an ``@search.score`` key.
+        """
+        if not vector_queries:
+            return []
+
+        best: Dict[int, float] = {}
+        with self._lock:
+            for vector_query in vector_queries:
+                query = np.asarray(vector_query.vector, dtype=np.float32)
+                norm = float(np.linalg.norm(query))
+                if norm:
+                    query = query / norm
+                k = getattr(vector_query, "k_nearest_neighbors", None) or top
+                positions, scores = self._top_k(query, max(k, top))
+                for position, score in zip(positions.tolist(), scores.tolist()):
+                    if score > best.get(position, -np.inf):
+                        best[position] = score
+
+            ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)[:top]
+            return [
+                {**self._rows[position], "@search.score": score}
+                for position, score in ranked
+                if self._rows[position] is not None
+            ]
+
+
+def mirror_from_azure(search_client, local_index: LocalVectorIndex, batch_size: int = 1000) -> int:
+    """
+    Copy every document of an Azure Search index into a local index.
+
+    Args:
+        search_client: Azure ``SearchClient`` for the source index.
+        local_index: Destination ``LocalVectorIndex``.
+        batch_size: Number of documents written per local upload.
+
+    Returns:
+        Number of documents mirrored.
+    """
+    copied = 0
+    batch = []
+    for result in search_client.search(search_text="*", select=["id", "chunks", "embeddings", "category"]):
+        batch.append({k: v for k, v in result.items() if not k.startswith("@")})
+        if len(batch) >= batch_size:
+            copied += sum(r.succeeded for r in local_index.upload_documents(batch))
+            batch = []
+    if batch:
+        copied += sum(r.succeeded for r in local_index.upload_documents(batch))
+    local_index.save()
+    logger.info("Mirrored %d documents into local index '%s'", copied, local_index.index_name)
+    return copied
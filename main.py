@@ -1,17 +1,34 @@
 import asyncio
-# import time
+import time
 import json
+import inspect
 import logging
+import functools
+import contextvars
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Any, Dict, Optional
+from typing import List, Any, AsyncIterator, Dict, Optional
 
-from index_search import qstn_vectorize
-from Query_routing_Agent import agent_model
-from rag_llm import rag_model
-from database_access import get_attendance_data
-from WebSearchTool import search_DDG
-from Query_receiver_Agent import query_generator
-from Testing import Result_validation
+import async_clients
+from answer_cache import AnswerCache
+from deadlines import (
+    Hedger, REQUEST_DEADLINE_SECONDS, VALIDATION_MIN_SECONDS,
+    DROPPED, current_deadline, deadline_scope, gather_within, run_stage,
+)
+from embeddings import vectorize_async
+from index_search import qstn_vectorize_async, qstn_vectorize_multi_async
+from retrieval_planner import RetrievalPlanner
+from context_packer import pack_context_async
+from Query_routing_Agent import agent_model, agent_model_async
+from kb_router import KBRouter
+from rag_llm import rag_model_async, rag_model_stream_async
+from attendance_rollups import get_attendance_context, start_background_refresh
+from WebSearchTool import get_web_searcher
+from Query_receiver_Agent import query_generator, query_generator_async
+from query_fastpath import QueryDecomposer
+from Testing import Result_validation_batch_async
+from validation_queue import ValidationQueue
+import embeddings
+from telemetry import METRICS_PORT, register_stats, span, start_metrics_server
 
 logging.basicConfig(
     filename="chatbot_logs.log",
@@ -19,10 +36,16 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+# Answers built from these sources reflect live data and are never cached.
+UNCACHEABLE_KBS = {"junaidh-text-NoKB", "junaidh-text-DB"}
+
 class RAGChatBot:
     """
     A modular, production-grade Retrieval-Augmented Generation (RAG) chatbot
     that supports web search fallback and query decomposition.
+
+    Components may be coroutine functions, which are awaited directly, or plain
+    blocking functions, which are run on the bot's thread pool.
     """
 
     def __init__(
@@ -33,7 +56,14 @@ class RAGChatBot:
         web_search,
         query_gen,
         Validate,
-        DataBase
+        DataBase,
+        rag_stream=None,
+        answer_cache: Optional[AnswerCache] = None,
+        multi_vectorizer=None,
+        validation_queue: Optional[ValidationQueue] = None,
+        context_packer=None,
+        request_deadline: float = REQUEST_DEADLINE_SECONDS,
+        hedger: Optional[Hedger] = None
     ):
         """
         Initialize the RAGChatBot with modular components.
@@ -45,6 +75,19 @@ class RAGChatBot:
             web_search: Function to search the web.
             query_gen: Function to decompose query into sub-queries.
             classifier: Function to classify query type.
+            rag_stream: Optional generator variant of ``rag`` yielding answer tokens,
+                used by ``handle_query_stream``.
+            answer_cache: Optional semantic cache consulted before the pipeline runs.
+            multi_vectorizer: Optional function retrieving context for several questions
+                against one knowledge base in a single search.
+            validation_queue: Optional background queue; when set, answers are validated
+                there instead of inline and ``Validate`` is not called.
+            context_packer: Optional function turning (user_query, [(source, result)])
+                into the prompt context; without it ``rag`` gets the raw result lists.
+            request_deadline: Seconds a query may take end to end; split into per-stage
+                budgets (``deadlines.STAGE_BUDGETS``) with generation getting the rest.
+            hedger: Optional ``Hedger``; idempotent calls (embedding, routing, retrieval)
+                get a second request when they run past their p95 latency.
         """
         self.vectorizer = vectorizer
         self.agent = agent
@@ -53,129 +96,408 @@ class RAGChatBot:
         self.query_gen = query_gen
         self.Validate = Validate
         self.DataBase = DataBase
+        self.rag_stream = rag_stream
+        self.answer_cache = answer_cache
+        self.multi_vectorizer = multi_vectorizer
+        self.validation_queue = validation_queue
+        self.context_packer = context_packer
+        self.request_deadline = request_deadline
+        self.hedger = hedger
         self.executor = ThreadPoolExecutor()
 
-    async def process_sub_query(self, sub_query: str, user_query: str) -> Optional[str]:
+    @staticmethod
+    def _is_async(component) -> bool:
+        return inspect.iscoroutinefunction(component) or inspect.iscoroutinefunction(
+            getattr(component, "__call__", None)
+        )
+
+    async def _call(self, component, *args):
         """
-        Processes each sub-query to get context either from KB or web.
+        Adapter between async and sync components: awaits coroutine functions,
+        runs blocking functions on the executor (with the caller's context, so the
+        request deadline reaches them too).
+        """
+        if self._is_async(component):
+            return await component(*args)
+        call = functools.partial(contextvars.copy_context().run, component, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
 
-        Args:
-            sub_query: Individual sub-query generated from the main query.
-            user_query: Original user query.
+    async def _call_idempotent(self, component, *args):
+        """
+        ``_call`` for calls that are safe to repeat; hedged when a ``Hedger`` is set.
+        """
+        if self.hedger is None:
+            return await self._call(component, *args)
+        key = getattr(component, "__qualname__", type(component).__name__)
+        return await self.hedger.run(key, lambda: self._call(component, *args))
+
+    async def _iterate(self, component, *args) -> AsyncIterator[Any]:
+        """
+        Streaming counterpart of ``_call``: iterates async generators directly and
+        drives sync generators on the executor, handing items over as they are produced.
+        """
+        if inspect.isasyncgenfunction(component) or inspect.isasyncgenfunction(
+            getattr(component, "__call__", None)
+        ):
+            async for item in component(*args):
+                yield item
+            return
+
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for item in component(*args):
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+            finally:
+                loop.call_soon_threadsafe(items.put_nowait, done)
+
+        producer = loop.run_in_executor(self.executor, contextvars.copy_context().run, produce)
+        while True:
+            item = await items.get()
+            if item is done:
+                break
+            yield item
+        await producer
+
+    async def route_sub_query(self, sub_query: str) -> Optional[str]:
+        """
+        Asks the agent which knowledge base serves the sub-query.
 
         Returns:
-            A string containing the context for the sub-query.
+            The knowledge base name, or None if the agent response was unusable.
         """
         try:
-            agent_resp_raw = await asyncio.get_event_loop().run_in_executor(
-                self.executor, self.agent, sub_query
-            )
-            agent_response = json.loads(agent_resp_raw)
-            kb = agent_response.get("knowledge_base", "NoKB")
+            with span("route") as route_span:
+                agent_resp_raw = await self._call_idempotent(self.agent, sub_query)
+                agent_response = json.loads(agent_resp_raw)
+                kb = agent_response.get("knowledge_base", "NoKB")
+                route_span.set("kb", kb)
 
             logging.info(f"Sub-query '{sub_query}' classified with KB: {kb}")
-
-            if kb == "junaidh-text-NoKB":
-                logging.info("Fallback to web search for sub-query")
-                return await asyncio.get_event_loop().run_in_executor(
-                    self.executor, self.web_search, sub_query
-                )
-            elif kb == "junaidh-text-DB":
-                logging.info("Fallback to database for sub-query")
-                return await asyncio.get_event_loop().run_in_executor(
-                    self.executor, self.DataBase, sub_query
-                )
-            else:
-                return await asyncio.get_event_loop().run_in_executor(
-                    self.executor, self.vectorizer, user_query, kb
-                )
+            return kb
         except json.JSONDecodeError:
             logging.error("500: Invalid agent response JSON")
         except Exception as e:
-            logging.exception(f"500: Sub-query processing error - {e}")
+            logging.exception(f"500: Sub-query routing error - {e}")
         return None
     
     async def validate_result(self, user_query: str,  context: list[str], result):
         """
         Validate the LLM result
         """
+        if self.validation_queue is not None:
+            # Off the critical path: sampled, batched and recorded by the background worker.
+            self.validation_queue.submit(user_query, context, result)
+            return
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() < VALIDATION_MIN_SECONDS:
+            logging.warning("Skipping validation: request deadline nearly spent")
+            return
         try:
-            Result_validation = await asyncio.get_event_loop().run_in_executor(
-                self.executor, self.Validate, user_query, context, result
-            )
+            with span("validate"):
+                Result_validation = await self._call(self.Validate, user_query, context, result)
             logging.info(f"validation result:{Result_validation}")
         except Exception as e:
             logging.exception(f"500: Validation error - {e}")
             return "Validation failed"
 
+    async def _cache_lookup(self, user_query: str):
+        """
+        Returns (cached answer or None, query embedding or None).
+        """
+        if self.answer_cache is None:
+            return None, None
+        try:
+            with span("cache") as cache_span:
+                vector = await self._call_idempotent(vectorize_async, user_query)
+                if vector is None:
+                    return None, None
+                cached = self.answer_cache.lookup(vector)
+                cache_span.set("cache_hit", cached is not None)
+            return cached, vector
+        except Exception as e:
+            logging.exception(f"Answer cache lookup failed - {e}")
+            return None, None
+
+    def _cache_versions(self) -> Optional[dict]:
+        """KB index versions before retrieval, for ``_cache_store``; None without a cache."""
+        if self.answer_cache is None:
+            return None
+        try:
+            return self.answer_cache.versions()
+        except Exception as e:
+            logging.exception(f"Answer cache version read failed - {e}")
+            return None
+
+    def _cache_store(self, user_query: str, vector, result: str, kbs: list, started: float, versions: Optional[dict]):
+        if vector is None or versions is None or not kbs or UNCACHEABLE_KBS.intersection(kbs):
+            return
+        try:
+            self.answer_cache.store(user_query, vector, result, kbs, time.perf_counter() - started, versions)
+        except Exception as e:
+            logging.exception(f"Answer cache store failed - {e}")
+
+    async def _retrieve_context(self, user_query: str, kbs: Optional[list] = None):
+        """
+        Decomposes the query and gathers context for every sub-query.
+
+        Returns:
+            (context, None, degraded) on success, or (None, message, degraded) when there
+            is nothing to answer from. ``degraded`` is True when a stage budget ran out
+            (decomposition skipped, sub-queries unrouted or retrievals dropped), so the
+            context may be incomplete.
+        """
+        deadline = current_deadline()
+        degraded = False
+        with span("decompose") as decompose_span:
+            queries_json = await run_stage("decompose", self._call(self.query_gen, user_query))
+            if queries_json is None:
+                # Out of time for decomposition: answer the question as a single intent
+                queries = [user_query]
+                degraded = True
+                decompose_span.set("degraded", True)
+            else:
+                queries = json.loads(queries_json).get("queries", [])
+            decompose_span.set("sub_queries", len(queries))
+
+        if not queries:
+            logging.warning("400: No sub-queries generated.")
+            return None, "I'm sorry, I couldn't understand your question.", degraded
+
+        # Sub-queries still being routed when the route budget runs out are dropped
+        route_budget = deadline.budget("route") if deadline is not None else None
+        routes = await gather_within(
+            [self.route_sub_query(sub_query) for sub_query in queries], route_budget, default=DROPPED
+        )
+        degraded = degraded or DROPPED in routes
+        routed = [(sub_query, kb) for sub_query, kb in zip(queries, routes) if kb is not None and kb is not DROPPED]
+        if kbs is not None:
+            kbs.extend(kb for _, kb in routed)
+
+        # Groups sub-queries per KB, runs each distinct retrieval once and de-duplicates chunks.
+        planner = RetrievalPlanner(
+            self._call_idempotent, self.vectorizer, self.web_search, self.DataBase, self.multi_vectorizer
+        )
+        # Retrievals still running when the budget runs out are dropped: partial context
+        tagged = await planner.retrieve_tagged(routed, deadline.budget("retrieve") if deadline is not None else None)
+        degraded = degraded or planner.dropped > 0
+
+        if not tagged:
+            logging.warning("404: No context found for any sub-query.")
+            return None, "I couldn't find enough information to answer that.", degraded
+        raw = [result for _, result in tagged]
+        if self.context_packer is None:
+            return raw, None, degraded
+        with span("pack", entries=len(tagged)):
+            packed = await run_stage("pack", self._call(self.context_packer, user_query, tagged))
+        return (raw if packed is None else packed), None, degraded
+
     async def handle_query(self, user_query: str) -> str:
         """
         Handles the entire pipeline of processing a user query.
 
+        The query runs under a ``request_deadline``: each stage gets its budget and
+        degrades when it runs out, and generation gets whatever time is left.
+
         Args:
             user_query: The main query input from the user.
 
         Returns:
             Final string response from the RAG model.
         """
-        try:
-            queries_json = await asyncio.get_event_loop().run_in_executor(
-                self.executor, self.query_gen, user_query
-            )
-            queries = json.loads(queries_json).get("queries", [])
+        started = time.perf_counter()
+        with deadline_scope(self.request_deadline) as deadline, span("query") as query_span:
+            try:
+                cached, vector = await run_stage("cache", self._cache_lookup(user_query), default=(None, None))
+                query_span.set("cache_hit", cached is not None)
+                if cached is not None:
+                    return cached
 
-            if not queries:
-                logging.warning("400: No sub-queries generated.")
-                return "I'm sorry, I couldn't understand your question."
+                kbs = []
+                versions = self._cache_versions()
+                context, message, degraded = await self._retrieve_context(user_query, kbs)
+                if message:
+                    return message
 
-            tasks = [
-                self.process_sub_query(sub_query, user_query) for sub_query in queries
-            ]
-            context = await asyncio.gather(*tasks)
+                with span("generate"):
+                    result = await asyncio.wait_for(self._call(self.rag, user_query, context), timeout=deadline.remaining())
+                await self.validate_result(user_query,context,result)
+                if degraded:
+                    logging.info("Answer built from degraded retrieval; not cached")
+                else:
+                    self._cache_store(user_query, vector, result, kbs, started, versions)
+                return result
 
-            context = [c for c in context if c]
+            except json.JSONDecodeError:
+                logging.error("500: Invalid sub-query JSON")
+                return "Something went wrong while understanding your question."
+            except asyncio.TimeoutError:
+                logging.error(f"504: Request deadline of {self.request_deadline:.1f}s exceeded")
+                return "That took longer than expected. Please try again."
+            except Exception as e:
+                logging.exception(f"500: Error in query handling - {e}")
+                return "Something went wrong on my side. Please try again."
 
-            if not context:
-                logging.warning("404: No context found for any sub-query.")
-                return "I couldn't find enough information to answer that."
+    async def handle_query_stream(self, user_query: str) -> AsyncIterator[str]:
+        """
+        Streaming variant of ``handle_query``: yields answer tokens as the RAG model
+        produces them. Validation runs after the last token has been sent. When the
+        deadline passes mid-answer the stream ends there and the answer is not cached.
 
-            result = await asyncio.get_event_loop().run_in_executor(
-                self.executor, self.rag, user_query, context
-            )
-            await self.validate_result(user_query,context,result)
-            return result
+        Args:
+            user_query: The main query input from the user.
 
-        except json.JSONDecodeError:
-            logging.error("500: Invalid sub-query JSON")
-            return "Something went wrong while understanding your question."
-        except Exception as e:
-            logging.exception(f"500: Error in query handling - {e}")
-            return "Something went wrong on my side. Please try again."
+        Yields:
+            Pieces of the final response.
+        """
+        started = time.perf_counter()
+        with deadline_scope(self.request_deadline) as deadline, span("query", stream=True) as query_span:
+            try:
+                cached, vector = await run_stage("cache", self._cache_lookup(user_query), default=(None, None))
+                query_span.set("cache_hit", cached is not None)
+                if cached is not None:
+                    yield cached
+                    return
+
+                kbs = []
+                versions = self._cache_versions()
+                context, message, degraded = await self._retrieve_context(user_query, kbs)
+                if message:
+                    yield message
+                    return
+
+                with span("generate", stream=self.rag_stream is not None) as generate_span:
+                    if self.rag_stream is None:
+                        result = await asyncio.wait_for(self._call(self.rag, user_query, context), timeout=deadline.remaining())
+                        logging.info(f"Time to first token: {time.perf_counter() - started:.3f}s (non-streaming rag)")
+                        yield result
+                    else:
+                        tokens = []
+                        stream = self._iterate(self.rag_stream, user_query, context)
+                        while True:
+                            try:
+                                token = await asyncio.wait_for(stream.__anext__(), timeout=deadline.remaining())
+                            except StopAsyncIteration:
+                                break
+                            except asyncio.TimeoutError:
+                                await stream.aclose()
+                                if not tokens:
+                                    raise
+                                logging.error(f"504: Request deadline exceeded after {len(tokens)} streamed tokens")
+                                return
+                            if not tokens:
+                                logging.info(f"Time to first token: {time.perf_counter() - started:.3f}s")
+                                generate_span.set("first_token_seconds", round(time.perf_counter() - started, 4))
+                            tokens.append(token)
+                            yield token
+                        result = "".join(tokens)
+                        generate_span.set("streamed_chunks", len(tokens))
+                logging.info(f"Streamed response complete in {time.perf_counter() - started:.3f}s")
+
+                await self.validate_result(user_query, context, result)
+                if degraded:
+                    logging.info("Answer built from degraded retrieval; not cached")
+                else:
+                    self._cache_store(user_query, vector, result, kbs, started, versions)
+
+            except json.JSONDecodeError:
+                logging.error("500: Invalid sub-query JSON")
+                yield "Something went wrong while understanding your question."
+            except asyncio.TimeoutError:
+                logging.error(f"504: Request deadline of {self.request_deadline:.1f}s exceeded")
+                yield "That took longer than expected. Please try again."
+            except Exception as e:
+                logging.exception(f"500: Error in query handling - {e}")
+                yield "Something went wrong on my side. Please try again."
+
+    async def close(self):
+        """
+        Release the thread pool and the shared async clients.
+        """
+        for component in (self.query_gen, self.agent, self.web_search):
+            owner = getattr(component, "__self__", None)
+            if hasattr(owner, "stats"):
+                logging.info(f"{type(owner).__name__} stats: {owner.stats()}")
+        if self.hedger is not None:
+            logging.info(f"Hedging stats: {self.hedger.stats()}")
+        if self.validation_queue is not None:
+            await self.validation_queue.aclose()
+            logging.info(f"Validation stats: {self.validation_queue.stats()}")
+        if self.answer_cache is not None:
+            logging.info(f"Answer cache stats: {self.answer_cache.stats()}")
+            self.answer_cache.close()
+        self.executor.shutdown(wait=False)
+        await async_clients.close_all()
 
     async def chat_loop(self):
         """
         Continuous chat loop to accept and respond to user queries.
         """
         print("Bot is ready. Type 'no' to exit.")
-        while True:
-            user_query = input("User: ").strip()
-            if user_query.lower() == "no":
-                print("Bot: Feel free to chat again!")
-                break
-            response = await self.handle_query(user_query)
-            print("Bot:", response)
+        try:
+            while True:
+                user_query = (await asyncio.to_thread(input, "User: ")).strip()
+                if user_query.lower() == "no":
+                    print("Bot: Feel free to chat again!")
+                    break
+                print("Bot: ", end="", flush=True)
+                async for token in self.handle_query_stream(user_query):
+                    print(token, end="", flush=True)
+                print()
+        finally:
+            await self.close()
+
+def build_chatbot() -> RAGChatBot:
+    """
+    The production wiring of ``RAGChatBot``, shared by the chat loop and ``server``.
+    """
+    # Routes locally by embedding similarity; the LLM router only sees low-confidence sub-queries.
+    router = KBRouter(fallback=agent_model, fallback_async=agent_model_async)
+    # Single-intent questions skip the decomposition LLM; the rest are memoized.
+    decomposer = QueryDecomposer(query_generator, query_generator_async)
+    # Web fallback: reused sessions, per-call deadline and a TTL cache of normalized queries.
+    searcher = get_web_searcher()
+    chatbot = RAGChatBot(
+        vectorizer=qstn_vectorize_async,
+        multi_vectorizer=qstn_vectorize_multi_async,
+        context_packer=pack_context_async,
+        agent=router.route_async,
+        rag=rag_model_async,
+        rag_stream=rag_model_stream_async,
+        web_search=searcher.search_async,
+        answer_cache=AnswerCache(),
+        # Aggregate attendance questions are answered from precomputed rollups
+        DataBase = get_attendance_context,
+        query_gen=decomposer.decompose_async,
+        Validate=None,
+        validation_queue=ValidationQueue(Result_validation_batch_async),
+        # Embedding, routing and retrieval calls get a second request past their p95 latency
+        hedger=Hedger()
+    )
+    # Builds the attendance rollups off the request path, then keeps them current
+    start_background_refresh()
+    # Component counters are exported next to the stage histograms on /metrics
+    for name, stats in (
+        ("query_decomposer", decomposer.stats), ("kb_router", router.stats),
+        ("web_search", searcher.stats), ("hedger", chatbot.hedger.stats),
+        ("answer_cache", chatbot.answer_cache.stats), ("validation", chatbot.validation_queue.stats),
+        ("embedding_cache", embeddings.cache_stats),
+    ):
+        register_stats(name, stats)
+    return chatbot
 
 if __name__ == "__main__":
     try:
-        chatbot = RAGChatBot(
-            vectorizer=qstn_vectorize,
-            agent=agent_model,
-            rag=rag_model,
-            web_search=search_DDG,
-            DataBase = get_attendance_data,
-            query_gen=query_generator,
-            Validate=Result_validation
-        )
+        chatbot = build_chatbot()
+        if METRICS_PORT:
+            try:
+                start_metrics_server()
+            except OSError as e:
+                # E.g. another chatbot process on this host already serves the port
+                logging.warning(f"Metrics endpoint disabled: cannot bind port {METRICS_PORT} - {e}")
         asyncio.run(chatbot.chat_loop())
     except KeyboardInterrupt:
         logging.info("Chatbot terminated by user.")
@@ -0,0 +1,260 @@
+"""
+Fast path in front of the query decomposition LLM.
+
+Most questions carry a single intent, and for them ``query_generator`` just echoes the
+question back as a one-item list after a full LLM round trip. ``QueryDecomposer``
+decides locally whether a query is single-intent, from cheap surface features (length,
+conjunctions, question marks, sentence count) and, for borderline cases, embedding
+similarity to queries already known to be single-intent. Single-intent queries go
+straight to routing; the rest go to the LLM, whose decompositions are memoized by
+normalized query text.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from embeddings import vectorize, vectorize_async, vectorize_batch, vectorize_batch_async
+
+logger = logging.getLogger("query_generator")
+
+FASTPATH_MAX_WORDS = int(os.getenv("FASTPATH_MAX_WORDS", "14"))
+FASTPATH_SIMILARITY_THRESHOLD = float(os.getenv("FASTPATH_SIMILARITY_THRESHOLD", "0.88"))
+FASTPATH_MAX_EXEMPLARS = int(os.getenv("FASTPATH_MAX_EXEMPLARS", "2000"))
+DECOMPOSITION_MEMO_SIZE = int(os.getenv("DECOMPOSITION_MEMO_SIZE", "4096"))
+
+SINGLE_INTENT_EXEMPLARS = [
+    "What is the difference between baking soda and baking powder?",
+    "How long should I rest bread dough before and after shaping?",
+    "What are the pros and cons of running every day?",
+    "Show my attendance for January and February.",
+]
+
+_CONJUNCTIONS = re.compile(r"\b(and|or|also|plus|then|as well as|along with|besides)\b|[;&]", re.IGNORECASE)
+# Sentence punctuation followed by a space or the end ("2.5" is not a boundary)
+_SENTENCE_END = re.compile(r"[.!?]+(?:\s+|$)")
+
+# Feature verdicts
+SINGLE, MULTI, UNSURE = "single", "multi", "unsure"
+
+
+def normalize_query(query: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation; the memo key."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" ?!.")
+
+
+def classify_features(query: str, max_words: int = FASTPATH_MAX_WORDS) -> str:
+    """
+    Cheap surface classification of a query.
+
+    Returns:
+        SINGLE when the query is clearly one request, MULTI when it clearly holds several,
+        UNSURE otherwise.
+    """
+    words = len(query.split())
+    question_marks = query.count("?")
+    conjunctions = len(_CONJUNCTIONS.findall(query))
+    # A last sentence without closing punctuation counts too
+    sentences = sum(1 for part in _SENTENCE_END.split(query) if part.strip())
+    # "T-rex, sourdough recipes": a comma may separate two topics
+    commas = query.count(",")
+
+    if question_marks > 1 or sentences > 1 or conjunctions > 1:
+        return MULTI
+    if conjunctions == 0 and commas == 0 and words <= max_words:
+        return SINGLE
+    if words > 2 * max_words:
+        return MULTI
+    return UNSURE
+
+
+class QueryDecomposer:
+    """
+    Wraps the decomposition LLM with a local single-intent fast path and a memo.
+
+    Usage:
+        decomposer = QueryDecomposer(query_generator, query_generator_async)
+        queries_json = await decomposer.decompose_async(user_query)   # same JSON as query_generator
+    """
+
+    def __init__(
+        self,
+        generator: Optional[Callable[[str], str]] = None,
+        generator_async: Optional[Callable] = None,
+        exemplars: Optional[List[str]] = None,
+        similarity_threshold: float = FASTPATH_SIMILARITY_THRESHOLD,
+        memo_size: int = DECOMPOSITION_MEMO_SIZE,
+        use_embeddings: bool = True,
+    ):
+        """
+        Args:
+            generator: LLM decomposer used on the sync path (``query_generator``).
+            generator_async: LLM decomposer used by ``decompose_async``.
+            exemplars: Known single-intent queries; defaults to SINGLE_INTENT_EXEMPLARS.
+            similarity_threshold: Cosine similarity to an exemplar that makes an
+                UNSURE query single-intent.
+            memo_size: Number of LLM decompositions kept, by normalized query.
+            use_embeddings: Consult exemplar similarity for UNSURE queries.
+        """
+        self.generator = generator
+        self.generator_async = generator_async
+        self.similarity_threshold = similarity_threshold
+        self.memo_size = memo_size
+        self.use_embeddings = use_embeddings
+
+        self._pending_exemplars = list(exemplars if exemplars is not None else SINGLE_INTENT_EXEMPLARS)
+        self._exemplar_texts: List[str] = []
+        self._exemplars = np.zeros((0, 0), dtype=np.float32)
+        self._memo: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.fast_path = 0
+        self.memo_hits = 0
+        self.llm_calls = 0
+        self._llm_seconds = 0.0
+
+    # -- single-intent exemplars -------------------------------------------------
+
+    def _add_exemplars(self, texts: List[str], vectors):
+        with self._lock:
+            rows = []
+            for text, vector in zip(texts, vectors):
+                if vector is None or text in self._exemplar_texts:
+                    continue
+                vector = np.asarray(vector, dtype=np.float32)
+                rows.append(vector / max(float(np.linalg.norm(vector)), 1e-12))
+                self._exemplar_texts.append(text)
+            if not rows:
+                return
+            self._exemplars = np.vstack([self._exemplars, rows]) if self._exemplars.size else np.stack(rows)
+            overflow = len(self._exemplar_texts) - FASTPATH_MAX_EXEMPLARS
+            if overflow > 0:
+                self._exemplars = self._exemplars[overflow:]
+                self._exemplar_texts = self._exemplar_texts[overflow:]
+
+    def _take_pending(self) -> List[str]:
+        """Exemplars still to be embedded (seed list first, then LLM-confirmed ones)."""
+        with self._lock:
+            pending, self._pending_exemplars = self._pending_exemplars, []
+        return pending
+
+    def _similar_to_single(self, vector) -> bool:
+        with self._lock:
+            exemplars = self._exemplars
+        if vector is None or not exemplars.size:
+            return False
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        return float(np.max(exemplars @ vector)) >= self.similarity_threshold
+
+    def _is_single(self, query: str) -> bool:
+        verdict = classify_features(query)
+        if verdict != UNSURE or not self.use_embeddings:
+            return verdict == SINGLE
+        pending = self._take_pending()
+        if pending:
+            # The exemplars and the query in one embedding request
+            *vectors, query_vector = vectorize_batch(pending + [query])
+            self._add_exemplars(pending, vectors)
+            return self._similar_to_single(query_vector)
+        return self._similar_to_single(vectorize(query))
+
+    async def _is_single_async(self, query: str) -> bool:
+        verdict = classify_features(query)
+        if verdict != UNSURE or not self.use_embeddings:
+            return verdict == SINGLE
+        pending = self._take_pending()
+        if pending:
+            *vectors, query_vector = await vectorize_batch_async(pending + [query])
+            self._add_exemplars(pending, vectors)
+            return self._similar_to_single(query_vector)
+        return self._similar_to_single(await vectorize_async(query))
+
+    # -- memo --------------------------------------------------------------------
+
+    def _memo_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            result = self._memo.get(key)
+            if result is not None:
+                self._memo.move_to_end(key)
+                self.memo_hits += 1
+            return result
+
+    def _memo_put(self, key: str, query: str, result: str, seconds: float):
+        try:
+            queries = json.loads(result).get("queries", [])
+        except (TypeError, ValueError, AttributeError):
+            return
+        with self._lock:
+            self.llm_calls += 1
+            self._llm_seconds += seconds
+            if not queries:
+                return
+            self._memo[key] = result
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        if len(queries) == 1 and self.use_embeddings:
+            # The LLM confirmed this query is single-intent: similar queries can skip it next time.
+            with self._lock:
+                self._pending_exemplars.append(query)
+
+    def _fast_result(self, query: str) -> str:
+        with self._lock:
+            self.fast_path += 1
+        logger.info("Decomposition fast path for user input: %s", query)
+        return json.dumps({"queries": [query.strip()]})
+
+    # -- public API --------------------------------------------------------------
+
+    def decompose(self, user_query: str) -> str:
+        """
+        Drop-in replacement for ``query_generator``.
+
+        Returns:
+            A stringified JSON containing the list of sub-queries.
+        """
+        if self._is_single(user_query):
+            return self._fast_result(user_query)
+        key = normalize_query(user_query)
+        cached = self._memo_get(key)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        result = self.generator(user_query)
+        self._memo_put(key, user_query, result, time.perf_counter() - started)
+        return result
+
+    async def decompose_async(self, user_query: str) -> str:
+        """Async variant of ``decompose``; drop-in replacement for ``query_generator_async``."""
+        if await self._is_single_async(user_query):
+            return self._fast_result(user_query)
+        key = normalize_query(user_query)
+        cached = self._memo_get(key)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        result = await self.generator_async(user_query)
+        self._memo_put(key, user_query, result, time.perf_counter() - started)
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.fast_path + self.memo_hits + self.llm_calls
+        skipped = self.fast_path + self.memo_hits
+        average_llm = self._llm_seconds / self.llm_calls if self.llm_calls else 0.0
+        return {
+            "fast_path": self.fast_path,
+            "memo_hits": self.memo_hits,
+            "llm_calls": self.llm_calls,
+            "skip_rate": skipped / requests if requests else 0.0,
+            # Estimated from the mean latency of the LLM calls that were made.
+            "seconds_saved": skipped * average_llm,
+        }
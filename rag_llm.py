@@ -2,6 +2,10 @@ import os
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 
+import async_clients
+from telemetry import record_usage
+from deadlines import timeout_kwargs
+
 load_dotenv()
 
 endpoints = os.getenv("GEN_MODEL_ENDPOINT")
@@ -13,21 +17,8 @@ api_versions = os.getenv("GEN_MODEL_VERSION")
 user_query = " "
 retrieved_document = " "
 
-def rag_model(user_query, retrieved_document):
-    
-    endpoint = endpoints
-    # model_name = model_names
-    deployment = deployments
-    subscription_key = subscription_keys
-    api_version = api_versions
-
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=endpoint,
-        api_key=subscription_key,
-    )
-
-    prompt = f"""
+def build_prompt(user_query, retrieved_document):
+    return f"""
                 # System:
                     Your name is **POKI**, a friendly and knowledgeable AI assistant, helping users with everyday Dinosaur, baking and fitness -related queries.
 
@@ -67,21 +58,117 @@ def rag_model(user_query, retrieved_document):
                     {user_query} 
                 """
 
+COMPLETION_PARAMS = dict(
+    max_completion_tokens=800,
+    temperature=0.3,
+    top_p=1.0,
+    frequency_penalty=0.0,
+    presence_penalty=0.0,
+    model=deployments
+)
+
+def rag_model(user_query, retrieved_document):
+    
+    endpoint = endpoints
+    # model_name = model_names
+    subscription_key = subscription_keys
+    api_version = api_versions
+
+    client = AzureOpenAI(
+        api_version=api_version,
+        azure_endpoint=endpoint,
+        api_key=subscription_key,
+    )
+
     response = client.chat.completions.create(
         messages=[
             {
                 "role": "system",
-                "content": prompt,
+                "content": build_prompt(user_query, retrieved_document),
             }
         ],
-        max_completion_tokens=800,
-        temperature=0.3,
-        top_p=1.0,
-        frequency_penalty=0.0,
-        presence_penalty=0.0,
-        model=deployment
+        **COMPLETION_PARAMS
     )
 
+    record_usage(response.usage)
     return response.choices[0].message.content
 
+async def rag_model_async(user_query, retrieved_document):
+    """
+    Async variant of ``rag_model`` on the shared async client.
+    """
+    response = await async_clients.get_chat_client().chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": build_prompt(user_query, retrieved_document),
+            }
+        ],
+        **COMPLETION_PARAMS,
+        **timeout_kwargs()
+    )
+
+    record_usage(response.usage)
+    return response.choices[0].message.content
+
+def _delta_text(chunk):
+    # Azure sends a prompt-filter chunk with no choices before the first token
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+def rag_model_stream(user_query, retrieved_document):
+    """
+    Streaming variant of ``rag_model``: yields the answer token by token.
+    """
+    client = AzureOpenAI(
+        api_version=api_versions,
+        azure_endpoint=endpoints,
+        api_key=subscription_keys,
+    )
+
+    stream = client.chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": build_prompt(user_query, retrieved_document),
+            }
+        ],
+        stream=True,
+        # The last chunk then carries the token usage (and no choices)
+        stream_options={"include_usage": True},
+        **COMPLETION_PARAMS
+    )
+
+    for chunk in stream:
+        if chunk.usage is not None:
+            record_usage(chunk.usage)
+        text = _delta_text(chunk)
+        if text:
+            yield text
+
+async def rag_model_stream_async(user_query, retrieved_document):
+    """
+    Async streaming variant of ``rag_model`` on the shared async client.
+    """
+    stream = await async_clients.get_chat_client().chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": build_prompt(user_query, retrieved_document),
+            }
+        ],
+        stream=True,
+        stream_options={"include_usage": True},
+        **COMPLETION_PARAMS,
+        **timeout_kwargs()
+    )
+
+    async for chunk in stream:
+        if chunk.usage is not None:
+            record_usage(chunk.usage)
+        text = _delta_text(chunk)
+        if text:
+            yield text
+
 # print(model(user_query, retrieved_document))
\ No newline at end of file
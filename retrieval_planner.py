@@ -0,0 +1,170 @@
+"""
+Per-request retrieval planner.
+
+Given the routed sub-queries of one user query, the planner groups them by knowledge
+base, runs each distinct (sub-query, KB) retrieval once (single-flight), sends one
+multi-vector search per KB when several distinct sub-queries target it, and removes
+duplicate chunks before the context reaches the RAG model.
+"""
+
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from deadlines import DROPPED, gather_within
+from telemetry import span
+
+logger = logging.getLogger("retrieval_planner")
+
+WEB_KB = "junaidh-text-NoKB"
+DB_KB = "junaidh-text-DB"
+
+def _dedupe_key(item: Any) -> str:
+    if isinstance(item, str):
+        return " ".join(item.split())
+    try:
+        return json.dumps(item, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        return repr(item)
+
+
+def dedupe_context(results: Sequence[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+    """
+    Drops repeated chunks across (source, result) pairs, keeping first occurrences.
+
+    List results are filtered item by item; any other result is kept whole unless an
+    identical result was already seen. Results left empty are dropped.
+    """
+    seen = set()
+    context = []
+    for source, result in results:
+        if not result:
+            continue
+        if isinstance(result, list):
+            kept = []
+            for item in result:
+                key = _dedupe_key(item)
+                if key not in seen:
+                    seen.add(key)
+                    kept.append(item)
+            if kept:
+                context.append((source, kept))
+        else:
+            key = _dedupe_key(result)
+            if key not in seen:
+                seen.add(key)
+                context.append((source, result))
+    return context
+
+
+class RetrievalPlanner:
+    """
+    Plans and runs the retrieval calls of one request.
+
+    Usage:
+        planner = RetrievalPlanner(bot._call, vectorizer, web_search, database, multi_vectorizer)
+        context = await planner.retrieve([(sub_query, kb), ...])
+    """
+
+    def __init__(
+        self,
+        call: Callable[..., Awaitable[Any]],
+        vectorizer: Callable,
+        web_search: Callable,
+        database: Callable,
+        multi_vectorizer: Optional[Callable] = None,
+    ):
+        """
+        Args:
+            call: Adapter that awaits async components and runs sync ones off the loop.
+            vectorizer: (question, kb) -> chunks.
+            web_search: (question) -> results.
+            database: (question) -> records.
+            multi_vectorizer: Optional (questions, kb) -> chunks, one search for many questions.
+        """
+        self._call = call
+        self.vectorizer = vectorizer
+        self.web_search = web_search
+        self.database = database
+        self.multi_vectorizer = multi_vectorizer
+        self._flights: Dict[Tuple[str, ...], "asyncio.Future"] = {}
+        self.requested = 0
+        self.executed = 0
+        # Retrievals cancelled by the time limit of ``retrieve_tagged``: the context is partial
+        self.dropped = 0
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    async def _once(self, source: str, key: Tuple[str, ...], component, *args):
+        """Single-flight: concurrent callers with the same key share one call."""
+        self.requested += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            self.executed += 1
+            flight = asyncio.ensure_future(self._safe_call(source, component, *args))
+            self._flights[key] = flight
+        return await asyncio.shield(flight)
+
+    async def _safe_call(self, source: str, component, *args):
+        try:
+            with span("retrieve", source=source) as retrieve_span:
+                result = await self._call(component, *args)
+                retrieve_span.set("chunks", len(result) if isinstance(result, list) else int(bool(result)))
+            return result
+        except Exception as e:
+            logger.exception("Retrieval call failed for %s: %s", args, e)
+            return None
+
+    def plan(self, routed: Sequence[Tuple[str, str]]) -> "OrderedDict[str, List[str]]":
+        """
+        Group routed sub-queries by KB, dropping repeats.
+
+        Returns:
+            KB -> distinct sub-queries, in first-seen order.
+        """
+        groups: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        for sub_query, kb in routed:
+            groups.setdefault(kb, OrderedDict()).setdefault(self._normalize(sub_query), sub_query)
+        return OrderedDict((kb, list(queries.values())) for kb, queries in groups.items())
+
+    def _calls_for(self, kb: str, queries: List[str]) -> List[Tuple[str, Awaitable]]:
+        if kb == WEB_KB:
+            return [("web", self._once("web", ("web", self._normalize(q)), self.web_search, q)) for q in queries]
+        if kb == DB_KB:
+            return [("database", self._once("database", ("db", self._normalize(q)), self.database, q)) for q in queries]
+        if len(queries) > 1 and self.multi_vectorizer is not None:
+            key = ("multi", kb) + tuple(sorted(self._normalize(q) for q in queries))
+            return [(kb, self._once(kb, key, self.multi_vectorizer, queries, kb))]
+        return [(kb, self._once(kb, ("vector", kb, self._normalize(q)), self.vectorizer, q, kb)) for q in queries]
+
+    async def retrieve_tagged(self, routed: Sequence[Tuple[str, str]], timeout: Optional[float] = None) -> List[Tuple[str, Any]]:
+        """
+        Run the planned retrieval and return de-duplicated context tagged with its source
+        (the KB name, "web" or "database").
+
+        Args:
+            routed: (sub_query, kb) pairs as decided by the router.
+            timeout: Seconds to wait; retrievals still running then are cancelled and
+                the context gathered so far is returned.
+        """
+        calls = [call for kb, queries in self.plan(routed).items() for call in self._calls_for(kb, queries)]
+        results = await gather_within([call for _, call in calls], timeout, default=DROPPED)
+        self.dropped += sum(result is DROPPED for result in results)
+        results = [None if result is DROPPED else result for result in results]
+        if timeout is not None:
+            for flight in self._flights.values():
+                flight.cancel()
+        context = dedupe_context([(source, result) for (source, _), result in zip(calls, results)])
+        logger.info(
+            "Retrieval plan: %d sub-queries -> %d calls; %d context entries after de-duplication",
+            len(routed), self.executed, len(context),
+        )
+        return context
+
+    async def retrieve(self, routed: Sequence[Tuple[str, str]], timeout: Optional[float] = None) -> List[Any]:
+        """Like ``retrieve_tagged``, without the source tags."""
+        return [result for _, result in await self.retrieve_tagged(routed, timeout)]
@@ -0,0 +1,406 @@
+"""
+ASGI serving mode for the chatbot.
+
+Exposes ``RAGChatBot.handle_query`` and ``handle_query_stream`` over HTTP, so one process
+serves many concurrent users. Run several processes per node with ``SERVER_WORKERS``:
+
+    python server.py                          # uvicorn, SERVER_HOST:SERVER_PORT
+    uvicorn server:app --workers 4            # or any ASGI server
+
+Endpoints:
+    POST /query           {"query": "..."} -> {"answer": "..."}
+    POST /query/stream    same request; the answer as server-sent events, one per token
+    GET  /healthz         liveness, with admission counters
+    GET  /readyz          200 once the downstream clients are warm, 503 before and while draining
+    GET  /metrics         Prometheus text from ``telemetry``
+
+Admission control bounds the load a process takes on. At most SERVER_MAX_IN_FLIGHT
+queries run at once, and up to SERVER_MAX_QUEUE more wait (FIFO) for a slot for at most
+SERVER_QUEUE_TIMEOUT seconds. Anything beyond that is shed with 429 and Retry-After, so
+an overloaded process answers fast instead of timing everyone out. Once shutdown begins,
+new and still-queued queries get 503 with Retry-After while in-flight ones finish.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import async_clients
+import database_access
+import telemetry
+from embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL
+
+logger = logging.getLogger("server")
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_MAX_IN_FLIGHT = int(os.getenv("SERVER_MAX_IN_FLIGHT", "32"))
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "64"))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "5"))
+SERVER_WARMUP_TIMEOUT = float(os.getenv("SERVER_WARMUP_TIMEOUT", "15"))
+SERVER_DRAIN_SECONDS = float(os.getenv("SERVER_DRAIN_SECONDS", "30"))
+# Probes that must succeed before /readyz reports ready; the others are informational.
+SERVER_REQUIRED_WARM = {name.strip() for name in os.getenv("SERVER_REQUIRED_WARM", "chat,embedding").split(",") if name.strip()}
+SERVER_MAX_BODY_BYTES = 64 * 1024
+
+
+class Overloaded(Exception):
+    """Raised when a query is shed by admission control."""
+
+
+class Draining(Overloaded):
+    """Raised when a query arrives (or leaves the queue) after shutdown began."""
+
+
+class AdmissionController:
+    """In-flight limit with a bounded FIFO wait queue."""
+
+    def __init__(
+        self,
+        max_in_flight: int = SERVER_MAX_IN_FLIGHT,
+        max_queue: int = SERVER_MAX_QUEUE,
+        queue_timeout: float = SERVER_QUEUE_TIMEOUT,
+    ):
+        """
+        Args:
+            max_in_flight: Queries processed concurrently.
+            max_queue: Queries allowed to wait for a slot; more are shed immediately.
+            queue_timeout: Seconds a query may wait for a slot before it is shed.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.draining = False
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._queue_seconds = 0.0
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Holds a slot for the enclosed block; raises ``Overloaded`` when none can be had,
+        and ``Draining`` once shutdown began.
+        """
+        if self.draining:
+            raise Draining("shutting down")
+        if not self._slots.locked():
+            # A free slot is taken without suspending, so a burst cannot overrun the check below
+            await self._slots.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                raise Overloaded("queue full")
+            started = time.perf_counter()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed += 1
+                raise Overloaded("queue timeout")
+            finally:
+                self.waiting -= 1
+            self._queue_seconds += time.perf_counter() - started
+            if self.draining:
+                self._slots.release()
+                raise Draining("shutting down")
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "mean_queue_seconds": self._queue_seconds / self.admitted if self.admitted else 0.0,
+        }
+
+
+# ---------------------------------------------------------------------- warm-up
+
+
+async def _probe_chat():
+    await async_clients.get_chat_client().chat.completions.create(
+        model=os.getenv("GEN_MODEL"), messages=[{"role": "user", "content": "ping"}], max_tokens=1,
+    )
+
+
+async def _probe_embedding():
+    await async_clients.get_embedding_client().embeddings.create(
+        input=["ping"], model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS,
+    )
+
+
+async def _probe_mongo():
+    # The attendance path queries through the pooled sync client, so that is the one to open.
+    await asyncio.to_thread(lambda: database_access.get_client().admin.command("ping"))
+
+
+DEFAULT_PROBES: Dict[str, Callable[[], Awaitable]] = {
+    "chat": _probe_chat,
+    "embedding": _probe_embedding,
+    "mongo": _probe_mongo,
+}
+
+
+class Warmup:
+    """
+    Opens the pooled downstream clients with one cheap call each and remembers which
+    are warm.
+    """
+
+    def __init__(self, probes: Optional[Dict[str, Callable[[], Awaitable]]] = None, required=None):
+        self.probes = dict(DEFAULT_PROBES if probes is None else probes)
+        self.required = set(SERVER_REQUIRED_WARM if required is None else required) & set(self.probes)
+        self.status: Dict[str, Dict[str, Any]] = {name: {"warm": False} for name in self.probes}
+
+    async def _run(self, name: str, probe: Callable[[], Awaitable], timeout: float):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), timeout=timeout)
+            self.status[name] = {"warm": True, "seconds": round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            self.status[name] = {"warm": False, "error": f"{type(e).__name__}: {e}"}
+            logger.warning("Warm-up probe '%s' failed: %s", name, e)
+
+    async def warm(self, timeout: float = SERVER_WARMUP_TIMEOUT):
+        """Runs the probes that are not warm yet, concurrently."""
+        await asyncio.gather(*(
+            self._run(name, probe, timeout) for name, probe in self.probes.items() if not self.status[name]["warm"]
+        ))
+
+    @property
+    def ready(self) -> bool:
+        return all(self.status[name]["warm"] for name in self.required)
+
+
+# ---------------------------------------------------------------------- ASGI
+
+
+def _default_factory():
+    # Imported here so every worker process wires its own bot and clients.
+    from main import build_chatbot
+    return build_chatbot()
+
+
+class RAGServer:
+    """
+    The ASGI application.
+
+    Usage:
+        app = RAGServer()                              # production wiring from main.build_chatbot
+        app = RAGServer(lambda: RAGChatBot(...))       # any bot, e.g. with benchmark fakes
+    """
+
+    def __init__(
+        self,
+        bot_factory: Callable[[], Any] = _default_factory,
+        admission: Optional[AdmissionController] = None,
+        warmup: Optional[Warmup] = None,
+    ):
+        self.bot_factory = bot_factory
+        self.admission = admission
+        self.warmup = warmup
+        self.bot = None
+        self._warm_task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def draining(self) -> bool:
+        return self.admission is not None and self.admission.draining
+
+    @draining.setter
+    def draining(self, value: bool):
+        self.admission.draining = value
+
+    # -- lifespan ------------------------------------------------------------------
+
+    async def startup(self):
+        async with self._start_lock:
+            if self.bot is None:
+                await self._start()
+
+    async def _start(self):
+        if self.admission is None:
+            # Created on the serving loop: asyncio primitives bind to it
+            self.admission = AdmissionController()
+        if self.warmup is None:
+            self.warmup = Warmup()
+        self.bot = self.bot_factory()
+        telemetry.register_stats("admission", self.admission.stats)
+        # Serve /healthz immediately; /readyz turns 200 once the probes succeed.
+        self._warm_task = asyncio.get_running_loop().create_task(self.warmup.warm())
+        logger.info("Server started (max in flight %d, max queue %d)", self.admission.max_in_flight, self.admission.max_queue)
+
+    async def shutdown(self):
+        self.draining = True
+        deadline = time.monotonic() + SERVER_DRAIN_SECONDS
+        while self.admission.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+        if self.bot is not None:
+            await self.bot.close()
+        logger.info("Server stopped")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception("Startup failed: %s", e)
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # -- HTTP helpers ----------------------------------------------------------------
+
+    @staticmethod
+    async def _send(send, status: int, body: bytes, content_type: str, headers: List[Tuple[bytes, bytes]] = ()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()), *headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+        telemetry.metrics.count("rag_http_responses_total", status=str(status))
+
+    async def _json(self, send, status: int, payload: Dict[str, Any], headers: List[Tuple[bytes, bytes]] = ()):
+        await self._send(send, status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    async def _read_query(self, receive, send) -> Optional[str]:
+        """The "query" field of the JSON body, or None after an error response was sent."""
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body += message.get("body", b"")
+            if len(body) > SERVER_MAX_BODY_BYTES:
+                await self._json(send, 413, {"error": "request body too large"})
+                return None
+            if not message.get("more_body"):
+                break
+        try:
+            query = json.loads(body or b"{}").get("query")
+        except (ValueError, AttributeError):
+            query = None
+        if not isinstance(query, str) or not query.strip():
+            await self._json(send, 400, {"error": 'expected a JSON body like {"query": "..."}'})
+            return None
+        return query.strip()
+
+    async def _overloaded(self, send, error: Overloaded):
+        retry_after = max(1, int(self.admission.queue_timeout))
+        if isinstance(error, Draining):
+            status, payload = 503, {"error": "server shutting down", "reason": str(error)}
+        else:
+            status, payload = 429, {"error": "server busy", "reason": str(error)}
+        await self._json(send, status, payload, [(b"retry-after", str(retry_after).encode())])
+
+    # -- endpoints -------------------------------------------------------------------
+
+    async def _query(self, receive, send):
+        query = await self._read_query(receive, send)
+        if query is None:
+            return
+        try:
+            async with self.admission.admit():
+                answer = await self.bot.handle_query(query)
+        except Overloaded as e:
+            await self._overloaded(send, e)
+            return
+        await self._json(send, 200, {"answer": answer})
+
+    async def _query_stream(self, receive, send):
+        query = await self._read_query(receive, send)
+        if query is None:
+            return
+        try:
+            async with self.admission.admit():
+                await send({
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+                })
+                stream = self.bot.handle_query_stream(query)
+                try:
+                    async for token in stream:
+                        await send({"type": "http.response.body", "body": f"data: {json.dumps(token)}\n\n".encode("utf-8"), "more_body": True})
+                finally:
+                    await stream.aclose()
+                await send({"type": "http.response.body", "body": b"event: end\ndata: {}\n\n"})
+                telemetry.metrics.count("rag_http_responses_total", status="200")
+        except Overloaded as e:
+            await self._overloaded(send, e)
+
+    async def _health(self, send):
+        await self._json(send, 200, {"status": "ok", **self.admission.stats()})
+
+    async def _ready(self, send):
+        ready = self.warmup.ready and not self.draining
+        await self._json(send, 200 if ready else 503, {
+            "ready": ready,
+            "draining": self.draining,
+            "clients": self.warmup.status,
+            "required": sorted(self.warmup.required),
+            "admission": self.admission.stats(),
+        })
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if self.bot is None:
+            # Servers without lifespan support: start on the first request
+            await self.startup()
+
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        routes = {
+            ("POST", "/query"): lambda: self._query(receive, send),
+            ("POST", "/query/stream"): lambda: self._query_stream(receive, send),
+            ("GET", "/healthz"): lambda: self._health(send),
+            ("GET", "/readyz"): lambda: self._ready(send),
+            ("GET", "/metrics"): lambda: self._send(send, 200, telemetry.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"),
+        }
+        handler = routes.get((method, path))
+        if handler is not None:
+            await handler()
+        elif any(route_path == path for _, route_path in routes):
+            await self._json(send, 405, {"error": "method not allowed"})
+        else:
+            await self._json(send, 404, {"error": "not found"})
+
+
+app = RAGServer()
+
+
+if __name__ == "__main__":
+    try:
+        # uvicorn is only required to run this module directly; any ASGI server can host ``app``.
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is not installed: pip install uvicorn, or run server:app under another ASGI server")
+    uvicorn.run("server:app", host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS, lifespan="on")
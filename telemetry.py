@@ -0,0 +1,345 @@
+"""
+Tracing and metrics for the RAG pipeline.
+
+Every stage of a query runs in a ``span``: decompose, route, retrieve (tagged with the
+KB, "web" or "database"), pack, generate and validate, all under one "query" root span.
+Spans carry their duration and attributes such as token usage, chunk counts and cache
+hits. Nesting follows the asyncio context, so concurrent sub-queries keep their own
+parents.
+
+Finished spans feed three outputs:
+    metrics     latency histograms and counters, rendered in the Prometheus text format
+                by ``render_prometheus`` (served by ``start_metrics_server``)
+    trace sink  OTLP/JSON-shaped span records appended to TRACE_EXPORT_PATH, if set
+    OpenTelemetry  when the ``opentelemetry`` API is installed and TRACE_OTEL=1, spans are
+                also recorded on its tracer, so any configured OTel exporter receives them
+
+Component ``stats()`` methods (decomposer, router, caches, hedger, ...) can be
+registered with ``register_stats`` and are exported as gauges at scrape time.
+"""
+
+import os
+import json
+import time
+import logging
+import secrets
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("telemetry")
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_OTEL = os.getenv("TRACE_OTEL", "0") == "1"
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+# 0 disables the /metrics endpoint (9464 is the usual Prometheus exporter port)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Set to 0.0.0.0 to let a remote Prometheus scrape it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+SERVICE_NAME = os.getenv("SERVICE_NAME", "agentic-rag")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """One timed pipeline step; attributes are set with ``set`` or ``add``."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add(self, key: str, amount: float = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OTLP/JSON field names, so standard tooling can ingest the sink."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# ---------------------------------------------------------------------- metrics
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram per label set."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[Tuple[str, str], ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            # bucket counts, then +Inf count, then sum
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+
+class Metrics:
+    """Histograms and counters fed by finished spans."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram()
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._stats: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def count(self, name: str, amount: float = 1, **labels: str):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + amount
+
+    def observe_span(self, span: Span):
+        labels = [("stage", span.name)]
+        if "source" in span.attributes:
+            labels.append(("source", str(span.attributes["source"])))
+        labels = tuple(labels)
+        with self._lock:
+            self.latency.observe(labels, span.duration)
+        if span.error:
+            self.count("rag_stage_errors_total", stage=span.name)
+        for key in ("prompt_tokens", "completion_tokens"):
+            if key in span.attributes:
+                self.count("rag_tokens_total", span.attributes[key], stage=span.name, kind=key.split("_")[0])
+        if "chunks" in span.attributes:
+            self.count("rag_chunks_total", span.attributes["chunks"], **dict(labels))
+        if "cache_hit" in span.attributes:
+            self.count("rag_cache_lookups_total", stage=span.name, hit=str(bool(span.attributes["cache_hit"])).lower())
+
+    def register_stats(self, component: str, stats: Callable[[], Dict[str, Any]]):
+        with self._lock:
+            self._stats[component] = stats
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP rag_stage_duration_seconds Duration of RAG pipeline stages.",
+            "# TYPE rag_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self.latency._series.items()}
+            counters = dict(self.counters)
+            stats = dict(self._stats)
+        for labels, values in sorted(series.items()):
+            base = ",".join(f'{key}="{value}"' for key, value in labels)
+            for bound, count in zip(self.latency.buckets, values):
+                lines.append(f'rag_stage_duration_seconds_bucket{{{base},le="{bound}"}} {count:g}')
+            lines.append(f'rag_stage_duration_seconds_bucket{{{base},le="+Inf"}} {values[-2]:g}')
+            lines.append(f"rag_stage_duration_seconds_count{{{base}}} {values[-2]:g}")
+            lines.append(f"rag_stage_duration_seconds_sum{{{base}}} {values[-1]:.6f}")
+
+        declared = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            base = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+            lines.append(f"{name}{{{base}}} {value:g}")
+
+        if stats:
+            lines.append("# TYPE rag_component_stat gauge")
+        for component, collect in sorted(stats.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning("Stats collection failed for %s: %s", component, e)
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'rag_component_stat{{component="{component}",stat="{key}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+_recent: Deque[Dict[str, Any]] = deque(maxlen=TRACE_BUFFER_SIZE)
+_sink_lock = threading.Lock()
+_otel_tracer = None
+_listeners: List[Callable[[Span], None]] = []
+
+
+def _get_otel_tracer():
+    """OpenTelemetry tracer when enabled; ``opentelemetry`` is only required then."""
+    global _otel_tracer, TRACE_OTEL
+    if _otel_tracer is None and TRACE_OTEL:
+        try:
+            from opentelemetry import trace
+            _otel_tracer = trace.get_tracer(SERVICE_NAME)
+        except ImportError:
+            logger.warning("TRACE_OTEL=1 but opentelemetry is not installed; spans stay local")
+            TRACE_OTEL = False
+    return _otel_tracer
+
+
+def _export(span: Span):
+    metrics.observe_span(span)
+    for listener in list(_listeners):
+        listener(span)
+    record = span.to_otlp()
+    _recent.append(record)
+    if TRACE_EXPORT_PATH:
+        line = json.dumps(record, default=str)
+        with _sink_lock:
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    tracer = _get_otel_tracer()
+    if tracer is not None:
+        otel_span = tracer.start_span(span.name, start_time=span.start_ns, attributes={
+            key: value if isinstance(value, (bool, int, float, str)) else str(value)
+            for key, value in span.attributes.items()
+        })
+        otel_span.end(end_time=span.end_ns)
+
+
+# ---------------------------------------------------------------------- spans
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Times the enclosed block as a child of the current span (or a new trace).
+
+    Usage:
+        with span("retrieve", source=kb) as s:
+            chunks = await vectorizer(question, kb)
+            s.set("chunks", len(chunks))
+    """
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Ended from another context (e.g. an async generator closed elsewhere)
+            pass
+        _export(current)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def set_attribute(key: str, value: Any):
+    """Sets an attribute on the current span, if there is one."""
+    current = _current.get()
+    if current is not None:
+        current.set(key, value)
+
+
+def record_usage(usage: Any):
+    """Adds an SDK response's token usage (``response.usage``) to the current span."""
+    current = _current.get()
+    if current is None or usage is None:
+        return
+    for key in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, key, None)
+        if value:
+            current.add(key, value)
+
+
+def record_cache(cache: str, hits: int, misses: int):
+    """Counts lookups of a cache that has no span of its own (e.g. embeddings)."""
+    if hits:
+        metrics.count("rag_cache_lookups_total", hits, stage=cache, hit="true")
+    if misses:
+        metrics.count("rag_cache_lookups_total", misses, stage=cache, hit="false")
+
+
+def add_span_listener(listener: Callable[[Span], None]):
+    """Calls ``listener(span)`` for every finished span (e.g. the benchmark's per-stage timings)."""
+    _listeners.append(listener)
+
+
+def remove_span_listener(listener: Callable[[Span], None]):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def register_stats(component: str, stats: Callable[[], Dict[str, Any]]):
+    metrics.register_stats(component, stats)
+
+
+def recent_spans(trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Recently finished spans (OTLP/JSON shape), optionally of one trace."""
+    return [record for record in list(_recent) if trace_id is None or record["traceId"] == trace_id]
+
+
+def render_prometheus() -> str:
+    return metrics.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics %s", format % args)
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> ThreadingHTTPServer:
+    """
+    Serves ``/metrics`` for Prometheus from a daemon thread.
+
+    Raises:
+        OSError: The address could not be bound (e.g. the port is in use).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving Prometheus metrics on %s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Module-level clients are built at import time; point them at the local backend and
+# scratch files so the tests never reach Azure.
+_SCRATCH = tempfile.mkdtemp(prefix="rag-tests-")
+for name, value in {
+    "INDEX": "test-index",
+    "SEARCH_BACKEND": "local",
+    "LOCAL_INDEX_DIR": os.path.join(_SCRATCH, "local_index"),
+    "EMBEDDING_CACHE_PATH": os.path.join(_SCRATCH, "embedding_cache.sqlite3"),
+    "ANSWER_CACHE_PATH": os.path.join(_SCRATCH, "answer_cache.sqlite3"),
+    "INGEST_MANIFEST_PATH": os.path.join(_SCRATCH, "ingest_manifest.sqlite3"),
+    "AZURE_OPENAI_API_KEY": "test",
+    "AZURE_OPENAI_API_VERSION": "2024-06-01",
+    "AZURE_OPENAI_ENDPOINT": "https://example.invalid",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,138 @@
+import threading
+from types import SimpleNamespace
+
+import ingest_pipeline
+from index_doc_upload import generate_unique_id
+from ingest_manifest import IngestManifest
+from ingest_pipeline import IngestionPipeline
+from keyword_index import BM25Index
+
+
+class FakeSearchClient:
+    def __init__(self):
+        self.uploaded = []
+        self.deleted = []
+
+    def upload_documents(self, documents):
+        self.uploaded.extend(document["id"] for document in documents)
+        return [SimpleNamespace(key=document["id"], succeeded=True) for document in documents]
+
+    def delete_documents(self, documents):
+        self.deleted.extend(document["id"] for document in documents)
+        return [SimpleNamespace(key=document["id"], succeeded=True) for document in documents]
+
+
+class ScriptedPipeline(IngestionPipeline):
+    """
+    Feeds pre-chunked parts instead of extracting PDFs, and holds back the embed worker
+    that picked up the last part until the file's "end" message has been tracked.
+    """
+
+    last_part_ids = None
+
+    def __init__(self, parts, **options):
+        super().__init__(**options)
+        self.parts = parts
+        self.end_tracked = threading.Event()
+
+    def _extract_stage(self, pdf_files):
+        try:
+            for pdf in pdf_files:
+                state = self.manifest.check_file(pdf)
+                first_index = 1
+                for payload in self.parts:
+                    self._count("chunks", len(payload))
+                    self._chunk_queue.put(("part", pdf, state, first_index, payload))
+                    first_index += len(payload)
+                self._chunk_queue.put(("end", pdf, state, len(self.parts), None))
+        finally:
+            for _ in range(self.embed_workers):
+                self._chunk_queue.put(ingest_pipeline._DONE)
+
+    def _plan_part(self, pdf, chunk_ids):
+        if chunk_ids == self.last_part_ids:
+            assert self.end_tracked.wait(timeout=5)
+        return super()._plan_part(pdf, chunk_ids)
+
+    def _track_end(self, pdf, state, parts, error):
+        tracked = super()._track_end(pdf, state, parts, error)
+        self.end_tracked.set()
+        return tracked
+
+
+def _ids(pdf, parts):
+    ids, index = [], 1
+    for payload in parts:
+        for text, _, _ in payload:
+            ids.append(generate_unique_id(pdf, index, method="content_hash", chunk_text=text))
+            index += 1
+    return ids
+
+
+def test_partly_unchanged_file_is_committed_when_end_overtakes_last_part(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_pipeline, "vectorize_batch", lambda texts: [[0.1, 0.2] for _ in texts])
+    monkeypatch.setattr(ingest_pipeline, "bump_index_version", lambda index: None)
+
+    pdf = tmp_path / "guide.pdf"
+    pdf.write_bytes(b"%PDF-1.4 version 1")
+    manifest = IngestManifest("test-index", path=str(tmp_path / "manifest.sqlite3"))
+    old_parts = [[("alpha", 1, 1), ("beta", 1, 1)], [("gamma", 2, 2), ("delta", 2, 2)]]
+    old_ids = _ids(pdf, old_parts)
+    manifest.commit_file(manifest.check_file(pdf), old_ids)
+
+    # Every remaining chunk is unchanged and "delta" was removed, so nothing is queued
+    # for upload and no acknowledgement can finalize the file.
+    pdf.write_bytes(b"%PDF-1.4 version 2")
+    new_parts = [[("alpha", 1, 1), ("beta", 1, 1)], [("gamma", 2, 2)]]
+    new_ids = _ids(pdf, new_parts)
+    client = FakeSearchClient()
+    pipeline = ScriptedPipeline(
+        new_parts, embed_workers=2, client=client, manifest=manifest, keyword_index=False,
+    )
+    pipeline.last_part_ids = new_ids[2:]
+
+    summary = pipeline.run([pdf])
+
+    assert client.uploaded == []
+    assert summary["reused_chunks"] == 3
+    assert set(client.deleted) == set(old_ids) - set(new_ids)
+    assert manifest.check_file(pdf) is None
+    assert manifest.uploaded_ids(pdf) == set(new_ids)
+
+
+def test_resumed_run_restores_acknowledged_chunks_missing_from_keyword_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_pipeline, "vectorize_batch", lambda texts: [[0.1, 0.2] for _ in texts])
+    monkeypatch.setattr(ingest_pipeline, "bump_index_version", lambda index: None)
+    monkeypatch.setattr(ingest_pipeline, "index", "resume-index")
+    keyword_root = tmp_path / "local_index"
+    monkeypatch.setattr(ingest_pipeline, "BM25Index", lambda name: BM25Index(name, root=str(keyword_root)))
+
+    pdf = tmp_path / "recipes.pdf"
+    pdf.write_bytes(b"%PDF-1.4 sourdough")
+    parts = [[("sourdough starter feeding", 1, 1), ("proofing basket", 1, 1)]]
+    manifest = IngestManifest("resume-index", path=str(tmp_path / "manifest.sqlite3"))
+    # A crashed run: the index acknowledged both chunks, the BM25 index was never saved.
+    manifest.record_chunks(pdf, _ids(pdf, parts))
+
+    client = FakeSearchClient()
+    pipeline = ScriptedPipeline(parts, embed_workers=2, client=client, manifest=manifest)
+    pipeline.run([pdf])
+
+    assert client.uploaded == []
+    assert manifest.check_file(pdf) is None
+    keywords = BM25Index("resume-index", root=str(keyword_root))
+    assert keywords.search_chunks("sourdough") == ["sourdough starter feeding"]
+    assert len(keywords) == 2
+
+
+def test_file_deleted_after_listing_is_recorded_as_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_pipeline, "bump_index_version", lambda index: None)
+    manifest = IngestManifest("test-index", path=str(tmp_path / "manifest.sqlite3"))
+    pipeline = IngestionPipeline(
+        extract_workers=1, embed_workers=1, client=FakeSearchClient(), manifest=manifest, keyword_index=False,
+    )
+
+    summary = pipeline.run([tmp_path / "deleted.pdf"], folders=[])
+
+    assert summary["failed_files"] == 1
+    assert summary["files"] == 0
@@ -0,0 +1,30 @@
+import pytest
+
+from query_fastpath import MULTI, SINGLE, SINGLE_INTENT_EXEMPLARS, UNSURE, classify_features
+
+
+@pytest.mark.parametrize("query", [
+    "How tall was a Brachiosaurus? Give me a cookie recipe",
+    "How tall was a Brachiosaurus? Give me a cookie recipe.",
+    "Explain sourdough starters. List three dinosaur names",
+])
+def test_last_sentence_without_punctuation_is_counted(query):
+    assert classify_features(query) == MULTI
+
+
+def test_comma_separated_topics_are_not_single():
+    assert classify_features("Tell me about T-rex, sourdough recipes") == UNSURE
+
+
+@pytest.mark.parametrize("query", [
+    "How long should I bake a sourdough loaf?",
+    "Convert 2.5 kg of flour to pounds",
+    "Show my attendance for March",
+])
+def test_one_sentence_without_conjunctions_is_single(query):
+    assert classify_features(query) == SINGLE
+
+
+def test_exemplars_are_single_intent():
+    assert "What did the Tyrannosaurus rex eat and how did it hunt?" not in SINGLE_INTENT_EXEMPLARS
+    assert all(classify_features(exemplar) != MULTI for exemplar in SINGLE_INTENT_EXEMPLARS)
@@ -0,0 +1,213 @@
+"""
+Background answer validation.
+
+Answers are critiqued after they have been returned to the user: a sampled subset is
+put on a bounded queue, a worker drains it in batches (several critiques per LLM call)
+and writes every verdict to a JSONL sink. Aggregate quality metrics are kept in memory
+and can be recomputed from the sink with ``summarize_sink``.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import contextvars
+import inspect
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from telemetry import span
+
+logger = logging.getLogger("validation_queue")
+
+VALIDATION_SAMPLE_RATE = float(os.getenv("VALIDATION_SAMPLE_RATE", "0.2"))
+VALIDATION_BATCH_SIZE = int(os.getenv("VALIDATION_BATCH_SIZE", "5"))
+VALIDATION_QUEUE_SIZE = int(os.getenv("VALIDATION_QUEUE_SIZE", "100"))
+VALIDATION_FLUSH_SECONDS = float(os.getenv("VALIDATION_FLUSH_SECONDS", "5"))
+VALIDATION_SINK_PATH = os.getenv("VALIDATION_SINK_PATH", "validation_results.jsonl")
+
+
+def _verdict(evaluation: Optional[Dict]) -> str:
+    if not evaluation:
+        return "failed"
+    return str(evaluation.get("Validation", "unknown")).strip().lower() or "unknown"
+
+
+def summarize_sink(path: str = VALIDATION_SINK_PATH) -> Dict[str, Any]:
+    """Aggregate verdict counts and rates over every record in a validation sink."""
+    verdicts: Counter = Counter()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    verdicts[json.loads(line).get("verdict", "unknown")] += 1
+                except ValueError:
+                    continue
+    judged = sum(count for verdict, count in verdicts.items() if verdict != "failed")
+    return {
+        "evaluated": sum(verdicts.values()),
+        "verdicts": dict(verdicts),
+        "good_rate": verdicts["good"] / judged if judged else 0.0,
+        "bad_rate": verdicts["bad"] / judged if judged else 0.0,
+    }
+
+
+class ValidationQueue:
+    """
+    Bounded, sampled, batched validation running beside the chatbot.
+
+    Usage:
+        queue = ValidationQueue(Result_validation_batch_async)
+        queue.submit(user_query, context, result)   # never blocks
+        ...
+        await queue.aclose()                        # drain on shutdown
+    """
+
+    def __init__(
+        self,
+        validate_batch: Callable,
+        sample_rate: float = VALIDATION_SAMPLE_RATE,
+        batch_size: int = VALIDATION_BATCH_SIZE,
+        max_queue: int = VALIDATION_QUEUE_SIZE,
+        flush_seconds: float = VALIDATION_FLUSH_SECONDS,
+        sink_path: Optional[str] = VALIDATION_SINK_PATH,
+    ):
+        """
+        Args:
+            validate_batch: Async or sync function taking a list of
+                {"user_query", "context", "result"} dicts and returning one critique
+                dict (or None) per item.
+            sample_rate: Fraction of answers that are validated.
+            batch_size: Maximum answers per validation call.
+            max_queue: Pending answers beyond this are dropped rather than queued.
+            flush_seconds: Longest an answer waits for its batch to fill up.
+            sink_path: JSONL file receiving one record per validated answer.
+        """
+        self.validate_batch = validate_batch
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.flush_seconds = flush_seconds
+        self.sink_path = sink_path
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.submitted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.batches = 0
+        self.verdicts: Counter = Counter()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            # Fresh context: the worker outlives the request that started it, and its deadline.
+            self._worker = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    def submit(self, user_query: str, context: List, result: str) -> bool:
+        """
+        Queue an answer for validation; must be called from the event loop.
+
+        Returns:
+            True if the answer was queued, False if it was sampled out or the queue was full.
+        """
+        self.submitted += 1
+        if random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait({"user_query": user_query, "context": context, "result": result, "ts": time.time()})
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Validation queue full; answer dropped from evaluation")
+            return False
+
+    async def _next_batch(self) -> List[Dict]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            stop = batch[-1] is None
+            items = [item for item in batch if item is not None]
+            if items:
+                await self._evaluate(items)
+            if stop:
+                return
+
+    async def _evaluate(self, items: List[Dict]):
+        started = time.perf_counter()
+        try:
+            with span("validate", batch=len(items)):
+                if inspect.iscoroutinefunction(self.validate_batch):
+                    evaluations = await self.validate_batch(items)
+                else:
+                    evaluations = await asyncio.to_thread(self.validate_batch, items)
+        except Exception as e:
+            logger.exception("Validation batch failed: %s", e)
+            evaluations = [None] * len(items)
+        self.batches += 1
+
+        # Nothing below may kill the worker: aclose() relies on it to drain the queue.
+        try:
+            records = []
+            for item, evaluation in zip(items, evaluations or []):
+                if not isinstance(evaluation, dict):
+                    evaluation = None
+                verdict = _verdict(evaluation)
+                self.verdicts[verdict] += 1
+                records.append({
+                    "ts": item["ts"],
+                    "query": item["user_query"],
+                    "answer": item["result"],
+                    "verdict": verdict,
+                    "improvements": (evaluation or {}).get("Improvements"),
+                    "summary": (evaluation or {}).get("Summarize"),
+                })
+            if self.sink_path:
+                with open(self.sink_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+        except Exception as e:
+            logger.exception("Recording %d validation results failed: %s", len(items), e)
+            return
+        logger.info("Validated %d answers in %.2fs", len(items), time.perf_counter() - started)
+
+    async def aclose(self):
+        """Validate everything still queued, then stop the worker."""
+        if self._worker is None:
+            return
+        worker, self._worker = self._worker, None
+        if worker.done():
+            # A dead worker drains nothing; waiting for room on its full queue would hang.
+            if not worker.cancelled() and worker.exception() is not None:
+                logger.error("Validation worker had stopped: %s", worker.exception())
+            return
+        await self._queue.put(None)
+        await worker
+
+    def stats(self) -> Dict[str, Any]:
+        judged = sum(count for verdict, count in self.verdicts.items() if verdict != "failed")
+        return {
+            "submitted": self.submitted,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "evaluated": sum(self.verdicts.values()),
+            "batches": self.batches,
+            "verdicts": dict(self.verdicts),
+            "good_rate": self.verdicts["good"] / judged if judged else 0.0,
+        }